@@ -0,0 +1,21 @@
+"""Baseline nowcasting of hub target data that is still being reported."""
+
+from .nowcast import (
+    NOWCAST_MODEL,
+    DelayEstimate,
+    ReportingTriangle,
+    baseline_nowcasts,
+    estimate_delay,
+    nowcast_quantiles,
+    reporting_triangle,
+)
+
+__all__ = [
+    "NOWCAST_MODEL",
+    "DelayEstimate",
+    "ReportingTriangle",
+    "baseline_nowcasts",
+    "estimate_delay",
+    "nowcast_quantiles",
+    "reporting_triangle",
+]
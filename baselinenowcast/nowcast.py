@@ -0,0 +1,241 @@
+"""
+Vectorized baseline nowcasts of right-truncated hub target data.
+
+Hub target data (`connect_target_data(..., TargetType.TIME_SERIES)`) holds one row per
+(location, target, target_end_date, as_of) vintage. `reporting_triangle` arranges every
+series into one `(series, date, delay)` array of the value known `delay` weeks after each
+date; `estimate_delay` learns multiplicative completion factors from the most recent
+complete rows; `nowcast_quantiles` scales each date's latest value by the empirical
+quantiles of those factors. Every step is a NumPy operation over all series at once.
+"""
+
+import warnings
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+NOWCAST_MODEL = "RespiLens-baselinenowcast"
+
+HUBVERSE_COLUMNS = [
+    "location", "reference_date", "target", "model_id", "horizon",
+    "output_type", "output_type_id", "value", "target_end_date",
+]
+
+_WEEK = pd.Timedelta(days=7)
+
+
+@dataclass(frozen=True)
+class ReportingTriangle:
+    """
+    Reported values by series, date and reporting delay.
+
+    `values[s, t, k]` is what series `s` (a `series` row: location and target) reported for
+    `dates[t]` as of `k` weeks after it (delay `max_delay` holds everything reported later).
+    Cells that could not have been observed by `as_of`, or have no report yet, are NaN.
+    """
+
+    series: pd.DataFrame
+    dates: pd.DatetimeIndex
+    values: np.ndarray
+    as_of: pd.Timestamp
+
+    @property
+    def max_delay(self) -> int:
+        return self.values.shape[2] - 1
+
+    def current_delay(self) -> np.ndarray:
+        """Delay (in weeks) each date has reached by `as_of`."""
+        return ((self.as_of - self.dates) // _WEEK).to_numpy()
+
+
+@dataclass(frozen=True)
+class DelayEstimate:
+    """
+    Completion factors per series and delay, estimated from complete rows of a ReportingTriangle.
+
+    `multipliers[s, k]` is the ratio of final to delay-`k` totals. `log_ratio_quantiles[q, s, k]`
+    are the `levels` quantiles of per-date log(final / delay-`k` value), shifted so that their
+    median is log(`multipliers[s, k]`): the point nowcast comes from the totals and only the
+    spread around it from the per-date ratios.
+    """
+
+    multipliers: np.ndarray
+    levels: np.ndarray
+    log_ratio_quantiles: np.ndarray
+
+    @property
+    def cumulative_reported(self) -> np.ndarray:
+        """Expected share of the final value reported by each delay, `(series, max_delay + 1)`."""
+        with np.errstate(divide="ignore"):
+            shares = np.where(self.multipliers > 0, 1.0 / self.multipliers, np.nan)
+        return np.minimum(shares, 1.0)
+
+    @property
+    def delay_pmf(self) -> np.ndarray:
+        """Probability that a unit is first reported at each delay, `(series, max_delay + 1)`."""
+        return np.diff(np.maximum.accumulate(np.nan_to_num(self.cumulative_reported), axis=1), prepend=0.0, axis=1)
+
+
+def reporting_triangle(
+    target_data: pd.DataFrame,
+    max_delay: int = 4,
+    observation_column: str = "observation",
+    as_of: Optional[pd.Timestamp] = None,
+) -> ReportingTriangle:
+    """
+    Build the reporting triangle of every (location, target) series in one pass.
+
+    A vintage's delay is the number of whole weeks between `target_end_date` and `as_of`;
+    vintages older than `max_delay` weeks count as delay `max_delay`. Within a delay the
+    latest vintage wins, and a date keeps its last reported value until it is revised.
+    """
+    missing = {"location", "target", "target_end_date", "as_of", observation_column} - set(target_data.columns)
+    if missing:
+        raise ValueError(f"Target data needs `as_of` vintages to nowcast; missing columns {sorted(missing)}")
+    df = target_data[["location", "target", "target_end_date", "as_of", observation_column]].dropna()
+    dates = pd.to_datetime(df["target_end_date"])
+    vintages = pd.to_datetime(df["as_of"])
+    as_of = vintages.max() if as_of is None else pd.Timestamp(as_of)
+    delay = ((vintages - dates) // _WEEK).to_numpy()
+    keep = (delay >= 0) & (vintages <= as_of).to_numpy()
+
+    frame = pd.DataFrame({
+        "location": df["location"].astype(str).to_numpy()[keep],
+        "target": df["target"].astype(str).to_numpy()[keep],
+        "date": dates.to_numpy()[keep],
+        "delay": np.minimum(delay[keep], max_delay),
+        "as_of": vintages.to_numpy()[keep],
+        "value": pd.to_numeric(df[observation_column], errors="coerce").to_numpy(dtype=float)[keep],
+    }).sort_values("as_of", kind="stable")
+    series_codes = frame.groupby(["location", "target"], sort=True).ngroup().to_numpy()
+    series = frame[["location", "target"]].drop_duplicates().sort_values(["location", "target"]).reset_index(drop=True)
+    date_codes, date_values = pd.factorize(frame["date"], sort=True)
+    frame = frame.assign(s=series_codes, t=date_codes).drop_duplicates(["s", "t", "delay"], keep="last")
+
+    values = np.full((len(series), len(date_values), max_delay + 1), np.nan)
+    values[frame["s"].to_numpy(), frame["t"].to_numpy(), frame["delay"].to_numpy()] = frame["value"].to_numpy()
+    # carry each date's last report forward to later delays
+    last_reported = np.where(np.isnan(values), 0, np.arange(max_delay + 1))
+    np.maximum.accumulate(last_reported, axis=2, out=last_reported)
+    values = np.take_along_axis(values, last_reported, axis=2)
+
+    dates = pd.DatetimeIndex(date_values)
+    reached = ((as_of - dates) // _WEEK).to_numpy()
+    values[:, np.arange(max_delay + 1)[None, :] > reached[:, None]] = np.nan
+    return ReportingTriangle(series=series, dates=dates, values=values, as_of=as_of)
+
+
+def estimate_delay(
+    triangle: ReportingTriangle,
+    levels: Iterable[float] = (0.025, 0.25, 0.5, 0.75, 0.975),
+    n_history: int = 8,
+    min_samples: int = 3,
+) -> DelayEstimate:
+    """
+    Estimate completion factors from each series' `n_history` most recent complete dates.
+
+    Series with fewer than `min_samples` usable dates at a delay fall back to the factors and
+    quantiles pooled across every series.
+    """
+    values = triangle.values
+    final = values[:, :, -1:]
+    usable = ~np.isnan(values) & ~np.isnan(final) & (values > 0)
+    usable[:, :, -1] = False
+    # keep only the most recent `n_history` usable dates per series and delay
+    from_end = np.cumsum(usable[:, ::-1, :], axis=1)[:, ::-1, :]
+    usable &= from_end <= n_history
+
+    final_totals = np.where(usable, final, 0.0).sum(axis=1)
+    reported_totals = np.where(usable, values, 0.0).sum(axis=1)
+    pooled = np.divide(final_totals.sum(axis=0), reported_totals.sum(axis=0),
+                       out=np.ones(values.shape[2]), where=reported_totals.sum(axis=0) > 0)
+    counts = usable.sum(axis=1)
+    enough = counts >= min_samples
+    multipliers = np.where(enough, np.divide(final_totals, reported_totals, out=np.ones_like(final_totals),
+                                             where=reported_totals > 0), pooled)
+    multipliers[:, -1] = 1.0
+
+    levels = np.asarray(list(levels), dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratios = np.where(usable & (final > 0), np.log(final / values), np.nan)
+    spread = np.zeros((len(levels), values.shape[0], values.shape[2]))
+    if usable.any():
+        with_median = np.append(levels, 0.5)
+        per_series = _nanquantile(log_ratios, with_median, axis=1)
+        pooled_quantiles = _nanquantile(log_ratios.reshape(-1, values.shape[2]), with_median, axis=0)
+        log_quantiles = np.nan_to_num(np.where(enough[None, :, :], per_series, pooled_quantiles[:, None, :]))
+        spread = log_quantiles[:-1] - log_quantiles[-1:]
+    # centre the per-date spread on the ratio of totals, so the median nowcast is `latest * multipliers`
+    quantiles = np.log(multipliers)[None, :, :] + spread
+    quantiles[:, :, -1] = 0.0
+    return DelayEstimate(multipliers=multipliers, levels=levels, log_ratio_quantiles=quantiles)
+
+
+def _nanquantile(values: np.ndarray, levels: np.ndarray, axis: int) -> np.ndarray:
+    """`np.nanquantile` that returns NaN (instead of warning) for all-NaN slices."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanquantile(values, levels, axis=axis)
+
+
+def nowcast_quantiles(triangle: ReportingTriangle, estimate: DelayEstimate) -> pd.DataFrame:
+    """
+    Quantile nowcasts of every date still inside the reporting window (delay < `max_delay`).
+
+    Returns long rows `location`, `target`, `target_end_date`, `delay`, `quantile_level`, `value`.
+    """
+    reached = triangle.current_delay()
+    open_dates = np.flatnonzero((reached >= 0) & (reached < triangle.max_delay))
+    if not len(open_dates):
+        return pd.DataFrame(columns=["location", "target", "target_end_date", "delay", "quantile_level", "value"])
+    delays = reached[open_dates]
+    latest = triangle.values[:, open_dates, delays]  # (series, open date)
+    factors = np.exp(estimate.log_ratio_quantiles[:, :, delays])  # (level, series, open date)
+    nowcasts = np.maximum.accumulate(latest[None, :, :] * factors, axis=0)
+
+    level_index, series_index, date_index = np.nonzero(~np.isnan(nowcasts))
+    # one contiguous block of levels per series and date
+    order = np.lexsort((level_index, date_index, series_index))
+    level_index, series_index, date_index = level_index[order], series_index[order], date_index[order]
+    return pd.DataFrame({
+        "location": triangle.series["location"].to_numpy()[series_index],
+        "target": triangle.series["target"].to_numpy()[series_index],
+        "target_end_date": triangle.dates[open_dates][date_index],
+        "delay": delays[date_index],
+        "quantile_level": estimate.levels[level_index],
+        "value": nowcasts[level_index, series_index, date_index],
+    })
+
+
+def baseline_nowcasts(
+    target_data: pd.DataFrame,
+    quantile_levels: Iterable[float] = (0.025, 0.25, 0.5, 0.75, 0.975),
+    max_delay: int = 4,
+    n_history: int = 8,
+    observation_column: str = "observation",
+    model_id: str = NOWCAST_MODEL,
+) -> pd.DataFrame:
+    """
+    Nowcast every location and target in `target_data` as hubverse quantile rows for `model_id`.
+
+    The reference date is the Saturday on or after the latest `as_of`, so each nowcast date
+    gets a negative horizon (-1 for the week before the reference date).
+    """
+    triangle = reporting_triangle(target_data, max_delay=max_delay, observation_column=observation_column)
+    rows = nowcast_quantiles(triangle, estimate_delay(triangle, levels=quantile_levels, n_history=n_history))
+    reference_date = triangle.as_of.normalize() + pd.Timedelta(days=(5 - triangle.as_of.weekday()) % 7)
+    end_dates = pd.DatetimeIndex(rows["target_end_date"])
+    return pd.DataFrame({
+        "location": rows["location"],
+        "reference_date": reference_date.date(),
+        "target": rows["target"],
+        "model_id": model_id,
+        "horizon": ((end_dates - reference_date) // _WEEK).astype(int),
+        "output_type": "quantile",
+        "output_type_id": [str(level) for level in rows["quantile_level"]],
+        "value": rows["value"].to_numpy(),
+        "target_end_date": end_dates.date,
+    }, columns=HUBVERSE_COLUMNS)
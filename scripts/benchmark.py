@@ -0,0 +1,389 @@
+"""
+End-to-end benchmarks of the RespiLens build on synthetic data.
+
+`synthetic_hub` generates a hubverse model-output table, matching `as_of` target data and
+location metadata at any scale; `synthetic_nhsn` and `synthetic_nssp` generate CDC endpoint
+records. `run_benchmarks` times the preprocessor, every hub processor, the NHSN/NSSP processors
+(fed from the synthetic records instead of data.cdc.gov) and `save_json_file`, and the results
+are written as JSON so runs can be compared with `compare_results`.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import nhsn_data_processor
+import nssp_data_processor
+from external_data import ExternalInputs
+from helper import (
+    DEFAULT_CATEGORICAL_LEVELS,
+    DEFAULT_QUANTILE_LEVELS,
+    FLU_PEAK_TARGETS,
+    STATENAME_TO_ABBREVIATION_MAP,
+    clean_nan_values,
+    hubverse_df_preprocessor,
+    save_json_file,
+)
+from processors import COVIDDataProcessor, FluMetrocastDataProcessor, FlusightDataProcessor, RSVDataProcessor
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_LOCATION = Path(__file__).resolve().parent
+
+# Synthetic hub shape per named scale
+SCALES = {
+    "small": {"n_locations": 5, "n_models": 3, "n_reference_dates": 4},
+    "medium": {"n_locations": 53, "n_models": 10, "n_reference_dates": 20},
+    "large": {"n_locations": 53, "n_models": 30, "n_reference_dates": 60},
+}
+
+# Per-processor synthetic hub settings: (processor, pathogen for save_json_file, synthetic_hub kwargs)
+HUB_BENCHMARKS = {
+    "flusight": (FlusightDataProcessor, "flusight", {
+        "target": "wk inc flu hosp", "rate_change_target": "wk flu hosp rate change",
+        "peak_targets": FLU_PEAK_TARGETS,
+    }),
+    "rsv": (RSVDataProcessor, "rsvforecasthub", {
+        "target": "wk inc rsv hosp", "rate_change_target": None, "peak_targets": (),
+    }),
+    "covid": (COVIDDataProcessor, "covid19forecasthub", {
+        "target": "wk inc covid hosp", "rate_change_target": None, "peak_targets": (),
+    }),
+    "flu_metrocast": (FluMetrocastDataProcessor, "flumetrocast", {
+        "target": "Flu ED visits pct", "rate_change_target": None, "peak_targets": (),
+        "first_reference_date": "2025-11-22", "metrocast": True,
+    }),
+}
+
+# MetroCast locations are state slugs plus numeric HSA ids
+METROCAST_STATES = {"colorado": "08", "georgia": "13", "maryland": "24", "north-carolina": "37", "virginia": "51"}
+
+NHSN_SERIES_COLUMNS = ("totalconfflunewadm", "totalconfc19newadm", "totalconfrsvnewadm")
+NSSP_SERIES_COLUMNS = ("percent_visits_covid", "percent_visits_influenza", "percent_visits_rsv")
+
+
+def synthetic_hub(
+    n_locations: int = 5,
+    n_models: int = 3,
+    n_reference_dates: int = 4,
+    horizons: Sequence[int] = (-1, 0, 1, 2, 3),
+    quantile_levels: Sequence[float] = DEFAULT_QUANTILE_LEVELS,
+    peak_targets: Tuple[Tuple[str, str], ...] = FLU_PEAK_TARGETS,
+    target: str = "wk inc flu hosp",
+    rate_change_target: Optional[str] = "wk flu hosp rate change",
+    samples: int = 0,
+    target_weeks: int = 104,
+    first_reference_date: str = "2024-11-02",
+    metrocast: bool = False,
+    seed: int = 0,
+) -> ExternalInputs:
+    """
+    Generate raw hubverse model output with matching target data and location metadata.
+
+    Every model submits every reference date, location and horizon: `quantile_levels` for
+    `target`, the categorical levels for `rate_change_target` (if any), `samples` sample rows,
+    and for each `peak_targets` entry either quantiles (peak size) or a four-week pmf (peak week).
+    Target data holds `target_weeks` weeks per location, each reported in two `as_of` vintages.
+    """
+    rng = np.random.default_rng(seed)
+    locations_data = _synthetic_locations(n_locations, metrocast)
+    locations = locations_data["location"].to_numpy(dtype=object)
+    models = np.array([f"team{i}-model" for i in range(n_models)], dtype=object)
+    reference_dates = pd.date_range(first_reference_date, periods=n_reference_dates, freq="7D")
+    horizons = np.asarray(horizons, dtype=int)
+
+    # one block of rows per (location, model, reference date, horizon)
+    grid = pd.MultiIndex.from_product(
+        [locations, models, reference_dates, horizons], names=["location", "model_id", "reference_date", "horizon"]
+    ).to_frame(index=False)
+    grid["target_end_date"] = grid["reference_date"] + pd.to_timedelta(grid["horizon"] * 7, unit="D")
+    levels = np.asarray(quantile_levels, dtype=float)
+    scale = rng.uniform(10, 1000, size=len(grid))
+    blocks = [_expand(grid, target, "quantile", [str(q) for q in levels], np.outer(scale, 0.5 + levels))]
+    if rate_change_target:
+        categories = list(DEFAULT_CATEGORICAL_LEVELS)
+        probabilities = rng.dirichlet(np.ones(len(categories)), size=len(grid))
+        blocks.append(_expand(grid, rate_change_target, "pmf", categories, probabilities))
+    if samples:
+        draws = scale[:, None] * rng.lognormal(0, 0.2, size=(len(grid), samples))
+        blocks.append(_expand(grid, target, "sample", [str(s) for s in range(samples)], draws))
+
+    peak_grid = grid.drop_duplicates(["location", "model_id", "reference_date"])[
+        ["location", "model_id", "reference_date"]
+    ].reset_index(drop=True)
+    peak_grid["horizon"] = np.nan
+    peak_grid["target_end_date"] = pd.NaT
+    for peak_target, output_type in peak_targets:
+        if output_type == "quantile":
+            values = np.outer(rng.uniform(100, 5000, size=len(peak_grid)), 0.5 + levels)
+            blocks.append(_expand(peak_grid, peak_target, "quantile", [str(q) for q in levels], values))
+        else:
+            weeks = [d.date().isoformat() for d in pd.date_range(reference_dates[0] + pd.Timedelta(days=28), periods=4, freq="7D")]
+            blocks.append(_expand(peak_grid, peak_target, "pmf", weeks, rng.dirichlet(np.ones(4), size=len(peak_grid))))
+
+    data = pd.concat(blocks, ignore_index=True)
+    data["reference_date"] = data["reference_date"].dt.date
+    data["target_end_date"] = data["target_end_date"].dt.date
+
+    weeks = pd.date_range(end=reference_dates[-1] - pd.Timedelta(days=7), periods=target_weeks, freq="7D")
+    truth = pd.MultiIndex.from_product([locations, weeks], names=["location", "target_end_date"]).to_frame(index=False)
+    first = rng.integers(0, 500, size=len(truth)).astype(float)
+    revised = first + rng.integers(0, 20, size=len(truth))
+    target_data = pd.concat([
+        truth.assign(as_of=truth["target_end_date"] + pd.Timedelta(days=4), observation=first),
+        truth.assign(as_of=truth["target_end_date"] + pd.Timedelta(days=11), observation=revised),
+    ], ignore_index=True)
+    target_data["target"] = target
+    target_data["as_of"] = target_data["as_of"].dt.date
+    target_data["target_end_date"] = target_data["target_end_date"].dt.date
+    return ExternalInputs(data=data, target_data=target_data, locations_data=locations_data)
+
+
+def _expand(grid: pd.DataFrame, target: str, output_type: str, output_type_ids: List[str], values: np.ndarray) -> pd.DataFrame:
+    """Repeat every grid row once per `output_type_id`, with `values[row, id]` as the value column."""
+    block = grid.loc[grid.index.repeat(len(output_type_ids))].reset_index(drop=True)
+    block["target"] = target
+    block["output_type"] = output_type
+    block["output_type_id"] = np.tile(np.asarray(output_type_ids, dtype=object), len(grid))
+    block["value"] = values.ravel()
+    return block
+
+
+def _synthetic_locations(n_locations: int, metrocast: bool) -> pd.DataFrame:
+    if not metrocast:
+        locations = pd.read_csv(SCRIPT_LOCATION / "locations.csv", dtype={"location": str})
+        return clean_nan_values(locations.head(n_locations).reset_index(drop=True))
+    states = list(METROCAST_STATES)
+    hsa_ids = [str(700 + i) for i in range(max(0, n_locations - len(states)))]
+    slugs = (states + hsa_ids)[:n_locations]
+    return pd.DataFrame({
+        "location": slugs,
+        "original_location_code": [METROCAST_STATES.get(slug, slug) for slug in slugs],
+        "location_name": [slug.replace("-", " ").title() if slug in METROCAST_STATES else f"HSA {slug}" for slug in slugs],
+        "population": np.arange(1, len(slugs) + 1) * 100000,
+    })
+
+
+def synthetic_nhsn(n_weeks: int = 104, seed: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Generate NHSN endpoint records for every jurisdiction and the matching CDC column metadata."""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(end="2025-05-31", periods=n_weeks, freq="7D").strftime("%Y-%m-%dT00:00:00.000")
+    jurisdictions = list(nhsn_data_processor.LOCATIONS_ABBREV[:-1]) + ["USA"]
+    records = [
+        {"jurisdiction": jurisdiction, "weekendingdate": week, "respseason": "2024-25",
+         **{column: str(int(value)) for column, value in zip(NHSN_SERIES_COLUMNS, rng.integers(0, 5000, size=len(NHSN_SERIES_COLUMNS)))}}
+        for jurisdiction in jurisdictions for week in weeks
+    ]
+    metadata = {"columns": [
+        {"fieldName": "jurisdiction", "name": "Geographic aggregation"},
+        {"fieldName": "weekendingdate", "name": "Week Ending Date"},
+        *({"fieldName": column, "name": f"Column {column}"} for column in NHSN_SERIES_COLUMNS),
+    ]}
+    return records, metadata
+
+
+def synthetic_nssp(hsas_per_state: int = 5, n_weeks: int = 104, seed: int = 0) -> List[Dict[str, Any]]:
+    """Generate NSSP endpoint records (one build) for `hsas_per_state` HSAs in every state."""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(end="2025-05-31", periods=n_weeks, freq="7D").strftime("%Y-%m-%dT00:00:00.000")
+    states = [name for name, abbreviation in STATENAME_TO_ABBREVIATION_MAP.items() if abbreviation != "US"]
+    records = []
+    for state_index, state in enumerate(states):
+        for hsa in range(hsas_per_state):
+            hsa_id = str(state_index * 100 + hsa)
+            for week in weeks:
+                records.append({
+                    "week_end": week, "geography": state, "hsa_nci_id": hsa_id, "hsa_counties": f"County {hsa_id}",
+                    "buildnumber": "2025-06-01", "hsa": hsa_id,
+                    **{column: f"{value:.2f}" for column, value in zip(NSSP_SERIES_COLUMNS, rng.uniform(0, 10, size=3))},
+                })
+    return records
+
+
+@contextmanager
+def cdc_fixtures(records: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+    """Serve `records` (and `metadata`) to the NHSN/NSSP processors in place of the CDC endpoints."""
+    response = mock.Mock()
+    response.json.return_value = metadata
+    with mock.patch.object(nhsn_data_processor, "retrieve_data_from_endpoint_aslist", return_value=records), \
+            mock.patch.object(nssp_data_processor, "retrieve_data_from_endpoint_aslist", return_value=records), \
+            mock.patch.object(nhsn_data_processor.requests, "get", return_value=response):
+        yield
+
+
+def time_call(function: Callable[[], Any], repeat: int = 3) -> Tuple[Dict[str, float], Any]:
+    """Run `function` `repeat` times and return (timing summary in seconds, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    summary = {"min": min(timings), "median": statistics.median(timings), "max": max(timings)}
+    return {name: round(value, 6) for name, value in summary.items()}, result
+
+
+def run_benchmarks(
+    scale: str = "small",
+    repeat: int = 3,
+    hubs: Optional[Sequence[str]] = None,
+    include_cdc: bool = True,
+    seed: int = 0,
+    **synthetic_options: Any,
+) -> Dict[str, Any]:
+    """
+    Time every build stage on synthetic inputs of the given scale.
+
+    Each benchmark records `seconds` (min/median/max over `repeat` runs) and its input size,
+    e.g. `rows` or `files`. `synthetic_options` override the `SCALES` entry, so
+    `run_benchmarks(n_models=50)` stresses the model dimension.
+    """
+    shape = {**SCALES[scale], **synthetic_options}
+    benchmarks: Dict[str, Dict[str, Any]] = {}
+
+    for name in hubs or HUB_BENCHMARKS:
+        processor_class, pathogen, hub_options = HUB_BENCHMARKS[name]
+        inputs = synthetic_hub(**{**hub_options, **shape}, seed=seed)
+        config = processor_class.config
+        seconds, preprocessed = time_call(
+            lambda: clean_nan_values(hubverse_df_preprocessor(
+                inputs.data,
+                quantile_levels=config.quantile_levels,
+                categorical_levels=config.categorical_levels,
+                drop_output_types=config.drop_output_types,
+                peak_targets=config.peak_targets,
+            )),
+            repeat,
+        )
+        benchmarks[f"{name}.preprocess"] = {"seconds": seconds, "rows": len(inputs.data), "rows_out": len(preprocessed)}
+
+        seconds, processor = time_call(
+            lambda: processor_class(
+                data=preprocessed, locations_data=inputs.locations_data, target_data=clean_nan_values(inputs.target_data)
+            ),
+            repeat,
+        )
+        benchmarks[f"{name}.process"] = {"seconds": seconds, "rows": len(preprocessed), "files": len(processor.output_dict)}
+        benchmarks[f"{name}.save_json"] = _benchmark_save(processor.output_dict, pathogen, repeat)
+
+    if include_cdc:
+        records, metadata = synthetic_nhsn(seed=seed)
+        with cdc_fixtures(records, metadata):
+            seconds, nhsn = time_call(lambda: nhsn_data_processor.NHSNDataProcessor(resource_id="synthetic"), repeat)
+        benchmarks["nhsn.process"] = {"seconds": seconds, "rows": len(records), "files": len(nhsn.output_dict)}
+        benchmarks["nhsn.save_json"] = _benchmark_save(nhsn.output_dict, "nhsn", repeat)
+
+        records = synthetic_nssp(seed=seed)
+        with cdc_fixtures(records):
+            seconds, nssp = time_call(lambda: nssp_data_processor.NSSPDataProcessor(resource_id="synthetic"), repeat)
+        benchmarks["nssp.process"] = {"seconds": seconds, "rows": len(records), "files": len(nssp.output_dict)}
+        benchmarks["nssp.save_json"] = _benchmark_save(nssp.output_dict, "nssp", repeat)
+
+    return {
+        "created": pd.Timestamp.now(tz='UTC').strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "scale": scale,
+        "shape": shape,
+        "repeat": repeat,
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "benchmarks": benchmarks,
+    }
+
+
+def _benchmark_save(output_dict: Dict[str, Any], pathogen: str, repeat: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as output_path:
+        def save_all() -> None:
+            for filename, contents in output_dict.items():
+                save_json_file(
+                    pathogen=pathogen, output_path=output_path, output_filename=filename,
+                    file_contents=contents, overwrite=True,
+                )
+        seconds, _ = time_call(save_all, repeat)
+        size = sum(path.stat().st_size for path in Path(output_path).rglob("*.json"))
+    return {"seconds": seconds, "files": len(output_dict), "bytes": size}
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.25) -> List[Dict[str, Any]]:
+    """
+    List benchmarks whose median time grew by more than `threshold` (a fraction) over `baseline`.
+
+    Benchmarks missing from either run are ignored.
+    """
+    regressions = []
+    for name, result in current["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None or not previous["seconds"]["median"]:
+            continue
+        ratio = result["seconds"]["median"] / previous["seconds"]["median"]
+        if ratio > 1 + threshold:
+            regressions.append({
+                "benchmark": name,
+                "baseline_seconds": previous["seconds"]["median"],
+                "seconds": result["seconds"]["median"],
+                "ratio": round(ratio, 3),
+            })
+    return regressions
+
+
+def main():
+    """
+    Main execution function
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the RespiLens build on synthetic hub and CDC data.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small", help="Synthetic hub size.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark (min/median/max are reported).")
+    parser.add_argument("--hubs", nargs="+", choices=list(HUB_BENCHMARKS), help="Hub processors to benchmark (default: all).")
+    parser.add_argument("--skip-cdc", action="store_true", help="Skip the NHSN and NSSP benchmarks.")
+    parser.add_argument("--locations", type=int, help="Override the number of locations.")
+    parser.add_argument("--models", type=int, help="Override the number of models.")
+    parser.add_argument("--reference-dates", type=int, help="Override the number of reference dates.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    parser.add_argument("--output", type=str, help="Path to write the JSON results to.")
+    parser.add_argument("--baseline", type=str, help="Results JSON from an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="With --baseline, fail if any median time grew by more than this fraction.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    overrides = {
+        key: value for key, value in (
+            ("n_locations", args.locations), ("n_models", args.models), ("n_reference_dates", args.reference_dates),
+        ) if value is not None
+    }
+    results = run_benchmarks(
+        scale=args.scale, repeat=args.repeat, hubs=args.hubs, include_cdc=not args.skip_cdc, seed=args.seed, **overrides,
+    )
+    for name, result in results["benchmarks"].items():
+        print(f"{name:28s} {result['seconds']['median']:10.4f}s")
+    if args.output:
+        with open(args.output, "w") as of:
+            json.dump(results, of, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, threshold=args.threshold)
+        for regression in regressions:
+            print(f"🛑 {regression['benchmark']} regressed: {regression['baseline_seconds']:.4f}s -> "
+                  f"{regression['seconds']:.4f}s ({regression['ratio']}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No benchmark regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
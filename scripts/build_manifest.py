@@ -0,0 +1,257 @@
+"""
+Content-addressed output names and the per-build manifest that maps logical names to them.
+
+With `process_RespiLens_data.py --content-addressed`, every payload is written as
+`{stem}.{hash}.{suffix}` next to where its logical name (e.g. `flusight/CA_flu.json`)
+would be, with `hash` the leading HASH_LENGTH characters of `helper.payload_digest`.
+The digest ignores the `last_updated` build timestamp, so a payload that did not change
+keeps its file name from build to build; a hashed file is never rewritten, so its contents
+never change and it can be cached forever. `manifest.json` at the top of the output path
+is the only file that changes every build:
+
+    {
+        "schema_version": "manifest-1",
+        "build_id": "20250104T120000123456Z",
+        "previous_build_id": "20250103T120000654321Z",
+        "created": "2025-01-04T12:00:00Z",
+        "files": {
+            "flusight/CA_flu.json": {"path": "flusight/CA_flu.3f2a9c01d4e5b6a7.json", "size": 81234, "hash": "3f2a9c01..."}
+        }
+    }
+
+File names inside payloads (e.g. sharded `index.json` shard names) stay logical and are
+resolved through the manifest.
+
+With `delta_max_ratio` (`--deltas`), every payload whose hash changed is also diffed against
+the previous build's file (see `deltas`). If the patch is at most `delta_max_ratio` times the
+new file's size, it is written as `deltas/{stem}.{from}.{to}.json` under the dataset
+directory and its manifest entry gains `"delta": {"from": ..., "path": ..., "size": ...}`,
+so a client holding the `from` version can fetch the patch instead of the file.
+
+Every written manifest is also kept as `manifests/{build_id}.json`. After writing, only the
+last `keep_builds` manifests are kept, and hashed payloads and patches under the dataset
+directories that none of them reference are deleted, so clients holding a recent manifest
+can still fetch its files while the output tree stops growing with every build.
+"""
+
+import json
+import os
+import re
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Optional, Set, Union
+
+import pandas as pd
+
+from deltas import build_delta
+from helper import save_json_file, payload_digest, OUTPUT_DIR_MAP
+from instrumentation import span
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_SCHEMA_VERSION = "manifest-1"
+HASH_LENGTH = 16
+DELTA_DIRECTORY = "deltas"
+HISTORY_DIRECTORY = "manifests"
+KEEP_BUILDS = 3
+# `{stem}.{hash}.json` payloads and `deltas/{stem}.{from}.{to}.json` patches; other files are never removed
+HASHED_FILE = re.compile(rf".+\.[0-9a-f]{{{HASH_LENGTH}}}\.json")
+
+
+def hashed_filename(filename: str, digest: str) -> str:
+    """`CA_flu.json` -> `CA_flu.{digest[:HASH_LENGTH]}.json` (sharded names keep their directory)."""
+    path = PurePosixPath(filename)
+    return str(path.with_name(f"{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}"))
+
+
+class BuildManifest:
+    """
+    Write payloads under content-addressed names and record them for this build's manifest.
+
+    The previous `manifest.json` (if any) is loaded first, so datasets that are not rebuilt
+    keep their entries; `save_dataset` replaces every entry of the dataset it writes (or, with
+    `partial=True`, only the entries of the files it is given). `write` keeps the files of
+    the last `keep_builds` manifests and removes older hashed files.
+    """
+
+    def __init__(
+        self,
+        output_path: Union[str, Path],
+        build_id: Optional[str] = None,
+        delta_max_ratio: Optional[float] = None,
+        keep_builds: int = KEEP_BUILDS,
+    ) -> None:
+        if keep_builds < 1:
+            raise ValueError(f"`keep_builds` must be at least 1, received {keep_builds}")
+        self.output_path = Path(output_path)
+        self.delta_max_ratio = delta_max_ratio
+        self.keep_builds = keep_builds
+        self.path = self.output_path / MANIFEST_FILENAME
+        self.history_path = self.output_path / HISTORY_DIRECTORY
+        self.previous: Dict[str, Any] = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.files: Dict[str, Dict[str, Any]] = dict(self.previous.get("files", {}))
+        self.build_id = build_id
+
+    def save_dataset(
+        self,
+        pathogen: str,
+        outputs: Dict[str, Any],
+        indent: Optional[int] = 4,
+        partial: bool = False,
+    ) -> Dict[str, int]:
+        """
+        Save every output of one dataset under its hashed name, replacing the dataset's manifest entries.
+
+        With `partial=True`, `outputs` are only some of the dataset's files (e.g. a --watch rebuild
+        of a few locations) and the entries of its other files are kept.
+
+        Returns counts of files `written`, `unchanged` (already present under the same name) and `deltas`.
+        """
+        directory = OUTPUT_DIR_MAP[pathogen]
+        prefix = f"{directory}/"
+        files = {name: entry for name, entry in self.files.items() if partial or not name.startswith(prefix)}
+        counts = {"written": 0, "unchanged": 0, "deltas": 0}
+        for filename, contents in outputs.items():
+            digest = payload_digest(contents)
+            hashed = hashed_filename(filename, digest)
+            file_path = self.output_path / directory / hashed
+            previous = self.previous_entry(prefix + filename)
+            if previous is not None and previous["hash"] == digest and file_path.exists():
+                files[prefix + filename] = previous # keeps the delta from the build before, if any
+                counts["unchanged"] += 1
+                continue
+            if file_path.exists():
+                counts["unchanged"] += 1
+            else:
+                save_json_file(
+                    pathogen=pathogen,
+                    output_path=str(self.output_path),
+                    output_filename=hashed,
+                    file_contents=contents,
+                    overwrite=False,
+                    indent=indent,
+                )
+                counts["written"] += 1
+            entry = {"path": prefix + hashed, "size": file_path.stat().st_size, "hash": digest}
+            if self.delta_max_ratio is not None and previous is not None:
+                delta_entry = self._save_delta(pathogen, filename, previous, contents, entry)
+                if delta_entry is not None:
+                    entry["delta"] = delta_entry
+                    counts["deltas"] += 1
+            files[prefix + filename] = entry
+        self.files = files
+        return counts
+
+    def _save_delta(
+        self,
+        pathogen: str,
+        filename: str,
+        previous: Dict[str, Any],
+        contents: Dict[str, Any],
+        entry: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        """Write the patch from the previous build's version of a file, if it is small enough."""
+        previous_path = self.output_path / previous["path"]
+        if not previous_path.exists():
+            return None
+        with span("deltas", files=1) as timing:
+            with previous_path.open() as handle:
+                old = json.load(handle)
+            delta = build_delta(
+                old,
+                contents,
+                file=f"{OUTPUT_DIR_MAP[pathogen]}/{filename}",
+                from_hash=previous["hash"],
+                to_hash=entry["hash"],
+                max_bytes=int(entry["size"] * self.delta_max_ratio),
+            )
+            if delta is None:
+                return None
+            path = PurePosixPath(DELTA_DIRECTORY) / filename
+            delta_filename = str(path.with_name(
+                f"{path.stem}.{previous['hash'][:HASH_LENGTH]}.{entry['hash'][:HASH_LENGTH]}{path.suffix}"
+            ))
+            save_json_file(
+                pathogen=pathogen,
+                output_path=str(self.output_path),
+                output_filename=delta_filename,
+                file_contents=delta,
+                overwrite=True,
+                indent=None,
+            )
+            delta_path = self.output_path / OUTPUT_DIR_MAP[pathogen] / delta_filename
+            if timing.enabled:
+                timing.add(bytes=delta_path.stat().st_size)
+        return {
+            "from": previous["hash"],
+            "path": f"{OUTPUT_DIR_MAP[pathogen]}/{delta_filename}",
+            "size": delta_path.stat().st_size,
+        }
+
+    def previous_entry(self, logical_name: str) -> Optional[Dict[str, Any]]:
+        """The previous build's manifest entry for a logical name, if it had one."""
+        return self.previous.get("files", {}).get(logical_name)
+
+    def as_dict(self) -> Dict[str, Any]:
+        now = pd.Timestamp.now(tz="UTC")
+        return {
+            "schema_version": MANIFEST_SCHEMA_VERSION,
+            "build_id": self.build_id or now.strftime("%Y%m%dT%H%M%S%fZ"),
+            "previous_build_id": self.previous.get("build_id"),
+            "created": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "files": dict(sorted(self.files.items())),
+        }
+
+    def write(self) -> Dict[str, Any]:
+        """
+        Atomically replace `manifest.json`, then prune files older builds alone referenced; returns what was written.
+
+        The written manifest becomes `previous` for the next build (e.g. the next --watch rebuild).
+        """
+        manifest = self.as_dict()
+        self.history_path.mkdir(parents=True, exist_ok=True)
+        if self.previous.get("build_id"): # a manifest written before the history was kept
+            previous_path = self.history_path / f"{self.previous['build_id']}.json"
+            if not previous_path.exists():
+                previous_path.write_text(json.dumps(self.previous))
+        (self.history_path / f"{manifest['build_id']}.json").write_text(json.dumps(manifest))
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(json.dumps(manifest, indent=2))
+        os.replace(temporary, self.path)
+        self.previous, self.build_id = manifest, None
+        self.prune()
+        return manifest
+
+    def prune(self) -> int:
+        """
+        Drop all but the last `keep_builds` manifests from the history and delete hashed files none of them reference.
+
+        Only files named like hashed payloads or patches, under directories the kept manifests
+        write to, are considered. Returns the number of files deleted.
+        """
+        with span("retention") as timing:
+            history = sorted(self.history_path.glob("*.json")) # build ids sort by time
+            kept = history[-self.keep_builds:]
+            for stale in history[:-self.keep_builds]:
+                stale.unlink()
+            referenced: Set[str] = set()
+            for manifest_path in kept:
+                referenced.update(manifest_files(json.loads(manifest_path.read_text())))
+            removed = 0
+            for directory in sorted({PurePosixPath(path).parts[0] for path in referenced}):
+                for file_path in (self.output_path / directory).rglob("*.json"):
+                    relative = file_path.relative_to(self.output_path).as_posix()
+                    if relative not in referenced and HASHED_FILE.fullmatch(file_path.name):
+                        file_path.unlink()
+                        removed += 1
+            if timing.enabled:
+                timing.add(files=removed)
+        return removed
+
+
+def manifest_files(manifest: Dict[str, Any]) -> Set[str]:
+    """Every path a manifest points clients to: its hashed payloads and their patches."""
+    paths = set()
+    for entry in manifest.get("files", {}).values():
+        paths.add(entry["path"])
+        if "delta" in entry:
+            paths.add(entry["delta"]["path"])
+    return paths
@@ -0,0 +1,110 @@
+"""
+Build-to-build structural patches of JSON payloads.
+
+`diff_payload(old, new)` walks both payloads once and returns a list of operations that
+turn `old` into `new`. Objects are compared key by key; an array whose old contents are a
+prefix of the new one (e.g. a ground truth series that gained a week) becomes one `extend`
+operation, and any other changed array or value is replaced whole. Each node is compared at
+most once, so diffing is linear in the payload size. Operations use JSON Pointer paths:
+
+    {"op": "add", "path": "/forecasts/2025-01-04", "value": {...}}   new object key
+    {"op": "remove", "path": "/forecasts/2024-10-05"}                 dropped object key
+    {"op": "replace", "path": "/metadata/last_updated", "value": ...} changed value
+    {"op": "extend", "path": "/ground_truth/dates", "value": [...]}   appended array items
+
+`add`, `remove` and `replace` follow RFC 6902; `extend` appends `value`'s items to the array
+at `path`. `apply_delta` is the reference implementation of applying a delta.
+"""
+
+import copy
+import json
+from typing import Any, Dict, List, Optional
+
+from helper import payload_digest
+
+DELTA_SCHEMA_VERSION = "delta-1"
+
+
+def diff_payload(old: Any, new: Any) -> List[Dict[str, Any]]:
+    """Operations that turn `old` into `new` (empty if they are equal)."""
+    operations: List[Dict[str, Any]] = []
+    _diff(old, new, "", operations)
+    return operations
+
+
+def _diff(old: Any, new: Any, path: str, operations: List[Dict[str, Any]]) -> None:
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                operations.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key in old:
+                _diff(old[key], value, child, operations)
+            else:
+                operations.append({"op": "add", "path": child, "value": value})
+    elif isinstance(old, list) and isinstance(new, list):
+        if len(new) >= len(old) and new[:len(old)] == old:
+            if len(new) > len(old):
+                operations.append({"op": "extend", "path": path, "value": new[len(old):]})
+        else:
+            operations.append({"op": "replace", "path": path, "value": new})
+    elif type(old) is not type(new) or old != new:
+        operations.append({"op": "replace", "path": path, "value": new})
+
+
+def apply_delta(payload: Any, delta: Dict[str, Any]) -> Any:
+    """Apply a delta's operations to (a copy of) `payload` and return the result."""
+    payload = copy.deepcopy(payload)
+    for operation in delta["ops"]:
+        tokens = [_unescape(token) for token in operation["path"].split("/")[1:]]
+        if not tokens:
+            payload = operation["value"] # only `replace` can target the whole payload
+            continue
+        parent = payload
+        for token in tokens[:-1]:
+            parent = parent[int(token) if isinstance(parent, list) else token]
+        key = int(tokens[-1]) if isinstance(parent, list) else tokens[-1]
+        if operation["op"] == "remove":
+            del parent[key]
+        elif operation["op"] == "extend":
+            parent[key].extend(operation["value"])
+        else:
+            parent[key] = operation["value"]
+    return payload
+
+
+def build_delta(
+    old: Any,
+    new: Any,
+    file: str,
+    from_hash: str,
+    to_hash: str,
+    max_bytes: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    The delta document patching `file` from content hash `from_hash` to `to_hash`.
+
+    Returns None when the serialized delta would be larger than `max_bytes`, or when applying
+    it does not reproduce `to_hash` (e.g. new object keys that are not appended at the end).
+    """
+    delta = {
+        "schema_version": DELTA_SCHEMA_VERSION,
+        "file": file,
+        "from": from_hash,
+        "to": to_hash,
+        "ops": diff_payload(old, new),
+    }
+    if max_bytes is not None and len(json.dumps(delta, separators=(",", ":"))) > max_bytes:
+        return None
+    if payload_digest(apply_delta(old, delta)) != to_hash:
+        return None
+    return delta
+
+
+def _escape(key: Any) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
@@ -4,13 +4,20 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, Optional, Set
+from typing import Callable, Dict, Iterable, Optional, Set
+import csv
 import logging
 
 import pandas as pd
 
 from helper import clean_nan_values, hubverse_df_preprocessor
 
+try:  # optional: the multithreaded Arrow CSV reader
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:  # `_read_csv` falls back to `pd.read_csv`
+    pa = pa_csv = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +55,36 @@ PATHOGEN_TARGET_REQUIREMENTS: Dict[str, Set[str]] = {
 
 LOCATION_REQUIRED_COLUMNS: Set[str] = {"location", "abbreviation", "location_name", "population"}
 
+# Declared dtypes for the fast CSV path (no type inference). Dates and `output_type_id`
+# stay strings; the preprocessor and processors parse them where needed.
+FORECAST_COLUMN_DTYPES: Dict[str, str] = {
+    "location": "string",
+    "reference_date": "string",
+    "target": "string",
+    "model_id": "string",
+    "horizon": "float64",
+    "output_type": "string",
+    "output_type_id": "string",
+    "value": "float64",
+    "target_end_date": "string",
+}
+
+LOCATION_COLUMN_DTYPES: Dict[str, str] = {
+    "location": "string",
+    "abbreviation": "string",
+    "location_name": "string",
+}
+
+PARQUET_SUFFIXES: Set[str] = {".parquet", ".pq"}
+
+
+@dataclass(frozen=True)
+class SharedInputs:
+    """Target data and location metadata, which can be shared by every submission for one pathogen."""
+
+    target_data: pd.DataFrame
+    locations_data: pd.DataFrame
+
 
 def load_inputs(
     pathogen: str,
@@ -57,27 +94,73 @@ def load_inputs(
     *,
     filter_quantiles: bool = True,
     filter_nowcasts: bool = True,
+    preprocess: Optional[Callable[..., pd.DataFrame]] = None,
 ) -> ExternalInputs:
     """Load and validate the three core datasets required to build RespiLens projections."""
 
+    shared = load_shared_inputs(pathogen, target_data_path, locations_data_path)
+    data = load_forecast_inputs(
+        data_path,
+        shared.locations_data,
+        locations_data_path,
+        filter_quantiles=filter_quantiles,
+        filter_nowcasts=filter_nowcasts,
+        preprocess=preprocess,
+    )
+
+    return ExternalInputs(
+        data=data,
+        target_data=shared.target_data,
+        locations_data=shared.locations_data,
+    )
+
+
+def load_shared_inputs(pathogen: str, target_data_path: Path, locations_data_path: Path) -> SharedInputs:
+    """Load and validate the target data and location metadata for a pathogen."""
+
     _validate_pathogen(pathogen)
 
-    forecast_df = _load_forecast_data(data_path)
     target_df = _load_target_data(target_data_path, pathogen)
     locations_df = _load_locations_data(locations_data_path)
 
-    _validate_forecast_columns(forecast_df, FORECAST_REQUIRED_COLUMNS, data_path)
     _validate_target_columns(target_df, PATHOGEN_TARGET_REQUIREMENTS[pathogen], target_data_path)
     _validate_location_columns(locations_df, LOCATION_REQUIRED_COLUMNS, locations_data_path)
-    _validate_location_coverage(forecast_df, locations_df, data_path, locations_data_path)
-
-    processed_data = hubverse_df_preprocessor(forecast_df, filter_quantiles=filter_quantiles, filter_nowcasts=filter_nowcasts)
 
-    return ExternalInputs(
-        data=clean_nan_values(processed_data),
+    return SharedInputs(
         target_data=clean_nan_values(target_df),
         locations_data=clean_nan_values(locations_df),
     )
+
+
+def load_forecast_inputs(
+    data_path: Path,
+    locations_data: pd.DataFrame,
+    locations_data_path: Path,
+    *,
+    filter_quantiles: bool = True,
+    filter_nowcasts: bool = True,
+    preprocess: Optional[Callable[..., pd.DataFrame]] = None,
+) -> pd.DataFrame:
+    """
+    Load, validate and preprocess one forecast submission against already-loaded location metadata.
+
+    `preprocess` is normally the target processor's `config.preprocess`, so the submission keeps the
+    quantile levels, output types and peak targets of its dataset; it is called with `filter_nowcasts`.
+    Without it, `hubverse_df_preprocessor` runs with its defaults and `filter_quantiles`.
+    """
+
+    forecast_df = _load_forecast_data(data_path)
+
+    _validate_forecast_columns(forecast_df, FORECAST_REQUIRED_COLUMNS, data_path)
+    _validate_location_coverage(forecast_df, locations_data, data_path, locations_data_path)
+
+    if preprocess is not None:
+        processed_data = preprocess(forecast_df, filter_nowcasts=filter_nowcasts)
+    else:
+        processed_data = hubverse_df_preprocessor(forecast_df, filter_quantiles=filter_quantiles, filter_nowcasts=filter_nowcasts)
+    return clean_nan_values(processed_data)
+
+
 def _validate_pathogen(pathogen: str) -> None:
     if pathogen not in PATHOGEN_TARGET_REQUIREMENTS:
         raise ExternalDataError(
@@ -85,11 +168,62 @@ def _validate_pathogen(pathogen: str) -> None:
         )
 
 
+def _read_csv(
+    path: Path,
+    column_dtypes: Dict[str, str],
+    usecols: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read a CSV with declared column dtypes, projected to `usecols` (columns absent from the file are skipped).
+
+    Uses the multithreaded Arrow CSV reader when pyarrow is installed, and falls back to `pd.read_csv`.
+    """
+    wanted = None if usecols is None else set(usecols)
+    if pa_csv is None:
+        return pd.read_csv(
+            path,
+            dtype={col: (str if dtype == "string" else dtype) for col, dtype in column_dtypes.items()},
+            usecols=None if wanted is None else (lambda col: col in wanted),
+        )
+
+    include_columns = None
+    if wanted is not None:
+        # Keep the file's column order, as `pd.read_csv(usecols=...)` does
+        with path.open(newline="") as handle:
+            header = next(csv.reader(handle), [])
+        include_columns = [col for col in header if col in wanted]
+
+    arrow_types = {"string": pa.string(), "float64": pa.float64()}
+    convert_options = pa_csv.ConvertOptions(
+        column_types={col: arrow_types[dtype] for col, dtype in column_dtypes.items()},
+        include_columns=include_columns,
+        strings_can_be_null=True,
+    )
+    return pa_csv.read_csv(path, convert_options=convert_options).to_pandas()
+
+
 def _load_forecast_data(data_path: Path) -> pd.DataFrame:
     if not data_path.exists():
         raise ExternalDataError(f"Forecast data path does not exist: {data_path}")
     logger.info("Loading forecast data from %s", data_path)
-    df = pd.read_csv(data_path, dtype={"location": str})
+    suffix = data_path.suffix.lower()
+    if suffix == ".csv":
+        df = _read_csv(data_path, FORECAST_COLUMN_DTYPES, usecols=FORECAST_REQUIRED_COLUMNS)
+    elif suffix in PARQUET_SUFFIXES:
+        import pyarrow.parquet as pq
+
+        # Keep the file's column order and the CSV path's numeric dtypes (e.g. integer horizons)
+        columns = [col for col in pq.read_schema(data_path).names if col in FORECAST_REQUIRED_COLUMNS]
+        df = pd.read_parquet(data_path, columns=columns)
+        if "location" in df.columns:
+            df["location"] = df["location"].astype(str)
+        for col, dtype in FORECAST_COLUMN_DTYPES.items():
+            if dtype == "float64" and col in df.columns:
+                df[col] = df[col].astype(dtype)
+    else:
+        raise ExternalDataError(
+            f"Unsupported forecast data file extension '{suffix}' for {data_path}"
+        )
     return df
 
 
@@ -101,7 +235,7 @@ def _load_target_data(target_data_path: Path, pathogen: str) -> pd.DataFrame:
     suffix = target_data_path.suffix.lower()
     if suffix == ".csv":
         df = pd.read_csv(target_data_path, dtype={"location": str})
-    elif suffix in {".parquet", ".pq"}:
+    elif suffix in PARQUET_SUFFIXES:
         df = pd.read_parquet(target_data_path)
         if "location" in df.columns:
             df["location"] = df["location"].astype(str)
@@ -116,7 +250,7 @@ def _load_locations_data(locations_data_path: Path) -> pd.DataFrame:
     if not locations_data_path.exists():
         raise ExternalDataError(f"Locations data path does not exist: {locations_data_path}")
     logger.info("Loading location metadata from %s", locations_data_path)
-    df = pd.read_csv(locations_data_path, dtype={"location": str})
+    df = _read_csv(locations_data_path, LOCATION_COLUMN_DTYPES)
     return df
 
 
@@ -150,8 +284,9 @@ def _validate_location_coverage(
     forecast_path: Path,
     locations_path: Path,
 ) -> None:
-    known_locations = set(locations_df["location"].astype(str))
-    missing_locations = sorted(set(forecast_df["location"].astype(str)) - known_locations)
+    # Compare distinct values only; the forecast location column can have millions of rows
+    known_locations = {str(loc) for loc in locations_df["location"].unique()}
+    missing_locations = sorted({str(loc) for loc in forecast_df["location"].unique()} - known_locations)
     if missing_locations:
         raise ExternalDataError(
             "The following locations appear in forecast data but are missing from location metadata: "
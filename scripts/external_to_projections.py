@@ -0,0 +1,250 @@
+"""Convert external Hubverse submissions into RespiLens projections JSON."""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from external_data import (
+    ExternalDataError,
+    PARQUET_SUFFIXES,
+    SharedInputs,
+    load_forecast_inputs,
+    load_shared_inputs,
+)
+from helper import save_json_file
+from processors import FlusightDataProcessor, RSVDataProcessor, COVIDDataProcessor
+
+logger = logging.getLogger(__name__)
+
+PATHOGEN_PROCESSORS = {
+    "flu": FlusightDataProcessor,
+    "rsvforecasthub": RSVDataProcessor,
+    "covid19forecasthub": COVIDDataProcessor,
+}
+
+MANIFEST_REQUIRED_COLUMNS = {"name", "pathogen", "data_path", "target_data_path", "locations_data_path"}
+MANIFEST_PATH_COLUMNS = ("data_path", "target_data_path", "locations_data_path")
+BATCH_REPORT_FILENAME = "batch_report.json"
+
+# (pathogen, target data path, locations data path) -> shared inputs, populated per worker process
+_SHARED_INPUTS: Dict[Tuple[str, str, str], SharedInputs] = {}
+
+
+def convert_submission(
+    pathogen: str,
+    data_path: Path,
+    shared: SharedInputs,
+    locations_data_path: Path,
+    output_path: Path,
+    overwrite: bool,
+) -> Dict[str, Any]:
+    """Process one forecast file and save its JSON outputs under `output_path`."""
+    processor_class = PATHOGEN_PROCESSORS[pathogen]
+    data = load_forecast_inputs(
+        data_path, shared.locations_data, locations_data_path, preprocess=processor_class.config.preprocess
+    )
+    processor = processor_class(
+        data=data,
+        locations_data=shared.locations_data,
+        target_data=shared.target_data,
+    )
+    for filename, contents in processor.output_dict.items():
+        save_json_file(
+            pathogen=pathogen,
+            output_path=str(output_path),
+            output_filename=filename,
+            file_contents=contents,
+            overwrite=overwrite,
+        )
+    return {"rows": len(data), "files": len(processor.output_dict)}
+
+
+def read_batch_manifest(manifest_path: Path) -> List[Dict[str, str]]:
+    """
+    Read a CSV manifest with one row per submission (`name,pathogen,data_path,target_data_path,locations_data_path`).
+
+    Relative paths are resolved against the manifest's directory, not the working directory.
+    """
+    with manifest_path.open(newline="") as handle:
+        rows = list(csv.DictReader(handle))
+    missing = MANIFEST_REQUIRED_COLUMNS - set(rows[0].keys() if rows else [])
+    if missing:
+        raise ExternalDataError(f"Batch manifest {manifest_path} is missing required columns: {sorted(missing)}")
+    names = [row["name"] for row in rows]
+    if len(names) != len(set(names)):
+        raise ExternalDataError(f"Batch manifest {manifest_path} contains duplicate submission names.")
+    base = manifest_path.parent
+    for row in rows:
+        for column in MANIFEST_PATH_COLUMNS:
+            row[column] = str(base / row[column])  # an absolute entry replaces `base`
+    return rows
+
+
+def collect_batch_directory(
+    batch_dir: Path, pathogen: str, target_data_path: Path, locations_data_path: Path
+) -> List[Dict[str, str]]:
+    """Treat every CSV/parquet file in `batch_dir` as one submission for a single pathogen."""
+    submissions = []
+    for data_path in sorted(batch_dir.iterdir()):
+        suffix = data_path.suffix.lower()
+        if not data_path.is_file() or (suffix != ".csv" and suffix not in PARQUET_SUFFIXES):
+            continue
+        submissions.append({
+            "name": data_path.stem,
+            "pathogen": pathogen,
+            "data_path": str(data_path),
+            "target_data_path": str(target_data_path),
+            "locations_data_path": str(locations_data_path),
+        })
+    return submissions
+
+
+def _shared_key(submission: Dict[str, str]) -> Tuple[str, str, str]:
+    return (
+        submission["pathogen"],
+        str(Path(submission["target_data_path"]).resolve()),
+        str(Path(submission["locations_data_path"]).resolve()),
+    )
+
+
+def _init_batch_worker(shared_inputs: Dict[Tuple[str, str, str], SharedInputs], log_level: str) -> None:
+    """Receive the shared inputs once per worker process instead of once per submission."""
+    logging.basicConfig(level=log_level)
+    _SHARED_INPUTS.update(shared_inputs)
+
+
+def _run_batch_submission(submission: Dict[str, str], output_path: str, overwrite: bool) -> Dict[str, Any]:
+    """Convert one batch submission into `output_path/<name>/`, returning its status entry."""
+    status: Dict[str, Any] = {"name": submission["name"], "pathogen": submission["pathogen"], "data_path": submission["data_path"]}
+    start = time.perf_counter()
+    try:
+        result = convert_submission(
+            pathogen=submission["pathogen"],
+            data_path=Path(submission["data_path"]),
+            shared=_SHARED_INPUTS[_shared_key(submission)],
+            locations_data_path=Path(submission["locations_data_path"]),
+            output_path=Path(output_path) / submission["name"],
+            overwrite=overwrite,
+        )
+        status.update(status="success", error=None, **result)
+    except Exception as e:  # one bad submission must not sink the batch
+        logger.error("Submission '%s' failed: %s", submission["name"], e)
+        status.update(status="failed", error=f"{type(e).__name__}: {e}", rows=0, files=0)
+    status["seconds"] = round(time.perf_counter() - start, 3)
+    return status
+
+
+def run_batch(
+    submissions: List[Dict[str, str]],
+    output_path: Path,
+    overwrite: bool,
+    workers: Optional[int] = None,
+    log_level: str = "INFO",
+) -> List[Dict[str, Any]]:
+    """
+    Convert many submissions in a process pool and write a per-submission status report.
+
+    Target data and location metadata are parsed once per (pathogen, target file, locations file)
+    and shared with the workers. Each submission's outputs go to `output_path/<name>/`.
+    """
+    report: List[Dict[str, Any]] = []
+    shared_inputs: Dict[Tuple[str, str, str], SharedInputs] = {}
+    shared_errors: Dict[Tuple[str, str, str], str] = {}
+    runnable = []
+    for submission in submissions:
+        key = _shared_key(submission)
+        if key not in shared_inputs and key not in shared_errors:
+            try:
+                shared_inputs[key] = load_shared_inputs(
+                    submission["pathogen"], Path(submission["target_data_path"]), Path(submission["locations_data_path"])
+                )
+            except ExternalDataError as e:
+                shared_errors[key] = f"{type(e).__name__}: {e}"
+        if key in shared_errors:
+            report.append({
+                "name": submission["name"], "pathogen": submission["pathogen"], "data_path": submission["data_path"],
+                "status": "failed", "error": shared_errors[key], "rows": 0, "files": 0, "seconds": 0.0,
+            })
+        else:
+            runnable.append(submission)
+
+    workers = workers or min(len(runnable), os.cpu_count() or 1) or 1
+    logger.info("Converting %d submissions with %d worker(s)...", len(runnable), workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(shared_inputs, log_level)) as pool:
+        report.extend(pool.map(_run_batch_submission, runnable, [str(output_path)] * len(runnable), [overwrite] * len(runnable)))
+
+    report.sort(key=lambda entry: entry["name"])
+    output_path.mkdir(parents=True, exist_ok=True)
+    with open(output_path / BATCH_REPORT_FILENAME, "w") as of:
+        json.dump({
+            "generated_at": pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "submissions": report,
+        }, of, indent=4)
+    n_failed = sum(entry["status"] != "success" for entry in report)
+    logger.info("Batch complete: %d succeeded, %d failed (report: %s)", len(report) - n_failed, n_failed, output_path / BATCH_REPORT_FILENAME)
+    return report
+
+
+def main():
+    """
+    Main execution function
+    """
+    parser = argparse.ArgumentParser(description="Convert Hubverse submissions into RespiLens projections JSON.")
+    parser.add_argument("--output-path", type=str, required=True, help="Directory where JSON files will be saved.")
+    parser.add_argument("--pathogen", type=str, choices=sorted(PATHOGEN_PROCESSORS), help="Pathogen to process.")
+    parser.add_argument("--data-path", type=str, help="Path to Hubverse forecast data (CSV or parquet).")
+    parser.add_argument("--target-data-path", type=str, help="Path to Hubverse target data (CSV or parquet).")
+    parser.add_argument("--locations-data-path", type=str, help="Path to the location metadata CSV.")
+    parser.add_argument("--batch-dir", type=str, help="Directory of forecast files to convert (one submission per file); uses --pathogen, --target-data-path and --locations-data-path for all of them.")
+    parser.add_argument("--batch-manifest", type=str, help="CSV manifest with columns name,pathogen,data_path,target_data_path,locations_data_path (one row per submission).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for batch mode (default: number of CPUs).")
+    parser.add_argument("--overwrite", action="store_true", help="Allow overwriting existing output files.")
+    parser.add_argument("--log-level", type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Console logging verbosity.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    output_path = Path(args.output_path)
+
+    if args.batch_manifest or args.batch_dir:
+        if args.batch_manifest and args.batch_dir:
+            parser.error("--batch-manifest and --batch-dir are mutually exclusive.")
+        if args.batch_manifest:
+            submissions = read_batch_manifest(Path(args.batch_manifest))
+        else:
+            if not (args.pathogen and args.target_data_path and args.locations_data_path):
+                parser.error("--batch-dir requires --pathogen, --target-data-path and --locations-data-path.")
+            submissions = collect_batch_directory(
+                Path(args.batch_dir), args.pathogen, Path(args.target_data_path), Path(args.locations_data_path)
+            )
+        for submission in submissions:
+            if submission["pathogen"] not in PATHOGEN_PROCESSORS:
+                parser.error(f"Unsupported pathogen '{submission['pathogen']}' for submission '{submission['name']}'.")
+        report = run_batch(submissions, output_path, overwrite=args.overwrite, workers=args.workers, log_level=args.log_level)
+        sys.exit(0 if all(entry["status"] == "success" for entry in report) else 1)
+
+    if not (args.pathogen and args.data_path and args.target_data_path and args.locations_data_path):
+        parser.error("--pathogen, --data-path, --target-data-path and --locations-data-path are required outside batch mode.")
+    logger.info("Beginning conversion process...")
+    shared = load_shared_inputs(args.pathogen, Path(args.target_data_path), Path(args.locations_data_path))
+    result = convert_submission(
+        pathogen=args.pathogen,
+        data_path=Path(args.data_path),
+        shared=shared,
+        locations_data_path=Path(args.locations_data_path),
+        output_path=output_path,
+        overwrite=args.overwrite,
+    )
+    logger.info("Success ✅ (%d files written)", result["files"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 """Helper functions for data conversion process."""
 
+import hashlib
 import json
-from typing import Literal
+from typing import Iterable, Literal, Optional, Tuple
 import numpy as np
 import pandas as pd
 import requests
@@ -11,6 +12,8 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from pathlib import Path
 
+from instrumentation import span
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,14 +22,46 @@ def clean_nan_values(df: pd.DataFrame) -> pd.DataFrame:
     return df.replace({np.nan: None})
 
 
-def hubverse_df_preprocessor(df: pd.DataFrame, filter_quantiles: bool = True, filter_nowcasts: bool = True) -> pd.DataFrame:
+# `output_type_id` levels kept by `hubverse_df_preprocessor` unless a HubDatasetConfig overrides them
+DEFAULT_QUANTILE_LEVELS = (0.025, 0.25, 0.5, 0.75, 0.975)
+DEFAULT_CATEGORICAL_LEVELS = ('decrease', 'increase', 'large_decrease', 'large_increase', 'stable')
+# Peak targets as (target, output type): 'quantile' targets describe the peak's size, 'pmf' targets
+# a distribution over peak weeks (ISO-date `output_type_id`s). Hubs declare theirs on HubDatasetConfig.
+FLU_PEAK_TARGETS = (('peak inc flu hosp', 'quantile'), ('peak week inc flu hosp', 'pmf'))
+PEAK_TARGETS = tuple(target for target, _ in FLU_PEAK_TARGETS)
+PEAK_WEEK_TARGETS = tuple(target for target, output_type in FLU_PEAK_TARGETS if output_type == 'pmf')
+# Placeholder horizon for peak targets (which have none), so horizon filters keep their rows
+PEAK_HORIZON = 50
+
+
+def hubverse_df_preprocessor(
+        df: pd.DataFrame,
+        filter_quantiles: bool = True,
+        filter_nowcasts: bool = True,
+        quantile_levels: Iterable[float] = DEFAULT_QUANTILE_LEVELS,
+        categorical_levels: Iterable[str] = DEFAULT_CATEGORICAL_LEVELS,
+        drop_output_types: Iterable[str] = ("sample",),
+        peak_targets: Iterable[Tuple[str, str]] = FLU_PEAK_TARGETS,
+        sample_quantiles: bool = False,
+) -> pd.DataFrame:
     """
     Do a number of pre-processing tasks that make a hubverse df ready to pass through a processing class.
 
+    All row filters are combined into a single boolean mask and applied once. Level
+    lookups (and date parsing for peak-week targets) run on the distinct
+    `output_type_id` values rather than on every row.
+
     Args:
         df: Hubverse data as pd.DataFrame
         filter_quantiles: If True, filter to specific quantile/pmf values only
         filter_nowcasts: If True, filter out horizon -1 (nowcasts)
+        quantile_levels: Numeric `output_type_id` values to keep when filter_quantiles=True
+        categorical_levels: Category `output_type_id` values to keep when filter_quantiles=True
+        drop_output_types: `output_type` values to remove entirely
+        peak_targets: (target, output type) pairs of peak targets; they get horizon PEAK_HORIZON, and
+            'pmf' peak targets also keep date-like `output_type_id`s (peak weeks)
+        sample_quantiles: If True, first add `quantile_levels` quantile rows computed from the sample rows of
+            every task without submitted quantiles (see `samples_to_quantiles`)
 
     Returns:
         A df with...
@@ -34,44 +69,198 @@ def hubverse_df_preprocessor(df: pd.DataFrame, filter_quantiles: bool = True, fi
             - horizon NaNs dropped,
             - horizon -1 (nowcasts) optionally filtered out,
             - only some `output_type_id` values kept (if filter_quantiles=True),
-            - all `output_type` == sample removed.
+            - all `output_type` in `drop_output_types` (default: sample) removed.
     """
-    df = df.copy()
-    # Set horizon for flu 'peak' targets = 50 (placeholder so it doesn't get filtered out)
-    peak_targets = {'peak inc flu hosp', 'peak week inc flu hosp'}
-    if 'target' in df.columns:
-        df['target'] = df['target'].astype(str)
-        is_peak_target = df['target'].isin(peak_targets)
-        df.loc[is_peak_target, 'horizon'] = 50
-    # Drop NaN values in horizon column
-    df = df.dropna(subset=['horizon'])
-    # Ensure horizons are ints (not floats)
-    df['horizon'] = df['horizon'].astype(int)
-    # Optionally filter out horizon -1 (nowcasts)
+    if sample_quantiles:
+        derived = samples_to_quantiles(df, quantile_levels=quantile_levels)
+        if not derived.empty:
+            df = pd.concat([df, derived], ignore_index=True)
+    peak_targets = tuple(peak_targets)
+    peak_target_names = [name for name, _ in peak_targets]
+    peak_week_targets = [name for name, output_type in peak_targets if output_type == 'pmf']
+    target = df['target'].astype(str) if 'target' in df.columns else None
+    # Set horizon for peak targets = PEAK_HORIZON (placeholder so it doesn't get filtered out)
+    horizon = df['horizon']
+    if target is not None and peak_target_names:
+        horizon = horizon.mask(target.isin(peak_target_names), PEAK_HORIZON)
+    # Drop NaN horizons, optionally horizon -1 (nowcasts), and unwanted output types
+    keep = horizon.notna().to_numpy(copy=True)
     if filter_nowcasts:
-        df = df[df['horizon'] >= 0]
-    # Get rid of all output_type == 'sample'
-    df = df[df['output_type'] != 'sample']
+        keep &= (horizon >= 0).to_numpy()
+    keep &= ~df['output_type'].isin(drop_output_types).to_numpy()
+
     if filter_quantiles:
-        # Filter `output_type_id` values
-        categorical_ids = ['decrease', 'increase', 'large_decrease', 'large_increase', 'stable'] 
-        numeric_ids = [0.025, 0.25, 0.5, 0.75, 0.975]
-        df['output_type_id'] = df['output_type_id'].astype(object)
-        # Also valid, date-like values where target is 'peak' something
-        numeric_output_ids = pd.to_numeric(df['output_type_id'], errors='coerce')
-        is_categorical_id = df['output_type_id'].isin(categorical_ids)
-        is_numeric_id = numeric_output_ids.isin(numeric_ids)
-        date_output_ids = pd.to_datetime(df['output_type_id'], errors='coerce')
-        is_convertible_to_date = date_output_ids.notna()
-        is_peak_week_target = df['target'].astype(str).str.contains('peak week inc flu hosp', na=False)
-        is_valid_peak_date = is_convertible_to_date & is_peak_week_target
-        df = df[is_categorical_id | is_numeric_id | is_valid_peak_date]
-        quantile_mask = df['output_type'] == 'quantile'
-        df.loc[quantile_mask, 'output_type_id'] = df.loc[quantile_mask, 'output_type_id'].astype(float)
+        # Classify each distinct `output_type_id` once, then broadcast back to rows via the codes
+        codes, uniques = pd.factorize(df['output_type_id'])
+        uniques = pd.Series(uniques, dtype=object)
+        numeric_uniques = pd.to_numeric(uniques, errors='coerce').to_numpy(dtype=float)
+        is_level = uniques.isin(set(categorical_levels)).to_numpy() | np.isin(numeric_uniques, list(quantile_levels))
+        keep_id = np.append(is_level, False)[codes]  # code -1 (missing id) -> not kept
+        # Also valid, date-like values where target is a 'peak week' target (only parse those)
+        if target is not None and peak_week_targets:
+            is_peak_candidate = keep & ~keep_id & target.isin(peak_week_targets).to_numpy()
+            candidate_codes = np.unique(codes[is_peak_candidate])
+            candidate_codes = candidate_codes[candidate_codes >= 0]
+            if len(candidate_codes):
+                parsed = pd.to_datetime(uniques.iloc[candidate_codes], errors='coerce', format='ISO8601')
+                valid_codes = candidate_codes[parsed.notna().to_numpy()]
+                keep_id |= is_peak_candidate & np.isin(codes, valid_codes)
+        keep &= keep_id
+
+    df = df[keep]
+    if target is not None:
+        df['target'] = target[keep]
+    # Ensure horizons are ints (not floats)
+    df['horizon'] = horizon[keep].astype(int)
+    if filter_quantiles:
+        # Quantile levels as floats; pmf categories and peak dates stay as-is
+        output_type_ids = df['output_type_id'].to_numpy(dtype=object, copy=True)
+        quantile_mask = (df['output_type'] == 'quantile').to_numpy()
+        output_type_ids[quantile_mask] = numeric_uniques[codes[keep]][quantile_mask]
+        df['output_type_id'] = pd.Series(output_type_ids, index=df.index, dtype=object)
 
     return df
 
 
+# Rows of one (sample count) block reduced per quantile call in `samples_to_quantiles`
+SAMPLE_BLOCK_VALUES = 1 << 22
+
+
+def samples_to_quantiles(
+        df: pd.DataFrame,
+        quantile_levels: Iterable[float] = DEFAULT_QUANTILE_LEVELS,
+        block_values: int = SAMPLE_BLOCK_VALUES,
+) -> pd.DataFrame:
+    """
+    Reduce `sample` rows to `quantile` rows at `quantile_levels`.
+
+    A task is every column other than `output_type`, `output_type_id` and `value` (so each
+    model's location/date/target/horizon); tasks that also have submitted quantile rows are
+    left alone. Tasks are ordered by sample count, so each count's samples form a dense
+    `(task, sample)` array that is reduced with one `np.quantile` call per block of at most
+    `block_values` samples.
+
+    Returns only the new quantile rows (float `output_type_id`s), in `df`'s columns.
+    """
+    levels = np.asarray(list(quantile_levels), dtype=float)
+    output_types = df['output_type'].to_numpy()
+    is_sample = output_types == 'sample'
+    if not is_sample.any():
+        return df.iloc[:0]
+    with span("sample_quantiles", rows=int(is_sample.sum())) as timing:
+        task_columns = [column for column in df.columns if column not in ('output_type', 'output_type_id', 'value')]
+        relevant = is_sample | (output_types == 'quantile')
+        frame = df if relevant.all() else df[relevant]
+        is_sample = is_sample[relevant]
+        codes = frame.groupby(task_columns, sort=False, dropna=False).ngroup().to_numpy()
+        n_tasks = int(codes.max()) + 1
+        values = pd.to_numeric(frame['value'], errors='coerce').to_numpy(dtype=float)
+        has_quantiles = np.bincount(codes[~is_sample], minlength=n_tasks) > 0
+        use = is_sample & ~has_quantiles[codes] & ~np.isnan(values)
+        # first row of each task, for its task columns
+        first_row = np.empty(n_tasks, dtype=np.int64)
+        first_row[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+
+        codes, values = codes[use], values[use]
+        counts = np.bincount(codes, minlength=n_tasks)
+        order = np.lexsort((codes, counts[codes]))
+        codes, values = codes[order], values[order]
+        task_parts, quantile_parts = [], []
+        start = 0
+        for count in np.unique(counts[codes]):
+            n_count_tasks = int((counts == count).sum())
+            tasks_per_block = max(1, block_values // int(count))
+            for block_start in range(0, n_count_tasks, tasks_per_block):
+                n_block = min(tasks_per_block, n_count_tasks - block_start)
+                block = values[start:start + n_block * count].reshape(n_block, count)
+                task_parts.append(codes[start:start + n_block * count:count])
+                quantile_parts.append(np.quantile(block, levels, axis=1).T)
+                start += n_block * count
+        if not task_parts:
+            return df.iloc[:0]
+        tasks = np.concatenate(task_parts)
+        quantiles = np.concatenate(quantile_parts)
+        timing.add(tasks=len(tasks))
+
+        derived = frame[task_columns].iloc[np.repeat(first_row[tasks], len(levels))].reset_index(drop=True)
+        derived['output_type'] = 'quantile'
+        derived['output_type_id'] = pd.Series(np.tile(levels, len(tasks)), dtype=object)
+        derived['value'] = quantiles.ravel()
+        return derived[list(df.columns)]
+
+
+OUTPUT_TYPE_ID_KINDS = ('quantile', 'category', 'date')
+
+
+def split_output_type_id(df: pd.DataFrame, date_targets: Iterable[str] = PEAK_WEEK_TARGETS) -> pd.DataFrame:
+    """
+    Replace the mixed-type `output_type_id` column with typed columns for internal processing.
+
+    Date-like ids are only read as dates for `date_targets` (the 'pmf' peak targets).
+
+    Adds:
+        - `output_type_id_kind`: categorical discriminator, one of OUTPUT_TYPE_ID_KINDS
+        - `quantile_level`: float64 level for quantile rows (NaN otherwise)
+        - `category`: dictionary-encoded (categorical) pmf category (NaN otherwise)
+        - `peak_date`: datetime64 peak-week date (NaT otherwise)
+
+    Each distinct `output_type_id` is parsed once; rows are mapped back via factorized codes.
+    Use `output_type_id_values()` to convert back to the JSON output format.
+    """
+    codes, uniques = pd.factorize(df['output_type_id'])
+    uniques = pd.Series(uniques, dtype=object)
+    # Per distinct id: numeric level and (for strings) ISO date; the trailing slot serves code -1 (missing id)
+    unique_levels = np.append(pd.to_numeric(uniques, errors='coerce').to_numpy(dtype=float), np.nan)
+    unique_dates = np.append(
+        pd.to_datetime(uniques.where(uniques.map(type) == str), errors='coerce', format='ISO8601').to_numpy(dtype='datetime64[ns]'),
+        np.datetime64('NaT', 'ns'),
+    )
+    levels = unique_levels[codes]
+    dates = unique_dates[codes]
+
+    is_quantile = (df['output_type'] == 'quantile').to_numpy() & ~np.isnan(levels)
+    is_date = df['target'].isin(list(date_targets)).to_numpy() & ~is_quantile & ~np.isnat(dates)
+    is_category = ~(is_quantile | is_date)
+
+    # Keep only the categories that are actually used, so the dictionary stays small
+    category_codes = np.where(is_category, codes, -1)
+    used_codes = np.unique(category_codes[category_codes >= 0])
+    remap = np.full(len(uniques) + 1, -1)
+    remap[used_codes] = np.arange(len(used_codes))
+
+    typed = df.drop(columns=['output_type_id'])
+    typed['output_type_id_kind'] = pd.Categorical.from_codes(
+        np.where(is_quantile, 0, np.where(is_date, 2, 1)), categories=list(OUTPUT_TYPE_ID_KINDS)
+    )
+    typed['quantile_level'] = np.where(is_quantile, levels, np.nan)
+    typed['category'] = pd.Categorical.from_codes(remap[category_codes], categories=uniques.iloc[used_codes].tolist())
+    typed['peak_date'] = np.where(is_date, dates, np.datetime64('NaT', 'ns'))
+    return typed
+
+
+def output_type_id_values(df: pd.DataFrame) -> list:
+    """Convert typed `output_type_id` columns (see `split_output_type_id`) back to the JSON output format."""
+    kind = df['output_type_id_kind'].cat.codes.to_numpy()
+    if (kind == 0).all():
+        return df['quantile_level'].tolist()
+    if (kind == 2).all():
+        return df['peak_date'].dt.strftime('%Y-%m-%d').tolist()
+    values = df['category'].astype(object).to_numpy(copy=True)
+    values[df['category'].cat.codes.to_numpy() < 0] = None
+    values[kind == 0] = df['quantile_level'].to_numpy()[kind == 0]
+    values[kind == 2] = df['peak_date'].dt.strftime('%Y-%m-%d').to_numpy()[kind == 2]
+    return values.tolist()
+
+
+def json_numbers(values):
+    """Make a (nested) list of floats JSON-ready: NaN becomes None and integral floats become ints."""
+    if isinstance(values, list):
+        return [json_numbers(value) for value in values]
+    if values != values: # NaN
+        return None
+    return int(values) if values.is_integer() else values
+
+
 def get_location_info(
         location_data: pd.DataFrame, 
         location: str, 
@@ -152,12 +341,31 @@ def retrieve_data_from_endpoint_aslist(data_url: str) -> list[dict]:
     return all_data
     
 
+# Maps every accepted `pathogen` slug (canonical or legacy alias) to its output directory.
+OUTPUT_DIR_MAP = {
+    'flu': 'flusight',
+    'flusight': 'flusight',
+    'flusightforecasthub': 'flusight',
+    'rsv': 'rsvforecasthub',
+    'rsvforecasthub': 'rsvforecasthub',
+    'covid': 'covid19forecasthub',
+    'covid19': 'covid19forecasthub',
+    'covid19forecasthub': 'covid19forecasthub',
+    'nhsn': 'nhsn',
+    'nssp': 'nssp',
+    'flumetrocast': 'flumetrocast',
+    'flumetrocashtub': 'flumetrocast',
+    'bundles': 'bundles',
+}
+
+
 def save_json_file(
-        pathogen: Literal['flusight', 'flu', 'flusightforecasthub', 'rsv','covid','covid19','rsvforecasthub','covid19forecasthub','nhsn', 'nssp', 'flumetrocast', 'flumetrocasthub'],
+        pathogen: Literal['flusight', 'flu', 'flusightforecasthub', 'rsv','covid','covid19','rsvforecasthub','covid19forecasthub','nhsn', 'nssp', 'flumetrocast', 'flumetrocasthub', 'bundles'],
         output_path: str,
         output_filename: str,
         file_contents: dict,
-        overwrite: bool
+        overwrite: bool,
+        indent: Optional[int] = 4,
 ) -> None:
     """
     Save an already-validated JSON to output_path/pathogen-ext/file_name.json.
@@ -167,37 +375,23 @@ def save_json_file(
         output_path: Path to top-level saving directory
         output_filename: Full name of file to be saved
         file_contents: Contents of file to be saved
+        indent: `json.dump` indentation; None writes the file without whitespace
 
     Raises:
         FileExistsError: If file already exists at the full output path and overwrite is set to False.
     """
 
-    # This single dictionary maps every possible input to the desired output directory.
-    output_dir_map = {
-        'flu': 'flusight',
-        'flusight': 'flusight',
-        'flusightforecasthub': 'flusight',
-        'rsv': 'rsvforecasthub',
-        'rsvforecasthub': 'rsvforecasthub',
-        'covid': 'covid19forecasthub',
-        'covid19': 'covid19forecasthub',
-        'covid19forecasthub': 'covid19forecasthub',
-        'nhsn': 'nhsn',
-        'nssp': 'nssp',
-        'flumetrocast': 'flumetrocast',
-        'flumetrocashtub': 'flumetrocast',
-    }
-
-    if pathogen not in output_dir_map:
-        raise ValueError(f"Invalid pathogen ('{pathogen}') provided; must be one of {list(output_dir_map.keys())}")
+    if pathogen not in OUTPUT_DIR_MAP:
+        raise ValueError(f"Invalid pathogen ('{pathogen}') provided; must be one of {list(OUTPUT_DIR_MAP.keys())}")
 
     # Get the single, correct directory name
-    target_name = output_dir_map[pathogen]
+    target_name = OUTPUT_DIR_MAP[pathogen]
     
     # Create the full path and save the file (no loop needed)
     target_dir = Path(output_path) / target_name
     target_dir.mkdir(parents=True, exist_ok=True)
     file_path = target_dir / output_filename
+    file_path.parent.mkdir(parents=True, exist_ok=True) # sharded layouts nest files per location
     
     if (not overwrite) and file_path.exists():
         raise FileExistsError(
@@ -205,8 +399,24 @@ def save_json_file(
             "Remove or move file and try again."
         )
     
-    with open(file_path, 'w') as of:
-        json.dump(file_contents, of, indent=4)
+    with span("save_json", files=1) as timing:
+        with open(file_path, 'w') as of:
+            json.dump(file_contents, of, indent=indent, separators=None if indent is not None else (',', ':'))
+        if timing.enabled:
+            timing.add(bytes=file_path.stat().st_size)
+
+
+def payload_digest(file_contents: dict, ignore: Iterable[str] = ('last_updated',)) -> str:
+    """
+    Digest of a JSON payload's contents, for telling whether it changed since it was last written.
+
+    Top-level keys in `ignore` (the build timestamp metadata files carry) do not count as changes.
+    """
+    ignore = set(ignore)
+    if isinstance(file_contents, dict) and ignore & file_contents.keys():
+        file_contents = {key: value for key, value in file_contents.items() if key not in ignore}
+    return hashlib.blake2b(json.dumps(file_contents, separators=(',', ':')).encode(), digest_size=16).hexdigest()
+
 
 NHSN_COLUMN_MASKS = {
     "RAW_PATIENT_COUNTS": [
@@ -3,17 +3,60 @@ Shared utilities for processing Hubverse forecast datasets into RespiLens JSON.
 """
 
 from dataclasses import dataclass
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Iterable, Iterator, Optional, Tuple, Union
+import bisect
 import logging
 import datetime
+import tempfile
+import urllib.parse
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
-from helper import get_location_info
+from instrumentation import add_counts, span
+from scoring import score_quantile_forecasts, build_leaderboard, concat_scores
+from helper import (
+    get_location_info,
+    hubverse_df_preprocessor,
+    json_numbers,
+    clean_nan_values,
+    split_output_type_id,
+    output_type_id_values,
+    samples_to_quantiles,
+    DEFAULT_QUANTILE_LEVELS,
+    DEFAULT_CATEGORICAL_LEVELS,
+    PEAK_TARGETS,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# "single": one `{abbr}_{suffix}.json` per location (default)
+# "sharded": `{abbr}_{suffix}/index.json`, `{abbr}_{suffix}/ground_truth.json` and one `{abbr}_{suffix}/{reference_date}.json` per week
+# "both": write both layouts
+OUTPUT_LAYOUTS = ("single", "sharded", "both")
+
+AVAILABILITY_COLUMNS = ("target", "model_id", "location", "reference_date")
+
+# "default": the nested per-horizon projections schema
+# "compact": shared quantile/date/category tables, one columnar block per model and target,
+#            values rounded to `significant_digits` (see `compact_projection_payload`)
+PAYLOAD_FORMATS = ("default", "compact")
+COMPACT_SCHEMA_VERSION = "compact-1"
+
+# Peak output type -> (`output_type_id` key, value key) inside a peaks model's `predictions`
+PEAK_OUTPUT_TYPES = {
+    "quantile": ("quantiles", "values"),
+    "pmf": ("peak week", "probabilities"),
+}
+
+# Pseudo-model names for server-side ensembles, keyed by aggregation
+ENSEMBLE_MODELS = {
+    "mean": "RespiLens-QuantileMean",
+    "median": "RespiLens-QuantileMedian",
+}
+
 
 @dataclass(frozen=True)
 class HubDatasetConfig:
@@ -25,6 +68,93 @@ class HubDatasetConfig:
     series_type: str = "projection"
     observation_column: str = "observation"
     drop_output_types: Tuple[str, ...] = ("sample",)
+    # Reduce models' sample rows to `quantile_levels` quantiles before `drop_output_types` removes them, so
+    # sample-only models appear in every output (set False to drop them as before)
+    sample_quantiles: bool = True
+    quantile_levels: Tuple[float, ...] = DEFAULT_QUANTILE_LEVELS
+    categorical_levels: Tuple[str, ...] = DEFAULT_CATEGORICAL_LEVELS
+    latest_ground_truth_weeks: int = 26
+    baseline_model: Optional[str] = None
+    # The hub's own ensembles; they and `baseline_model` are left out of the RespiLens ensembles
+    ensemble_models: Tuple[str, ...] = ()
+    # (target, output type) pairs written to `peaks` instead of `forecasts`, e.g. helper.FLU_PEAK_TARGETS
+    peak_targets: Tuple[Tuple[str, str], ...] = ()
+
+    def __post_init__(self) -> None:
+        for target, output_type in self.peak_targets:
+            if output_type not in PEAK_OUTPUT_TYPES:
+                raise ValueError(
+                    f"Peak target '{target}' must have an output type in {PEAK_OUTPUT_TYPES}, received '{output_type}'"
+                )
+
+    @property
+    def peak_target_names(self) -> Tuple[str, ...]:
+        return tuple(target for target, _ in self.peak_targets)
+
+    @property
+    def ensemble_exclusions(self) -> Tuple[str, ...]:
+        """Models that are not ensemble members: the hub's ensembles and its baseline."""
+        return self.ensemble_models + ((self.baseline_model,) if self.baseline_model else ())
+
+    @property
+    def peak_week_targets(self) -> Tuple[str, ...]:
+        """Peak targets whose `output_type_id`s are peak-week dates."""
+        return tuple(target for target, output_type in self.peak_targets if output_type == "pmf")
+
+    def preprocess(self, df: pd.DataFrame, filter_nowcasts: bool = True) -> pd.DataFrame:
+        """Run `hubverse_df_preprocessor` with this dataset's retained levels, output types and peak targets."""
+        with span("preprocess", rows=len(df)):
+            return hubverse_df_preprocessor(
+                df=df,
+                filter_nowcasts=filter_nowcasts,
+                quantile_levels=self.quantile_levels,
+                categorical_levels=self.categorical_levels,
+                drop_output_types=self.drop_output_types,
+                peak_targets=self.peak_targets,
+                sample_quantiles=self.sample_quantiles,
+            )
+
+    def read_dataset(self, dataset: "pyarrow.dataset.Dataset") -> pd.DataFrame:
+        """
+        Read a raw hub dataset into one (unpreprocessed) DataFrame.
+
+        With `sample_quantiles`, sample rows are reduced to quantiles one hub file (one model's
+        round) at a time as the dataset is scanned, so only a single file's samples are ever
+        held in pandas; the other rows are converted together at the end.
+        """
+        if not self.sample_quantiles:
+            return dataset.to_table().to_pandas()
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        kept_tables, derived_parts, fragment_batches = [], [], []
+
+        def reduce_fragment() -> None:
+            table = pa.Table.from_batches(fragment_batches, schema=dataset.schema)
+            fragment_batches.clear()
+            is_sample = pc.equal(table.column("output_type"), "sample")
+            if pc.any(is_sample).as_py():
+                reducible = pc.or_(is_sample, pc.equal(table.column("output_type"), "quantile"))
+                derived_parts.append(
+                    samples_to_quantiles(table.filter(reducible).to_pandas(), quantile_levels=self.quantile_levels)
+                )
+                table = table.filter(pc.invert(is_sample))
+            kept_tables.append(table)
+
+        current_fragment = None
+        for tagged in dataset.scanner().scan_batches():
+            fragment = getattr(tagged.fragment, "path", tagged.fragment)
+            if fragment_batches and fragment != current_fragment:
+                reduce_fragment()
+            current_fragment = fragment
+            fragment_batches.append(tagged.record_batch)
+        if fragment_batches or not kept_tables:
+            reduce_fragment()
+        hubverse_df = pa.concat_tables(kept_tables).to_pandas()
+        derived_parts = [part for part in derived_parts if not part.empty]
+        if derived_parts:
+            hubverse_df = pd.concat([hubverse_df, *derived_parts], ignore_index=True)
+        return hubverse_df
 
 
 class HubDataProcessorBase:
@@ -32,51 +162,249 @@ class HubDataProcessorBase:
     Base processor that handles the shared JSON export workflow for Hubverse datasets.
 
     Subclasses supply dataset-specific configuration via HubDatasetConfig.
+
+    `data` is normally an already-preprocessed Hubverse DataFrame. It may instead be
+    a raw `pyarrow.dataset.Dataset` (e.g. `connect_hub(...).get_dataset()`), in which
+    case the processor runs out-of-core: rows are loaded, preprocessed and converted
+    one location at a time, so peak memory tracks the largest single location rather
+    than the whole hub archive. Per-location DataFrames are not retained in that mode.
+
+    With `build_ensembles=True`, quantile-mean and quantile-median ensembles (see
+    `compute_ensemble_quantiles`) are added to each location's forecasts as the
+    pseudo-models in ENSEMBLE_MODELS.
+
+    With `score_forecasts=True`, every quantile forecast with ground truth is scored
+    (see `scoring.score_quantile_forecasts`); per-forecast scores are kept on `self.scores`
+    and a `leaderboard.json` is added to the outputs. Passing the previous run's scores
+    as `previous_scores` re-scores only forecasts whose values or observation changed.
+
+    With `payload_format="compact"`, every projections file is written in the opt-in
+    compact schema (see `compact_projection_payload`) with values rounded to
+    `significant_digits`; the default schema is unchanged.
+
+    `nowcasts` are extra hubverse rows (e.g. `baselinenowcast.baseline_nowcasts(target_data)`)
+    added to the forecasts of locations in the dump after preprocessing, so their negative
+    horizons survive `filter_nowcasts`; their models are left out of the ensembles.
+
+    With `lean=True`, per-location hubverse and ground truth DataFrames are neither copied
+    nor kept in `location_dataframes`/`ground_truth_dataframes` while the outputs are built;
+    `intermediate_dataframes` is rebuilt from `df_data` and `target_data` on first access instead.
+
+    With `only_locations` (in-memory data only), location payloads are built for those
+    locations alone, e.g. after a --watch rebuild reloaded a few model-output files. The
+    dataset-level files (metadata, availability, vintages, leaderboard) still cover every
+    location; scores of the other locations are taken from `previous_scores`. With
+    `only_reference_dates` as well, sharded layouts keep only those weeks'
+    `{reference_date}.json` shards, as the other weeks' are unchanged.
     """
     
     def __init__(
         self,
-        data: pd.DataFrame,
+        data: Union[pd.DataFrame, "pyarrow.dataset.Dataset"],
         locations_data: pd.DataFrame,
         target_data: pd.DataFrame,
         config: HubDatasetConfig,
-        is_metro_cast: bool = False
+        is_metro_cast: bool = False,
+        output_layout: str = "single",
+        build_ensembles: bool = False,
+        score_forecasts: bool = False,
+        previous_scores: Optional[pd.DataFrame] = None,
+        payload_format: str = "default",
+        significant_digits: int = 4,
+        lean: bool = False,
+        nowcasts: Optional[pd.DataFrame] = None,
+        only_locations: Optional[Iterable[str]] = None,
+        only_reference_dates: Optional[Iterable[str]] = None,
     ) -> None:
+        if output_layout not in OUTPUT_LAYOUTS:
+            raise ValueError(f"`output_layout` must be one of {OUTPUT_LAYOUTS}, received '{output_layout}'")
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"`payload_format` must be one of {PAYLOAD_FORMATS}, received '{payload_format}'")
         self.output_dict: Dict[str, Dict[str, Any]] = {}
+        self.output_layout = output_layout
+        self.build_ensembles = build_ensembles
+        self.score_forecasts = score_forecasts
+        self.previous_scores = previous_scores
+        self.payload_format = payload_format
+        self.significant_digits = significant_digits
+        self.lean = lean
+        self.scores: Optional[pd.DataFrame] = None
+        self.out_of_core = not isinstance(data, pd.DataFrame)
+        if only_locations is not None and self.out_of_core:
+            raise ValueError("`only_locations` needs in-memory data, not a hub dataset")
+        self.only_locations = None if only_locations is None else {str(loc) for loc in only_locations}
+        self.only_shards = (
+            None if only_reference_dates is None
+            else {"index.json", "ground_truth.json", *(f"{date}.json" for date in only_reference_dates)}
+        )
         self.df_data = data
         self.locations_data = locations_data
         self.target_data = target_data
         self.config = config
-        self.locations_in_this_dump = set(self.df_data['location'])
         self.is_metro_cast = is_metro_cast
-        if self.is_metro_cast: # necessary date filter for metrocast data
-            self.df_data = self.df_data[self.df_data['reference_date'] >= datetime.date(2025, 11, 19)]
+        if self.out_of_core: # filled in location-by-location in `_iter_location_dataframes`
+            self.locations_in_this_dump = set()
+        else:
+            self.locations_in_this_dump = set(self.df_data['location'])
+            if self.is_metro_cast: # necessary date filter for metrocast data
+                self.df_data = self._apply_metro_cast_filter(self.df_data)
+        self._nowcasts_by_location: Dict[str, pd.DataFrame] = {}
+        self._nowcast_models: Tuple[str, ...] = ()
+        if nowcasts is not None and not nowcasts.empty:
+            self._nowcast_models = tuple(str(model) for model in pd.unique(nowcasts["model_id"]))
+            if self.out_of_core: # appended to each location as it is loaded
+                self._nowcasts_by_location = {str(loc): loc_df for loc, loc_df in nowcasts.groupby("location")}
+            else:
+                nowcasts = _match_date_columns(nowcasts[nowcasts["location"].isin(self.locations_in_this_dump)], self.df_data)
+                self.df_data = pd.concat([self.df_data, nowcasts], ignore_index=True)
 
         self.logger = logging.getLogger(self.__class__.__name__)
         self.location_dataframes: Dict[str, pd.DataFrame] = {}
         self.ground_truth_dataframes: Dict[str, pd.DataFrame] = {}
+        self._all_models: Dict[str, None] = {}
+        self._availability_parts: list = [] # out-of-core only: distinct availability rows per location
+        self._ensemble_availability: list = [] # availability rows of the ensemble pseudo-models
+        self._ensemble_exclusions = self.config.ensemble_exclusions + self._nowcast_models
 
         self.logger.info("Building individual %s JSON files...", self.config.dataset_label)
-        self._build_outputs()
+        with span("locations"):
+            self._build_outputs()
 
-        metadata_file_contents = self._build_metadata_file(self._build_all_models_list())
-        self.output_dict["metadata.json"] = metadata_file_contents
+        with span("metadata"):
+            metadata_file_contents = self._build_metadata_file(self._build_all_models_list())
+            self.output_dict["metadata.json"] = metadata_file_contents
+        with span("availability"):
+            self.output_dict["availability.json"] = self._build_availability_file()
+        with span("ground_truth_vintages", rows=len(self.target_data)):
+            try:
+                self.output_dict["ground_truth_vintages.json"] = build_ground_truth_vintages(
+                    self.target_data,
+                    observation_column=self.config.observation_column,
+                    min_date=self.config.ground_truth_min_date,
+                    dataset_label=self.config.dataset_label,
+                )
+            except ValueError as error:
+                self.logger.warning("Skipping %s ground truth vintages: %s", self.config.dataset_label, error)
+        if self.score_forecasts:
+            with span("leaderboard", rows=len(self.scores)):
+                self.output_dict["leaderboard.json"] = build_leaderboard(
+                    self.scores, baseline_model=self.config.baseline_model, dataset_label=self.config.dataset_label
+                )
         self.logger.info("Success ✅")
 
         # Expose a consolidated dictionary of intermediate DataFrames for future exports.
-        self.intermediate_dataframes: Dict[str, Any] = {
-            "hubverse_raw": self.df_data,
-            "locations": self.location_dataframes,
-            "ground_truth": self.ground_truth_dataframes,
-        }
+        self._intermediate_dataframes: Optional[Dict[str, Any]] = None
+        if not self.lean:
+            self._intermediate_dataframes = {
+                "hubverse_raw": self.df_data,
+                "locations": self.location_dataframes,
+                "ground_truth": self.ground_truth_dataframes,
+            }
+
+    @property
+    def intermediate_dataframes(self) -> Dict[str, Any]:
+        """Raw hubverse data plus per-location hubverse and ground truth DataFrames (rebuilt on first access in lean mode)."""
+        if self._intermediate_dataframes is None:
+            if not self.out_of_core:
+                self.location_dataframes = {
+                    str(loc): loc_df for loc, loc_df in self.df_data.groupby("location")
+                }
+            locations = self.location_dataframes if not self.out_of_core else sorted(self.locations_in_this_dump)
+            self.ground_truth_dataframes = {loc: self._prepare_ground_truth_df(location=loc) for loc in locations}
+            self._intermediate_dataframes = {
+                "hubverse_raw": self.df_data,
+                "locations": self.location_dataframes,
+                "ground_truth": self.ground_truth_dataframes,
+            }
+        return self._intermediate_dataframes
+
+    @staticmethod
+    def _apply_metro_cast_filter(df: pd.DataFrame) -> pd.DataFrame:
+        """Drop MetroCast rows from before the 2025/26 season."""
+        return df[df['reference_date'] >= datetime.date(2025, 11, 19)]
+
+    def _iter_location_dataframes(self) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """Yield `(location, location_df)` pairs for every location in the dump."""
+        if not self.out_of_core:
+            for loc, loc_df in self.df_data.groupby("location"):
+                if self.only_locations is not None and str(loc) not in self.only_locations:
+                    continue
+                if not self.lean:
+                    loc_df = loc_df.copy()
+                    self.location_dataframes[str(loc)] = loc_df
+                yield str(loc), loc_df
+            return
+
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+
+        # `location` is not a partition key of hub datasets, so filtering the hub per location would scan
+        # every file once per location. Instead the hub is scanned once, streamed into a temporary
+        # location-partitioned copy, and each location is read back from its own directory.
+        with tempfile.TemporaryDirectory(prefix="respilens-locations-") as spill:
+            partitioning = ds.partitioning(
+                pa.schema([self.df_data.schema.field("location")]), flavor="hive"
+            )
+            with span("partition"):
+                ds.write_dataset(
+                    self.df_data, spill, format="parquet", partitioning=partitioning,
+                    preserve_order=True, max_partitions=1_000_000,
+                )
+            partitioned = ds.dataset(spill, format="parquet", partitioning=partitioning)
+            locations = sorted(
+                urllib.parse.unquote(path.name.split("=", 1)[1])
+                for path in Path(spill).iterdir() if path.name != "location=__HIVE_DEFAULT_PARTITION__"
+            )
+            for loc in locations:
+                # Partition pruning: only this location's directory is read
+                with span("load") as timing:
+                    table = partitioned.to_table(filter=pc.field("location") == loc)
+                    timing.add(rows=table.num_rows)
+                loc_df = clean_nan_values(self.config.preprocess(table.to_pandas()))
+                del table
+                if loc_df.empty:
+                    continue
+                if loc in self._nowcasts_by_location:
+                    loc_df = pd.concat([loc_df, _match_date_columns(self._nowcasts_by_location[loc], loc_df)], ignore_index=True)
+                self.locations_in_this_dump.add(loc)
+                if self.is_metro_cast:
+                    loc_df = self._apply_metro_cast_filter(loc_df)
+                    if loc_df.empty:
+                        continue
+                yield loc, loc_df
 
     def _build_outputs(self) -> None:
         """Create per-location JSON payloads."""
-        locations_gbo = self.df_data.groupby("location")
-        for loc, loc_df in locations_gbo:
-            loc_str = str(loc)
-            loc_df = loc_df.copy()
-            self.location_dataframes[loc_str] = loc_df
+        ensembles_by_location: Dict[str, pd.DataFrame] = {}
+        if self.build_ensembles and not self.out_of_core: # one pass over the whole hub, split by location afterwards
+            with span("ensembles", rows=len(self.df_data)):
+                ensembles = compute_ensemble_quantiles(
+                    self.df_data,
+                    exclude_targets=self.config.peak_target_names,
+                    exclude_models=self._ensemble_exclusions,
+                    quantile_levels=self.config.quantile_levels,
+                )
+                ensembles_by_location = {str(loc): loc_ensemble for loc, loc_ensemble in ensembles.groupby("location")}
+                if not ensembles.empty: # every location's, including any not rebuilt (`only_locations`)
+                    self._ensemble_availability.append(ensemble_availability(ensembles))
+        if self.only_locations is not None: # the metadata model list covers the locations not rebuilt too
+            self._all_models.update(dict.fromkeys(str(model) for model in pd.unique(self.df_data["model_id"])))
+            if ensembles_by_location:
+                self._all_models.update(dict.fromkeys(ENSEMBLE_MODELS.values()))
+
+        previous_scores_by_location: Dict[str, pd.DataFrame] = {}
+        if self.score_forecasts and self.previous_scores is not None:
+            previous_scores_by_location = {
+                str(loc): loc_scores for loc, loc_scores in self.previous_scores.groupby("location")
+            }
+        score_parts = []
+
+        for loc_str, loc_df in self._iter_location_dataframes():
+            add_counts(groups=1, rows=len(loc_df))
+            self._all_models.update(dict.fromkeys(str(model) for model in loc_df["model_id"]))
+            if self.out_of_core:
+                self._availability_parts.append(loc_df[list(AVAILABILITY_COLUMNS)].drop_duplicates())
 
             if self.is_metro_cast:
                 location_abbreviation = loc_df['location'].iloc[0]
@@ -86,27 +414,85 @@ class HubDataProcessorBase:
                 )
             file_name = f"{location_abbreviation}_{self.config.file_suffix}.json"
 
-            ground_truth_df = self._prepare_ground_truth_df(location=loc_str)
-            self.ground_truth_dataframes[loc_str] = ground_truth_df.copy()
+            with span("ground_truth"):
+                ground_truth_df = self._prepare_ground_truth_df(location=loc_str)
+                if not self.out_of_core and not self.lean:
+                    self.ground_truth_dataframes[loc_str] = ground_truth_df.copy()
+                ground_truth = self._format_ground_truth_output(ground_truth_df=ground_truth_df)
 
             metadata = self._build_metadata_key(df=loc_df)
-            ground_truth = self._format_ground_truth_output(ground_truth_df=ground_truth_df)
-            forecasts, peaks = self._build_forecasts_key(df=loc_df)
+            with span("forecasts", rows=len(loc_df)):
+                typed_loc_df = split_output_type_id(loc_df, date_targets=self.config.peak_week_targets)
+                forecasts, peaks = self._build_forecasts_key(df=typed_loc_df)
+            if self.build_ensembles:
+                ensemble_df = (
+                    compute_ensemble_quantiles(
+                        typed_loc_df,
+                        exclude_targets=self.config.peak_target_names,
+                        exclude_models=self._ensemble_exclusions,
+                        quantile_levels=self.config.quantile_levels,
+                    )
+                    if self.out_of_core
+                    else ensembles_by_location.get(loc_str)
+                )
+                if ensemble_df is not None and not ensemble_df.empty:
+                    add_ensemble_forecasts(forecasts, ensemble_df)
+                    if self.out_of_core:
+                        self._ensemble_availability.append(ensemble_availability(ensemble_df))
+                    metadata["hubverse_keys"]["models"].extend(ENSEMBLE_MODELS.values())
+                    self._all_models.update(dict.fromkeys(ENSEMBLE_MODELS.values()))
+            if self.score_forecasts:
+                with span("scoring"):
+                    score_parts.append(score_quantile_forecasts(
+                        typed_loc_df,
+                        ground_truth_df,
+                        observation_column=self.config.observation_column,
+                        previous_scores=previous_scores_by_location.get(loc_str),
+                        exclude_targets=self.config.peak_target_names,
+                    ))
 
             if peaks is None:
-                self.output_dict[file_name] = {
+                payload = {
                     "metadata": metadata,
                     "ground_truth": ground_truth,
                     "forecasts": forecasts,
                 }
             else:
-                self.output_dict[file_name] = {
+                payload = {
                     "metadata": metadata,
                     "ground_truth": ground_truth,
                     "forecasts": forecasts,
                     "peaks": peaks,
                 }
 
+            with span("payloads"):
+                if self.output_layout in ("single", "both"):
+                    self.output_dict[file_name] = self._encode_payload(payload)
+                self.output_dict[f"{file_name[:-len('.json')]}_latest.json"] = self._encode_payload(
+                    latest_projection_payload(payload, ground_truth_weeks=self.config.latest_ground_truth_weeks)
+                )
+                if self.output_layout in ("sharded", "both"):
+                    shard_dir = file_name[:-len(".json")]
+                    for shard_name, shard in shard_projection_payload(payload).items():
+                        if self.only_shards is not None and shard_name not in self.only_shards:
+                            continue
+                        self.output_dict[f"{shard_dir}/{shard_name}"] = (
+                            shard if shard_name == "index.json" else self._encode_payload(shard)
+                        )
+
+        if self.score_forecasts:
+            if self.only_locations is not None and self.previous_scores is not None:
+                score_parts.extend(
+                    loc_scores for loc, loc_scores in previous_scores_by_location.items() if loc not in self.only_locations
+                )
+            self.scores = concat_scores(score_parts)
+
+    def _encode_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert an assembled projections payload to the configured `payload_format`."""
+        if self.payload_format == "compact":
+            return compact_projection_payload(payload, significant_digits=self.significant_digits)
+        return payload
+
     def _build_metadata_key(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Build metadata section of an individual JSON file."""
         location = str(df["location"].iloc[0])
@@ -216,63 +602,70 @@ class HubDataProcessorBase:
 
     def _build_peaks_key(self, peaks_df: pd.DataFrame) -> Dict[str, Any]:
         """
-        Build the `peaks` key of RespiLens JSON for hubs that participate in:
-            - peak inc flu hosp
-            - peak week inc flu hosp
-        targets
+        Build the `peaks` key of RespiLens JSON from the rows of the config's peak targets.
+
+        Table-driven by `HubDatasetConfig.peak_targets`: rows of other output types are skipped,
+        and the rest are laid out per PEAK_OUTPUT_TYPES in one pass over rows sorted by
+        (reference date, declared target order, model).
         """
-        
+        if "output_type_id_kind" not in peaks_df.columns:
+            peaks_df = split_output_type_id(peaks_df, date_targets=self.config.peak_week_targets)
+        declared = dict(self.config.peak_targets)
+        target_order = {target: i for i, target in enumerate(declared)}
+        peaks_df = peaks_df[
+            peaks_df["target"].isin(list(declared))
+            & (peaks_df["output_type"].astype(str) == peaks_df["target"].map(declared).astype(str))
+        ]
         peaks: Dict[str, Any] = {}
-        peak_inc = peaks_df[peaks_df['target'] == 'peak inc flu hosp']
-        peak_week = peaks_df[peaks_df['target'] == 'peak week inc flu hosp']
-        peak_inc_gbo = peak_inc.groupby(['reference_date', 'model_id'])
-        peak_week_gbo = peak_week.groupby(["reference_date", "model_id"])
-
-        for _, grouped_df in peak_inc_gbo: # handle PEAK INC FLU HOSP
-            reference_date = str(grouped_df["reference_date"].iloc[0])
-            target = 'peak inc flu hosp'
-            model = str(grouped_df["model_id"].iloc[0])
+        if peaks_df.empty:
+            return peaks
 
-            reference_date_dict = peaks.setdefault(reference_date, {})
-            target_dict = reference_date_dict.setdefault(target, {})
-            model_dict = target_dict.setdefault(model, {})
-            model_dict['type'] = "quantile"
-            predictions_dict = model_dict.setdefault("predictions", {})
-            predictions_dict["quantiles"] = list(grouped_df["output_type_id"])
-            predictions_dict["values"] = list(grouped_df["value"])
-
-        for _, grouped_df in peak_week_gbo: # handle PEAK WEEK INC FLU HOSP
-            reference_date = str(grouped_df["reference_date"].iloc[0])
-            target = 'peak week inc flu hosp'
-            model = str(grouped_df["model_id"].iloc[0])
+        reference_dates = peaks_df["reference_date"].astype(str).to_numpy()
+        target_codes = peaks_df["target"].map(target_order).to_numpy(dtype=int)
+        models = peaks_df["model_id"].astype(str).to_numpy()
+        order = np.lexsort((models, target_codes, reference_dates)) # stable: rows keep their order within a model
+        reference_dates, target_codes, models = reference_dates[order], target_codes[order], models[order]
+        ids = output_type_id_values(peaks_df.iloc[order])
+        values = peaks_df["value"].to_numpy(dtype=object)[order].tolist()
 
-            reference_date_dict = peaks.setdefault(reference_date, {})
-            target_dict = reference_date_dict.setdefault(target, {})
-            model_dict = target_dict.setdefault(model, {})
-            model_dict['type'] = "pmf"
-            predictions_dict = model_dict.setdefault("predictions", {})
-            predictions_dict["peak week"] = list(grouped_df["output_type_id"])
-            predictions_dict["probabilities"] = list(grouped_df["value"])
-        
+        changes = (
+            (reference_dates[1:] != reference_dates[:-1])
+            | (target_codes[1:] != target_codes[:-1])
+            | (models[1:] != models[:-1])
+        )
+        starts = np.flatnonzero(np.concatenate(([True], changes))).tolist()
+        targets = list(declared)
+        for start, end in zip(starts, starts[1:] + [len(order)]):
+            target = targets[target_codes[start]]
+            output_type = declared[target]
+            id_key, value_key = PEAK_OUTPUT_TYPES[output_type]
+            peaks.setdefault(str(reference_dates[start]), {}).setdefault(target, {})[str(models[start])] = {
+                "type": output_type,
+                "predictions": {id_key: ids[start:end], value_key: values[start:end]},
+            }
         return peaks
 
 
     def _build_forecasts_key(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """Build the forecasts section of an individual JSON file."""
+        """
+        Build the forecasts section of an individual JSON file.
+
+        Works on the typed `output_type_id` columns from `helper.split_output_type_id`
+        (split here if `df` still carries the raw mixed-type column). Rows of the config's
+        peak targets go to the `peaks` section instead (None if the dataset has none).
+        """
+        if "output_type_id_kind" not in df.columns:
+            df = split_output_type_id(df, date_targets=self.config.peak_week_targets)
         forecasts: Dict[str, Any] = {}
         
-        # Define the peak targets
-        peak_targets = {'peak inc flu hosp', 'peak week inc flu hosp'}
-        standard_forecasts_df = df.copy()
-        peak_flu_targets_df = pd.DataFrame()
-        peak_targets_flag = False
-        
         # Filter the main DataFrame into two parts: standard targets and peak targets
-        if peak_targets.intersection(set(df['target'])):
-            is_peak = df["target"].isin(peak_targets)
-            peak_flu_targets_df = df[is_peak].copy()
-            peak_targets_flag = True
-            standard_forecasts_df = df[~is_peak]
+        standard_forecasts_df = df
+        peak_targets_df = None
+        if self.config.peak_targets:
+            is_peak = df["target"].isin(self.config.peak_target_names)
+            if is_peak.any():
+                peak_targets_df = df[is_peak]
+                standard_forecasts_df = df[~is_peak]
         full_gbo = standard_forecasts_df.groupby(["reference_date", "target", "model_id", "horizon", "output_type"])
         
         for _, grouped_df in full_gbo:
@@ -294,7 +687,7 @@ class HubDataProcessorBase:
                 predictions_dict = model_dict.setdefault("predictions", {})
                 predictions_dict[horizon] = {
                     "date": str(grouped_df["target_end_date"].iloc[0]),
-                    "quantiles": list(grouped_df["output_type_id"]),
+                    "quantiles": output_type_id_values(grouped_df),
                     "values": list(grouped_df["value"]),
                 }
             elif output_type == "pmf":
@@ -302,7 +695,7 @@ class HubDataProcessorBase:
                 predictions_dict = model_dict.setdefault("predictions", {})
                 predictions_dict[horizon] = {
                     "date": str(grouped_df["target_end_date"].iloc[0]),
-                    "categories": list(grouped_df["output_type_id"]),
+                    "categories": output_type_id_values(grouped_df),
                     "probabilities": list(grouped_df["value"]),
                 }
             else:
@@ -313,10 +706,10 @@ class HubDataProcessorBase:
                 )
         
         # If has peaks, redirect to other method
-        if peak_targets_flag: 
-            peaks = self._build_peaks_key(peaks_df=peak_flu_targets_df)
-        else:
-            peaks = None
+        peaks = None
+        if peak_targets_df is not None:
+            with span("peaks", rows=len(peak_targets_df)):
+                peaks = self._build_peaks_key(peaks_df=peak_targets_df)
 
         return forecasts, peaks 
 
@@ -325,10 +718,27 @@ class HubDataProcessorBase:
         unique_models_from_loc_df = dict.fromkeys(df["model_id"])
         return [str(model) for model in unique_models_from_loc_df.keys()]
 
+    def _build_availability_file(self) -> Dict[str, Any]:
+        """Build dataset-level availability.json contents (which models forecast which target/location/week)."""
+        if self.out_of_core:
+            availability_df = (
+                pd.concat(self._availability_parts, ignore_index=True)
+                if self._availability_parts
+                else pd.DataFrame(columns=list(AVAILABILITY_COLUMNS))
+            )
+            self._availability_parts = []
+        else:
+            availability_df = self.df_data
+        if self._ensemble_availability:
+            availability_df = pd.concat(
+                [availability_df[list(AVAILABILITY_COLUMNS)], *self._ensemble_availability], ignore_index=True
+            )
+            self._ensemble_availability = []
+        return build_availability_index(availability_df)
+
     def _build_all_models_list(self) -> list:
-        """Build list of all models seen across the dataset."""
-        unique_models_from_primary_df = dict.fromkeys(self.df_data["model_id"])
-        return [str(model) for model in unique_models_from_primary_df.keys()]
+        """Build list of all models seen across the dataset (accumulated per location)."""
+        return list(self._all_models.keys())
 
     def _build_metadata_file(self, all_models: list[str]) -> Dict[str, Any]:
         """Build dataset-level metadata.json contents."""
@@ -340,9 +750,10 @@ class HubDataProcessorBase:
         filtered_locations_data = self.locations_data[self.locations_data['location'].isin(self.locations_in_this_dump)]
         if self.is_metro_cast: # different building for metrocast (stems from locations.csv structure)
             for _, row in filtered_locations_data.iterrows():
-                file_name = str(row["location"]) + "_flu_metrocast.json"
                 location_info = {
-                    "location": self.output_dict[file_name]["metadata"]["location"],
+                    "location": get_location_info(
+                        self.locations_data, location=str(row["location"]), value_needed="original_location_code"
+                    ),
                     "abbreviation": str(row["location"]),
                     "location_name": str(row["location_name"]),
                     "population": None if row["population"] is None else float(row["population"]),
@@ -359,3 +770,496 @@ class HubDataProcessorBase:
                 metadata_file_contents["locations"].append(location_info)
 
         return metadata_file_contents
+
+
+def latest_projection_payload(payload: Dict[str, Any], ground_truth_weeks: int) -> Dict[str, Any]:
+    """
+    Build a compact "first paint" payload holding only the newest reference date.
+
+    The result has the single-file layout's keys, with `forecasts`/`peaks` limited to the
+    latest reference date and `ground_truth` limited to the `ground_truth_weeks` weeks before
+    it (plus anything observed since). It slices the already-built dicts; no DataFrame work.
+    """
+    forecasts = payload["forecasts"]
+    peaks = payload.get("peaks")
+    reference_dates = set(forecasts) | set(peaks or {})
+    latest = max(reference_dates) if reference_dates else None
+
+    ground_truth = payload["ground_truth"]
+    start = 0
+    if latest is not None:
+        cutoff = (pd.Timestamp(latest) - pd.Timedelta(weeks=ground_truth_weeks)).strftime("%Y-%m-%d")
+        start = bisect.bisect_left(ground_truth["dates"], cutoff) # dates are sorted ISO strings
+    trimmed_truth = {key: values[start:] for key, values in ground_truth.items()}
+
+    latest_payload = {
+        "metadata": payload["metadata"],
+        "ground_truth": trimmed_truth,
+        "forecasts": {latest: forecasts[latest]} if latest in forecasts else {},
+    }
+    if peaks is not None:
+        latest_payload["peaks"] = {latest: peaks[latest]} if latest in peaks else {}
+    return latest_payload
+
+
+def shard_projection_payload(payload: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Split a single-file projections payload into per-reference-date shards plus a small index.
+
+    Returns `{shard_name: contents}` with `index.json`, `ground_truth.json` and one
+    `{reference_date}.json` per reference date. Each shard holds that week's `forecasts`
+    (and `peaks`, if any) under the same keys as the single-file layout, so the frontend
+    can fetch the index and latest week first and load the rest on demand.
+    """
+    forecasts = payload["forecasts"]
+    peaks = payload.get("peaks") or {}
+    reference_dates = sorted(set(forecasts) | set(peaks))
+
+    shards: Dict[str, Dict[str, Any]] = {
+        "ground_truth.json": {
+            "metadata": payload["metadata"],
+            "ground_truth": payload["ground_truth"],
+        },
+    }
+    index_entries: Dict[str, Any] = {}
+    for reference_date in reference_dates:
+        shard_name = f"{reference_date}.json"
+        shard = {
+            "metadata": {**payload["metadata"], "reference_date": reference_date},
+            "forecasts": {reference_date: forecasts.get(reference_date, {})},
+        }
+        if reference_date in peaks:
+            shard["peaks"] = {reference_date: peaks[reference_date]}
+        shards[shard_name] = shard
+
+        targets = {**forecasts.get(reference_date, {}), **peaks.get(reference_date, {})}
+        models = dict.fromkeys(model for target_dict in targets.values() for model in target_dict)
+        index_entries[reference_date] = {
+            "file": shard_name,
+            "targets": list(targets),
+            "models": list(models),
+        }
+
+    shards["index.json"] = {
+        "metadata": payload["metadata"],
+        "reference_dates": reference_dates,
+        "latest_reference_date": reference_dates[-1] if reference_dates else None,
+        "ground_truth_file": "ground_truth.json",
+        "shards": index_entries,
+    }
+    return shards
+
+
+def compact_projection_payload(payload: Dict[str, Any], significant_digits: int = 4) -> Dict[str, Any]:
+    """
+    Re-encode a default-schema projections payload in the compact schema (COMPACT_SCHEMA_VERSION).
+
+    Quantile levels, dates and categories are stored once per file in `tables` and referenced
+    by index. Each `forecasts[reference_date][target][model]` entry becomes one columnar block:
+    `horizons`, `dates` (one per horizon), the `quantiles`/`categories` it uses, and a
+    horizon x level `values`/`probabilities` matrix (null where a horizon lacks a level).
+    Peaks keep one flat list per model. Values and ground truth are rounded to
+    `significant_digits`, and integral values are written as integers.
+    """
+    forecasts = payload.get("forecasts")
+    peaks = payload.get("peaks")
+    levels, dates, categories = set(), set(), {}
+    for target_dicts in (forecasts or {}).values():
+        for model_dicts in target_dicts.values():
+            for model_dict in model_dicts.values():
+                for prediction in model_dict["predictions"].values():
+                    dates.add(prediction["date"])
+                    if model_dict["type"] == "quantile":
+                        levels.update(prediction["quantiles"])
+                    else:
+                        categories.update(dict.fromkeys(prediction["categories"]))
+    for target_dicts in (peaks or {}).values():
+        for model_dicts in target_dicts.values():
+            for model_dict in model_dicts.values():
+                if model_dict["type"] == "quantile":
+                    levels.update(model_dict["predictions"]["quantiles"])
+                else:
+                    dates.update(model_dict["predictions"]["peak week"])
+
+    tables = {"quantiles": sorted(levels), "dates": sorted(dates), "categories": list(categories)}
+    index = {name: {item: i for i, item in enumerate(table)} for name, table in tables.items()}
+
+    compact: Dict[str, Any] = {"schema_version": COMPACT_SCHEMA_VERSION}
+    for key, value in payload.items():
+        if key == "ground_truth":
+            compact[key] = {
+                column: values if column == "dates" else _round_significant(values, significant_digits)
+                for column, values in value.items()
+            }
+        elif key == "forecasts":
+            compact["tables"] = tables
+            compact[key] = {
+                reference_date: {
+                    target: {
+                        model: _compact_forecast(model_dict, index, significant_digits)
+                        for model, model_dict in model_dicts.items()
+                    }
+                    for target, model_dicts in target_dicts.items()
+                }
+                for reference_date, target_dicts in value.items()
+            }
+        elif key == "peaks":
+            compact[key] = {
+                reference_date: {
+                    target: {
+                        model: _compact_peak(model_dict, index, significant_digits)
+                        for model, model_dict in model_dicts.items()
+                    }
+                    for target, model_dicts in target_dicts.items()
+                }
+                for reference_date, target_dicts in value.items()
+            }
+        else:
+            compact[key] = value
+    return compact
+
+
+def expand_compact_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reference decoder: turn a `compact_projection_payload` result back into the default schema.
+
+    Null cells of a forecast matrix are dropped, so a level the model did not submit for a
+    horizon and a submitted null value both decode as absent.
+    """
+    tables = payload.get("tables", {})
+    expanded: Dict[str, Any] = {}
+    for key, value in payload.items():
+        if key in ("schema_version", "tables"):
+            continue
+        if key == "forecasts":
+            expanded[key] = {
+                reference_date: {
+                    target: {model: _expand_forecast(block, tables) for model, block in model_blocks.items()}
+                    for target, model_blocks in target_blocks.items()
+                }
+                for reference_date, target_blocks in value.items()
+            }
+        elif key == "peaks":
+            expanded[key] = {
+                reference_date: {
+                    target: {model: _expand_peak(block, tables) for model, block in model_blocks.items()}
+                    for target, model_blocks in target_blocks.items()
+                }
+                for reference_date, target_blocks in value.items()
+            }
+        else:
+            expanded[key] = value
+    return expanded
+
+
+def _round_significant(values: Any, significant_digits: int) -> list:
+    """Round a (nested) list of numbers to `significant_digits`, mapping NaN/None to None and integral floats to int."""
+    array = np.array(values, dtype=float) # None becomes NaN
+    rounded = array.copy()
+    nonzero = np.isfinite(array) & (array != 0)
+    exponents = np.zeros(array.shape, dtype=int)
+    exponents[nonzero] = significant_digits - 1 - np.floor(np.log10(np.abs(array[nonzero]))).astype(int)
+    # scale by an exact power of ten in whichever direction avoids dividing by 0.1, 0.01, ...
+    up = nonzero & (exponents >= 0)
+    down = nonzero & (exponents < 0)
+    rounded[up] = np.round(array[up] * 10.0 ** exponents[up]) / 10.0 ** exponents[up]
+    rounded[down] = np.round(array[down] / 10.0 ** -exponents[down]) * 10.0 ** -exponents[down]
+    return json_numbers(rounded.tolist())
+
+
+def _compact_forecast(model_dict: Dict[str, Any], index: Dict[str, Dict[Any, int]], significant_digits: int) -> Dict[str, Any]:
+    is_quantile = model_dict["type"] == "quantile"
+    level_key, value_key = ("quantiles", "values") if is_quantile else ("categories", "probabilities")
+    predictions = model_dict["predictions"]
+    horizons = list(predictions)
+    columns = sorted(
+        dict.fromkeys(level for horizon in horizons for level in predictions[horizon][level_key]),
+        key=index[level_key].__getitem__,
+    )
+    position = {level: i for i, level in enumerate(columns)}
+    matrix = np.full((len(horizons), len(columns)), np.nan)
+    for row, horizon in enumerate(horizons):
+        prediction = predictions[horizon]
+        matrix[row, [position[level] for level in prediction[level_key]]] = [
+            np.nan if value is None else value for value in prediction[value_key]
+        ]
+    return {
+        "type": model_dict["type"],
+        "horizons": [int(horizon) for horizon in horizons],
+        "dates": [index["dates"][predictions[horizon]["date"]] for horizon in horizons],
+        level_key: [index[level_key][level] for level in columns],
+        value_key: _round_significant(matrix, significant_digits),
+    }
+
+
+def _compact_peak(model_dict: Dict[str, Any], index: Dict[str, Dict[Any, int]], significant_digits: int) -> Dict[str, Any]:
+    predictions = model_dict["predictions"]
+    if model_dict["type"] == "quantile":
+        return {
+            "type": "quantile",
+            "quantiles": [index["quantiles"][level] for level in predictions["quantiles"]],
+            "values": _round_significant(predictions["values"], significant_digits),
+        }
+    return {
+        "type": model_dict["type"],
+        "dates": [index["dates"][date] for date in predictions["peak week"]],
+        "probabilities": _round_significant(predictions["probabilities"], significant_digits),
+    }
+
+
+def _expand_forecast(block: Dict[str, Any], tables: Dict[str, list]) -> Dict[str, Any]:
+    is_quantile = block["type"] == "quantile"
+    level_key, value_key = ("quantiles", "values") if is_quantile else ("categories", "probabilities")
+    levels = [tables[level_key][i] for i in block[level_key]]
+    predictions = {}
+    for horizon, date_index, row in zip(block["horizons"], block["dates"], block[value_key]):
+        kept = [(level, value) for level, value in zip(levels, row) if value is not None]
+        predictions[str(horizon)] = {
+            "date": tables["dates"][date_index],
+            level_key: [level for level, _ in kept],
+            value_key: [value for _, value in kept],
+        }
+    return {"type": block["type"], "predictions": predictions}
+
+
+def _expand_peak(block: Dict[str, Any], tables: Dict[str, list]) -> Dict[str, Any]:
+    if block["type"] == "quantile":
+        predictions = {"quantiles": [tables["quantiles"][i] for i in block["quantiles"]], "values": block["values"]}
+    else:
+        predictions = {"peak week": [tables["dates"][i] for i in block["dates"]], "probabilities": block["probabilities"]}
+    return {"type": block["type"], "predictions": predictions}
+
+
+def build_availability_index(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Build a compact `reference_date x target x model_id x location` availability index.
+
+    Reference dates, targets, models and locations are stored once as sorted lookup tables.
+    `availability[target][model][location]` is a run-length encoded list of `[start, length]`
+    pairs indexing into `reference_dates`: `[[0, 3], [5, 1]]` means reference dates 0, 1, 2 and 5.
+    """
+    combos = df[list(AVAILABILITY_COLUMNS)].drop_duplicates()
+    target_codes, targets = pd.factorize(combos["target"].astype(str), sort=True)
+    model_codes, models = pd.factorize(combos["model_id"].astype(str), sort=True)
+    location_codes, locations = pd.factorize(combos["location"].astype(str), sort=True)
+    date_codes, reference_dates = pd.factorize(combos["reference_date"].astype(str), sort=True)
+
+    order = np.lexsort((date_codes, location_codes, model_codes, target_codes))
+    t, m, l, d = target_codes[order], model_codes[order], location_codes[order], date_codes[order]
+    # A run continues while the (target, model, location) group is unchanged and dates are consecutive
+    continues = (t[1:] == t[:-1]) & (m[1:] == m[:-1]) & (l[1:] == l[:-1]) & (d[1:] == d[:-1] + 1)
+    run_starts = np.flatnonzero(np.concatenate(([True], ~continues))) if len(order) else np.array([], dtype=int)
+    run_lengths = np.diff(np.append(run_starts, len(order)))
+
+    availability: Dict[str, Any] = {}
+    for start, length in zip(run_starts.tolist(), run_lengths.tolist()):
+        target_dict = availability.setdefault(targets[t[start]], {})
+        model_dict = target_dict.setdefault(models[m[start]], {})
+        model_dict.setdefault(locations[l[start]], []).append([int(d[start]), length])
+
+    return {
+        "last_updated": pd.Timestamp.now(tz='UTC').strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "reference_dates": list(reference_dates),
+        "targets": list(targets),
+        "models": list(models),
+        "locations": list(locations),
+        "availability": availability,
+    }
+
+
+def build_ground_truth_vintages(
+    target_data: pd.DataFrame,
+    observation_column: str = "observation",
+    min_date: Optional[pd.Timestamp] = None,
+    dataset_label: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Encode every `as_of` vintage of the target data as base values plus sparse revisions.
+
+    Vintages (`as_of`), target end dates, targets and locations are stored once as sorted tables.
+    For each `series[target][location]`, `dates`, `first_as_of` and `base` give every date's first
+    reported value and the vintage that reported it. `revisions` lists later changes as parallel
+    `as_of`/`dates`/`deltas` arrays sorted by vintage, where `dates` are positions in the series'
+    `dates`. The value as of vintage V is `base` plus every delta with `as_of <= V`, for dates
+    whose `first_as_of <= V` (see `ground_truth_as_of`). Built in one sorted pass over all rows.
+    """
+    columns = ["target", "location", "target_end_date", "as_of", observation_column]
+    missing = set(columns) - set(target_data.columns)
+    if missing:
+        raise ValueError(f"Target data needs `as_of` vintages and targets to record revisions; missing columns {sorted(missing)}")
+    df = target_data[columns].dropna(subset=[observation_column, "as_of"])
+    end_dates = pd.to_datetime(df["target_end_date"])
+    if min_date is not None:
+        keep = (end_dates >= pd.Timestamp(min_date)).to_numpy()
+        df, end_dates = df[keep], end_dates[keep]
+
+    target_codes, targets = pd.factorize(df["target"].astype(str), sort=True)
+    location_codes, locations = pd.factorize(df["location"].astype(str), sort=True)
+    date_codes, dates = pd.factorize(end_dates.dt.strftime("%Y-%m-%d"), sort=True)
+    as_of_codes, as_ofs = pd.factorize(pd.to_datetime(df["as_of"]).dt.strftime("%Y-%m-%d"), sort=True)
+    values = pd.to_numeric(df[observation_column], errors="coerce").to_numpy(dtype=float)
+
+    order = np.lexsort((as_of_codes, date_codes, location_codes, target_codes))
+    t, l, d, a, v = target_codes[order], location_codes[order], date_codes[order], as_of_codes[order], values[order]
+    # A repeated (series, date, as_of) keeps its last row
+    last_of_vintage = np.ones(len(order), dtype=bool)
+    last_of_vintage[:-1] = (t[1:] != t[:-1]) | (l[1:] != l[:-1]) | (d[1:] != d[:-1]) | (a[1:] != a[:-1])
+    t, l, d, a, v = t[last_of_vintage], l[last_of_vintage], d[last_of_vintage], a[last_of_vintage], v[last_of_vintage]
+
+    new_series = np.concatenate(([True], (t[1:] != t[:-1]) | (l[1:] != l[:-1])))
+    new_date = new_series | np.concatenate(([True], d[1:] != d[:-1]))
+    deltas = np.round(np.diff(v, prepend=np.nan), 10)
+    is_revision = ~new_date & (deltas != 0)
+    # position of each row's date within its series
+    date_positions = np.cumsum(new_date) - 1
+    series_first_position = date_positions[new_series]
+    series_index = np.cumsum(new_series) - 1
+    date_positions = date_positions - series_first_position[series_index]
+
+    series_starts = np.flatnonzero(new_series).tolist()
+    series_ends = series_starts[1:] + [len(t)]
+    series: Dict[str, Any] = {}
+    for start, end in zip(series_starts, series_ends):
+        base_rows = np.flatnonzero(new_date[start:end]) + start
+        revision_rows = np.flatnonzero(is_revision[start:end]) + start
+        revision_rows = revision_rows[np.argsort(a[revision_rows], kind="stable")]
+        series.setdefault(targets[t[start]], {})[locations[l[start]]] = {
+            "dates": d[base_rows].tolist(),
+            "first_as_of": a[base_rows].tolist(),
+            "base": json_numbers(v[base_rows].tolist()),
+            "revisions": {
+                "as_of": a[revision_rows].tolist(),
+                "dates": date_positions[revision_rows].tolist(),
+                "deltas": json_numbers(deltas[revision_rows].tolist()),
+            },
+        }
+
+    return {
+        "last_updated": pd.Timestamp.now(tz='UTC').strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "dataset": dataset_label,
+        "as_of": list(as_ofs),
+        "dates": list(dates),
+        "targets": list(targets),
+        "locations": list(locations),
+        "series": series,
+    }
+
+
+def ground_truth_as_of(vintages: Dict[str, Any], as_of: str) -> pd.DataFrame:
+    """Reconstruct the ground truth known on `as_of` from a `build_ground_truth_vintages` payload."""
+    as_of_index = bisect.bisect_right(vintages["as_of"], as_of) - 1
+    rows = []
+    for target, locations in vintages["series"].items():
+        for location, encoded in locations.items():
+            values = np.array(encoded["base"], dtype=float)
+            revisions = encoded["revisions"]
+            applied = bisect.bisect_right(revisions["as_of"], as_of_index)
+            np.add.at(values, revisions["dates"][:applied], revisions["deltas"][:applied])
+            known = np.array(encoded["first_as_of"]) <= as_of_index
+            for date_index, value in zip(np.array(encoded["dates"])[known], values[known]):
+                rows.append((target, location, vintages["dates"][date_index], float(value)))
+    return pd.DataFrame(rows, columns=["target", "location", "target_end_date", "observation"])
+
+
+def _match_date_columns(rows: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    """Give `rows`' `reference_date`/`target_end_date` the representation used in `like` (ISO strings, dates or timestamps)."""
+    rows = rows.copy()
+    for column in ("reference_date", "target_end_date"):
+        sample = like[column].dropna()
+        if sample.empty:
+            continue
+        dates = pd.to_datetime(rows[column])
+        if isinstance(sample.iloc[0], str):
+            rows[column] = dates.dt.strftime("%Y-%m-%d")
+        elif isinstance(sample.iloc[0], pd.Timestamp):
+            rows[column] = dates
+        else:
+            rows[column] = dates.dt.date
+    return rows
+
+
+def compute_ensemble_quantiles(
+    df: pd.DataFrame,
+    exclude_targets: Iterable[str] = PEAK_TARGETS,
+    exclude_models: Iterable[str] = (),
+    quantile_levels: Optional[Iterable[float]] = DEFAULT_QUANTILE_LEVELS,
+) -> pd.DataFrame:
+    """
+    Compute quantile-mean and quantile-median ensembles across models in one grouped pass.
+
+    Uses the quantile rows of `df` (raw `output_type_id` or typed `quantile_level`) at `quantile_levels` (all levels
+    if None), outside `exclude_targets` (peak targets) and `exclude_models` (e.g. hub ensembles, the baseline and
+    generated nowcasts), and aggregates per (location, reference_date, target, horizon, quantile_level). Returns one
+    row per group with `mean`, `median` and `target_end_date` columns. Members need not share every level, so each
+    aggregate is sorted across the levels of its (location, reference_date, target, horizon) to keep it monotone.
+    """
+    group_keys = ["location", "reference_date", "target", "horizon"]
+    is_member = (df["output_type"] == "quantile") & ~df["target"].isin(list(exclude_targets))
+    exclude_models = list(exclude_models)
+    if exclude_models:
+        is_member &= ~df["model_id"].isin(exclude_models)
+    quantile_rows = df[is_member]
+    levels = (
+        quantile_rows["quantile_level"]
+        if "quantile_level" in quantile_rows.columns
+        else pd.to_numeric(quantile_rows["output_type_id"], errors="coerce")
+    ).astype(float)
+    if quantile_levels is not None:
+        in_levels = levels.isin(list(quantile_levels))
+        quantile_rows, levels = quantile_rows[in_levels], levels[in_levels]
+    frame = pd.DataFrame({
+        "location": quantile_rows["location"].astype(str),
+        "reference_date": quantile_rows["reference_date"],
+        "target": quantile_rows["target"],
+        "horizon": quantile_rows["horizon"],
+        "quantile_level": levels,
+        "target_end_date": quantile_rows["target_end_date"],
+        "value": pd.to_numeric(quantile_rows["value"], errors="coerce"),
+    })
+    ensemble = (
+        frame.groupby([*group_keys, "quantile_level"], sort=True, dropna=True)
+        .agg(
+            mean=("value", "mean"),
+            median=("value", "median"),
+            target_end_date=("target_end_date", "first"),
+        )
+        .reset_index()
+    )
+    # Rows are ordered by group then level; sorting each aggregate within its group makes it non-decreasing in level
+    for aggregation in ENSEMBLE_MODELS:
+        ensemble[aggregation] = ensemble.sort_values([*group_keys, aggregation], kind="stable")[aggregation].to_numpy()
+    return ensemble
+
+
+def ensemble_availability(ensemble_df: pd.DataFrame) -> pd.DataFrame:
+    """`AVAILABILITY_COLUMNS` rows of the ENSEMBLE_MODELS pseudo-models for `compute_ensemble_quantiles` output."""
+    combos = ensemble_df[["target", "location", "reference_date"]].drop_duplicates()
+    return pd.concat(
+        [combos.assign(model_id=model) for model in ENSEMBLE_MODELS.values()], ignore_index=True
+    )[list(AVAILABILITY_COLUMNS)]
+
+
+def add_ensemble_forecasts(forecasts: Dict[str, Any], ensemble_df: pd.DataFrame) -> None:
+    """Insert one location's `compute_ensemble_quantiles` rows into its forecasts dict as pseudo-models."""
+    group_keys = ["reference_date", "target", "horizon"]
+    # rows are sorted by group then level, so each group is a contiguous block
+    boundaries = np.flatnonzero(
+        np.concatenate(([True], (ensemble_df[group_keys].iloc[1:].to_numpy() != ensemble_df[group_keys].iloc[:-1].to_numpy()).any(axis=1)))
+    )
+    ends = np.append(boundaries[1:], len(ensemble_df))
+    levels = ensemble_df["quantile_level"].tolist()
+    columns = {aggregation: ensemble_df[aggregation].tolist() for aggregation in ENSEMBLE_MODELS}
+    reference_dates = ensemble_df["reference_date"].to_numpy()
+    targets = ensemble_df["target"].to_numpy()
+    horizons = ensemble_df["horizon"].to_numpy()
+    dates = ensemble_df["target_end_date"].to_numpy()
+
+    for start, end in zip(boundaries.tolist(), ends.tolist()):
+        target_dict = forecasts.setdefault(str(reference_dates[start]), {}).setdefault(str(targets[start]), {})
+        for aggregation, model in ENSEMBLE_MODELS.items():
+            model_dict = target_dict.setdefault(model, {"type": "quantile", "predictions": {}})
+            model_dict["predictions"][str(horizons[start])] = {
+                "date": str(dates[start]),
+                "quantiles": levels[start:end],
+                "values": columns[aggregation][start:end],
+            }
@@ -0,0 +1,475 @@
+"""
+Opt-in timing spans and counters for the build pipeline.
+
+Stages are wrapped in `span(name, **counters)`. Spans nest, and repeated spans with the same
+name under the same parent are merged (seconds, calls and counters are summed), so a
+per-location loop reports one entry per stage rather than one per location. Nothing is
+recorded until `enable()` is called; while disabled `span` returns a shared no-op object,
+so instrumented code pays one function call and one global lookup per span.
+
+With `track_memory`, every span also records resident set size (RSS) around the stage and,
+in "tracemalloc" mode, the peak of Python/NumPy allocations made inside it. A
+`memory_budget_mb` makes the first span boundary over budget raise MemoryBudgetExceeded,
+carrying the report, instead of running on until the OS kills the process. On Linux a
+watchdog thread also samples RSS while stages run, so a single long stage that grows past
+the budget is stopped inside the stage rather than at its end.
+
+    enable(profile_stage="forecasts", track_memory="rss", memory_budget_mb=6000)
+    ... run the build ...
+    write_report("run_report.json")
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+
+class _NullSpan:
+    """Stand-in returned by `span` while instrumentation is disabled."""
+
+    __slots__ = ()
+    enabled = False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+    def add(self, **counters: float) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+MEMORY_MODES = ("rss", "tracemalloc")
+
+_MB = 1024 * 1024
+
+# Seconds between the memory watchdog's RSS samples
+WATCHDOG_INTERVAL = 0.05
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Raised at a span boundary, or by the memory watchdog inside a stage, once RSS exceeds the configured memory budget."""
+
+    def __init__(self, message: str, report: Dict[str, Any]) -> None:
+        super().__init__(message)
+        self.report = report
+
+
+def rss_bytes() -> Dict[str, Optional[int]]:
+    """
+    Current and peak (high-water mark) resident set size of this process, in bytes.
+
+    Read from /proc on Linux; elsewhere only the peak is available (from `resource`).
+    """
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status if line.startswith(("VmRSS", "VmHWM")))
+        return {"current": int(fields["VmRSS"].split()[0]) * 1024, "peak": int(fields["VmHWM"].split()[0]) * 1024}
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return {"current": None, "peak": None}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"current": None, "peak": peak if sys.platform == "darwin" else peak * 1024}
+
+
+class SpanNode:
+    """Accumulated totals of every span with one name under one parent."""
+
+    __slots__ = ("name", "seconds", "calls", "counters", "children", "memory")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.counters: Dict[str, float] = {}
+        self.children: Dict[str, "SpanNode"] = {}
+        # bytes; `rss_peak` and `alloc_peak` are maxima over calls, `rss_growth` and `alloc_net` sums
+        self.memory: Optional[Dict[str, int]] = None
+
+    def child(self, name: str) -> "SpanNode":
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = SpanNode(name)
+        return node
+
+    def record_memory(self, **measurements: Optional[int]) -> None:
+        if self.memory is None:
+            self.memory = {}
+        for name, value in measurements.items():
+            if value is None:
+                continue
+            if name in ("rss_growth", "alloc_net"):
+                self.memory[name] = self.memory.get(name, 0) + value
+            else:
+                self.memory[name] = max(self.memory.get(name, value), value)
+
+    def memory_mb(self) -> Dict[str, float]:
+        return {f"{name}_mb": round(value / _MB, 3) for name, value in (self.memory or {}).items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        node = {
+            "name": self.name,
+            "seconds": round(self.seconds, 6),
+            "calls": self.calls,
+            "counters": {name: _json_number(value) for name, value in self.counters.items()},
+        }
+        if self.memory is not None:
+            node["memory"] = self.memory_mb()
+        node["children"] = [child.to_dict() for child in self.children.values()]
+        return node
+
+
+class Span:
+    """An active span; `add(**counters)` adds to its node's counters."""
+
+    __slots__ = ("recorder", "node", "profile", "start", "rss_start", "alloc_start")
+    enabled = True
+
+    def __init__(self, recorder: "RunRecorder", node: SpanNode, profile: bool) -> None:
+        self.recorder = recorder
+        self.node = node
+        self.profile = profile
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        if self.recorder.track_memory:
+            self.recorder.enter_memory(self)
+        self.recorder.stack.append(self.node)
+        if self.profile:
+            self.recorder.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.node.seconds += time.perf_counter() - self.start
+        self.node.calls += 1
+        if self.profile:
+            self.recorder.profiler.disable()
+        self.recorder.stack.pop()
+        if self.recorder.track_memory:
+            # a budget error already in flight is not replaced by the parent spans' checks
+            self.recorder.exit_memory(self, check_budget=not isinstance(exc_info[1], MemoryBudgetExceeded))
+        return False
+
+    def add(self, **counters: float) -> None:
+        node_counters = self.node.counters
+        for name, value in counters.items():
+            node_counters[name] = node_counters.get(name, 0) + value
+
+
+class RunRecorder:
+    """
+    Collects the span tree of one run.
+
+    If `profile_stage` is set, every span with that name runs under one cProfile profiler; the
+    report lists its `profile_top` functions by cumulative time, and the raw stats are dumped
+    to `profile_output` (readable with `pstats` or snakeviz) when given.
+
+    `track_memory` is one of MEMORY_MODES (or None). "rss" records RSS at span boundaries:
+    `rss_peak` is the process high-water mark if it rose during the span, otherwise the larger
+    of the RSS at entry and exit. "tracemalloc" also traces allocations (several times slower)
+    for per-span `alloc_peak` and `alloc_net` and the source lines holding the most live memory.
+    `memory_budget_mb` (which implies "rss") is checked at every span boundary; when it is
+    exceeded the report is written to `report_path` (if set) before MemoryBudgetExceeded is raised.
+    Where RSS can be read from /proc and the recorder is created on the main thread, a watchdog
+    thread also samples RSS every `watchdog_interval` seconds and, once it is over budget,
+    signals the main thread (SIGUSR1) to raise MemoryBudgetExceeded at the stage it is running.
+    The signal is handled between Python bytecodes, so a single long NumPy or Arrow call
+    finishes first. `close()` stops the watchdog.
+    """
+
+    def __init__(
+        self,
+        profile_stage: Optional[str] = None,
+        profile_output: Optional[str] = None,
+        profile_top: int = 25,
+        track_memory: Optional[str] = None,
+        memory_budget_mb: Optional[float] = None,
+        report_path: Optional[str] = None,
+        watchdog_interval: float = WATCHDOG_INTERVAL,
+    ) -> None:
+        if track_memory is not None and track_memory not in MEMORY_MODES:
+            raise ValueError(f"`track_memory` must be one of {MEMORY_MODES}, received '{track_memory}'")
+        self.root = SpanNode("run")
+        self.stack: List[SpanNode] = [self.root]
+        self.started = pd.Timestamp.now(tz='UTC').strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.start = time.perf_counter()
+        self.profile_stage = profile_stage
+        self.profile_output = profile_output
+        self.profile_top = profile_top
+        self.report_path = report_path
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.memory_budget = None if memory_budget_mb is None else memory_budget_mb * _MB
+        self.track_memory = track_memory or ("rss" if memory_budget_mb is not None else None)
+        self.trace_allocations = self.track_memory == "tracemalloc"
+        self._alloc_stack: List[int] = [0] # highest traced allocation seen by each open span
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self.budget_exceeded: Optional[str] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._watchdog_stop = threading.Event()
+        self._watchdog_rss: Optional[int] = None
+        self._previous_handler: Any = None
+        if self.memory_budget is not None:
+            self._start_watchdog(watchdog_interval)
+
+    def span(self, name: str, counters: Dict[str, float]) -> Span:
+        node = self.stack[-1].child(name)
+        # nested spans of the profiled stage share the outer span's profiler session
+        profile = name == self.profile_stage and not any(parent.name == name for parent in self.stack[1:])
+        active = Span(self, node, profile)
+        if counters:
+            active.add(**counters)
+        return active
+
+    def enter_memory(self, active: Span) -> None:
+        rss = rss_bytes()
+        self._check_budget(rss["current"] if rss["current"] is not None else rss["peak"], active.node.name)
+        active.rss_start = rss
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self._alloc_stack[-1] = max(self._alloc_stack[-1], peak)
+            tracemalloc.reset_peak()
+            active.alloc_start = current
+            self._alloc_stack.append(current)
+
+    def exit_memory(self, active: Span, check_budget: bool = True) -> None:
+        rss = rss_bytes()
+        start = active.rss_start
+        measurements: Dict[str, Optional[int]] = {}
+        if rss["current"] is not None and start["current"] is not None:
+            measurements["rss_growth"] = rss["current"] - start["current"]
+            measurements["rss_end"] = rss["current"]
+            measurements["rss_peak"] = (
+                rss["peak"] if rss["peak"] is not None and rss["peak"] > start["peak"] else max(rss["current"], start["current"])
+            )
+        elif rss["peak"] is not None:
+            measurements["rss_peak"] = rss["peak"]
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            span_peak = max(self._alloc_stack.pop(), peak)
+            measurements["alloc_peak"] = span_peak - active.alloc_start
+            measurements["alloc_net"] = current - active.alloc_start
+            self._alloc_stack[-1] = max(self._alloc_stack[-1], span_peak)
+            tracemalloc.reset_peak()
+        active.node.record_memory(**measurements)
+        if check_budget:
+            self._check_budget(measurements.get("rss_peak"), active.node.name)
+
+    def _check_budget(self, rss: Optional[int], stage: str) -> None:
+        """Raise MemoryBudgetExceeded if `rss` (bytes) is over budget."""
+        if self.memory_budget is None or self.budget_exceeded is not None or rss is None or rss <= self.memory_budget:
+            return
+        # called outside the span's own stack entry, so the stack holds exactly its parents
+        self._exceed_budget(rss, "/".join([node.name for node in self.stack[1:]] + [stage]))
+
+    def _start_watchdog(self, interval: float) -> None:
+        if (
+            rss_bytes()["current"] is None
+            or not hasattr(signal, "SIGUSR1")
+            or threading.current_thread() is not threading.main_thread()
+        ):
+            return # span boundary checks only
+        self._previous_handler = signal.signal(signal.SIGUSR1, self._on_watchdog_signal)
+        main_thread = threading.main_thread().ident
+
+        def sample() -> None:
+            while not self._watchdog_stop.wait(interval):
+                rss = rss_bytes()["current"]
+                if rss is not None and rss > self.memory_budget:
+                    self._watchdog_rss = rss
+                    signal.pthread_kill(main_thread, signal.SIGUSR1)
+                    return
+
+        self._watchdog = threading.Thread(target=sample, name="memory-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _on_watchdog_signal(self, signum: int, frame: Any) -> None:
+        """Runs on the main thread: raise MemoryBudgetExceeded from whatever stage is running."""
+        if self._watchdog_rss is None or self.budget_exceeded is not None:
+            return
+        self._exceed_budget(self._watchdog_rss, "/".join(node.name for node in self.stack[1:]) or self.root.name)
+
+    def close(self) -> None:
+        """Stop the memory watchdog (if running) and restore the SIGUSR1 handler it replaced."""
+        if self._watchdog is None:
+            return
+        self._watchdog_stop.set()
+        self._watchdog.join()
+        self._watchdog = None
+        signal.signal(signal.SIGUSR1, self._previous_handler)
+
+    def _exceed_budget(self, rss: int, path: str) -> None:
+        self.budget_exceeded = (
+            f"RSS {rss / _MB:.0f} MB exceeded the {self.memory_budget / _MB:.0f} MB memory budget at stage '{path}'"
+        )
+        report = self.report()
+        if self.report_path:
+            _dump(report, self.report_path)
+        raise MemoryBudgetExceeded(self.budget_exceeded, report)
+
+    def report(self) -> Dict[str, Any]:
+        self.root.seconds = time.perf_counter() - self.start
+        report = {
+            "started": self.started,
+            "seconds": round(self.root.seconds, 6),
+            "spans": [child.to_dict() for child in self.root.children.values()],
+            "stages": _flatten(self.root),
+        }
+        if self.track_memory:
+            report["memory"] = self._memory_summary(report["stages"])
+        if self.profiler is not None:
+            report["profile"] = self._profile_summary()
+        return report
+
+    def _memory_summary(self, stages: Dict[str, Dict[str, Any]], top: int = 10) -> Dict[str, Any]:
+        """Process peak RSS, the stages that allocated the most, and (with tracemalloc) the largest live allocation sites."""
+        rss = rss_bytes()
+        ranking = "alloc_peak_mb" if self.trace_allocations else "rss_growth_mb"
+        ranked = sorted(
+            (path for path, stage in stages.items() if ranking in stage),
+            key=lambda path: stages[path][ranking], reverse=True,
+        )
+        summary: Dict[str, Any] = {
+            "mode": self.track_memory,
+            "rss_mb": None if rss["current"] is None else round(rss["current"] / _MB, 3),
+            "rss_peak_mb": None if rss["peak"] is None else round(rss["peak"] / _MB, 3),
+            "budget_mb": None if self.memory_budget is None else round(self.memory_budget / _MB, 3),
+            "budget_exceeded": self.budget_exceeded,
+            "top_stages": [{"stage": path, ranking: stages[path][ranking]} for path in ranked[:top]],
+        }
+        if self.trace_allocations:
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__)])
+            summary["top_allocation_sites"] = [
+                {
+                    "site": str(stat.traceback[-1]),
+                    "callers": [str(frame) for frame in list(stat.traceback)[-2:-5:-1]],
+                    "size_mb": round(stat.size / _MB, 3),
+                    "blocks": stat.count,
+                }
+                for stat in snapshot.statistics("traceback")[:top]
+            ]
+        return summary
+
+    def _profile_summary(self) -> Dict[str, Any]:
+        if self.profile_output:
+            self.profiler.dump_stats(self.profile_output)
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.profile_top]
+        return {
+            "stage": self.profile_stage,
+            "output": self.profile_output,
+            "functions": [
+                {
+                    "function": f"{filename}:{line}({function})",
+                    "calls": primitive_calls,
+                    "total_seconds": round(total_time, 6),
+                    "cumulative_seconds": round(cumulative_time, 6),
+                }
+                for (filename, line, function), (primitive_calls, _, total_time, cumulative_time, _) in rows
+            ],
+        }
+
+
+def _flatten(root: SpanNode) -> Dict[str, Dict[str, Any]]:
+    """`{"flusight/process/forecasts": {"seconds": ..., "calls": ..., ...counters}}` for every span."""
+    stages: Dict[str, Dict[str, Any]] = {}
+    pending = [(child, child.name) for child in root.children.values()]
+    while pending:
+        node, path = pending.pop(0)
+        stages[path] = {"seconds": round(node.seconds, 6), "calls": node.calls,
+                        **{name: _json_number(value) for name, value in node.counters.items()},
+                        **node.memory_mb()}
+        pending.extend((child, f"{path}/{child.name}") for child in node.children.values())
+    return stages
+
+
+def _json_number(value: float) -> float:
+    return int(value) if float(value).is_integer() else round(float(value), 6)
+
+
+_RECORDER: Optional[RunRecorder] = None
+
+
+def enable(
+    profile_stage: Optional[str] = None,
+    profile_output: Optional[str] = None,
+    track_memory: Optional[str] = None,
+    memory_budget_mb: Optional[float] = None,
+    report_path: Optional[str] = None,
+) -> RunRecorder:
+    """Start recording spans (replacing any earlier recorder) and return the recorder."""
+    global _RECORDER
+    disable()
+    _RECORDER = RunRecorder(
+        profile_stage=profile_stage,
+        profile_output=profile_output,
+        track_memory=track_memory,
+        memory_budget_mb=memory_budget_mb,
+        report_path=report_path,
+    )
+    return _RECORDER
+
+
+def disable() -> Optional[RunRecorder]:
+    """Stop recording (and any tracing it started) and return the recorder that was active, if any."""
+    global _RECORDER
+    recorder, _RECORDER = _RECORDER, None
+    if recorder is not None:
+        recorder.close()
+    if recorder is not None and recorder.trace_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return recorder
+
+
+def is_enabled() -> bool:
+    return _RECORDER is not None
+
+
+def span(name: str, **counters: float):
+    """Time the enclosed block as stage `name`, adding `counters` (e.g. rows=len(df)) to it."""
+    if _RECORDER is None:
+        return NULL_SPAN
+    return _RECORDER.span(name, counters)
+
+
+def add_counts(**counters: float) -> None:
+    """Add `counters` to the innermost active span."""
+    if _RECORDER is not None and len(_RECORDER.stack) > 1:
+        node_counters = _RECORDER.stack[-1].counters
+        for name, value in counters.items():
+            node_counters[name] = node_counters.get(name, 0) + value
+
+
+def report() -> Optional[Dict[str, Any]]:
+    """The active recorder's run report, or None while disabled."""
+    return None if _RECORDER is None else _RECORDER.report()
+
+
+def write_report(path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Write the active recorder's run report to `path` (default: its `report_path`) as JSON and return it."""
+    run_report = report()
+    path = path or (_RECORDER.report_path if _RECORDER is not None else None)
+    if run_report is not None and path:
+        _dump(run_report, path)
+    return run_report
+
+
+def _dump(run_report: Dict[str, Any], path: str) -> None:
+    with open(path, "w") as of:
+        json.dump(run_report, of, indent=4)
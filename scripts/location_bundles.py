@@ -0,0 +1,147 @@
+"""
+Per-location bundles of every dataset's latest slice, for `process_RespiLens_data.py --bundles`.
+
+A location page overlays the hub forecasts with the NHSN and NSSP series, which is one
+request per dataset. With `--bundles`, `main` keeps each dataset's latest slice per location
+while it builds (`dataset_slices`, taken from the in-memory outputs, not from disk) and
+writes one `bundles/{abbr}_bundle.json` per location at the end:
+
+    {
+        "schema_version": "bundle-1",
+        "metadata": {"location": "06", "abbreviation": "CA", "location_name": "California", "population": 39512223.0},
+        "last_updated": "2025-01-04T12:00:00Z",
+        "datasets": {
+            "flusight": {"metadata": {"dataset": "FluSight", ...}, "ground_truth": {...}, "forecasts": {...}},
+            "nhsn": {"metadata": {"dataset": "NHSN", ...}, "series": {"dates": [...], ...}},
+            "nssp": {"metadata": {"dataset": "NSSP", ...}, "locations": {"704": {"metadata": {...}, "series": {...}}}}
+        }
+    }
+
+Hub entries are the `{abbr}_{suffix}_latest.json` payloads (in whatever `--payload-format`
+they were built); series entries keep their last `series_weeks` weeks. The location keys
+(LOCATION_KEYS) are stored once in the bundle's `metadata` and dropped from every entry whose
+values match. Datasets with several files per location (SUBLOCATION_DATASETS, e.g. one NSSP
+file per health service area) list them under `locations`, keyed by their own `location`.
+"""
+
+import bisect
+from typing import Any, Dict, Iterable, Optional
+
+import pandas as pd
+
+BUNDLE_SCHEMA_VERSION = "bundle-1"
+LOCATION_KEYS = ("location", "abbreviation", "location_name", "population")
+SUBLOCATION_DATASETS = ("nssp",)
+LATEST_SUFFIX = "_latest.json"
+
+
+def dataset_slices(
+    dataset: str,
+    outputs: Dict[str, Any],
+    series_weeks: Optional[int] = 26,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    One dataset's bundle entry per location abbreviation, from its `output_dict`.
+
+    Hub outputs contribute their `_latest.json` payloads; CDC outputs (payloads with a
+    `series`) are trimmed to their last `series_weeks` weeks. Other files are ignored.
+    """
+    if any(filename.endswith(LATEST_SUFFIX) for filename in outputs):
+        return {
+            _abbreviation(filename[:-len(LATEST_SUFFIX)], payload): payload
+            for filename, payload in outputs.items()
+            if filename.endswith(LATEST_SUFFIX) and "/" not in filename
+        }
+    entries: Dict[str, Any] = {}
+    for filename, payload in outputs.items():
+        if not isinstance(payload, dict) or "series" not in payload:
+            continue
+        entry = {"metadata": payload.get("metadata", {}), "series": latest_series(payload["series"], series_weeks)}
+        abbreviation = _abbreviation(filename.split("_")[0], payload)
+        if dataset in SUBLOCATION_DATASETS:
+            entries.setdefault(abbreviation, []).append(entry)
+        else:
+            entries[abbreviation] = entry
+    if dataset in SUBLOCATION_DATASETS:
+        return {abbreviation: _sublocation_entry(parts) for abbreviation, parts in entries.items()}
+    return entries
+
+
+def latest_series(series: Dict[str, list], weeks: Optional[int]) -> Dict[str, list]:
+    """The last `weeks` weeks of a `{"dates": [...], column: [...]}` series (all of it if `weeks` is None)."""
+    dates = series.get("dates") or []
+    if weeks is None or not dates:
+        return series
+    cutoff = (pd.Timestamp(dates[-1]) - pd.Timedelta(weeks=weeks)).strftime("%Y-%m-%d")
+    start = bisect.bisect_right(dates, cutoff) # dates are sorted ISO strings
+    return {key: values[start:] for key, values in series.items()}
+
+
+def build_location_bundles(slices: Dict[str, Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Assemble `{abbr}_bundle.json` outputs from `dataset -> {abbreviation: entry}` slices.
+
+    Datasets appear in each bundle in the order of `slices`; a location gets a bundle if any
+    dataset has an entry for it.
+    """
+    last_updated = pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%dT%H:%M:%SZ")
+    locations = dict.fromkeys(abbreviation for entries in slices.values() for abbreviation in entries)
+    bundles = {}
+    for abbreviation in locations:
+        entries = {dataset: entries[abbreviation] for dataset, entries in slices.items() if abbreviation in entries}
+        shared = _shared_metadata(abbreviation, entries.values())
+        bundles[f"{abbreviation}_bundle.json"] = {
+            "schema_version": BUNDLE_SCHEMA_VERSION,
+            "metadata": shared,
+            "last_updated": last_updated,
+            "datasets": {dataset: _without_shared(entry, shared) for dataset, entry in entries.items()},
+        }
+    return bundles
+
+
+def _abbreviation(prefix: str, payload: Dict[str, Any]) -> str:
+    return (payload.get("metadata") or {}).get("abbreviation") or prefix
+
+
+def _sublocation_entry(parts: list) -> Dict[str, Any]:
+    """Group a location's sub-location files under `locations`; metadata they all share (except location keys) is hoisted."""
+    common = {
+        key: value for key, value in parts[0]["metadata"].items()
+        if (key == "abbreviation" or key not in LOCATION_KEYS) and all(part["metadata"].get(key) == value for part in parts)
+    }
+    return {
+        "metadata": common,
+        "locations": {
+            str(part["metadata"].get("location")): {
+                "metadata": {key: value for key, value in part["metadata"].items() if key not in common},
+                "series": part["series"],
+            }
+            for part in parts
+        },
+    }
+
+
+def _shared_metadata(abbreviation: str, entries: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """The first non-empty value of every LOCATION_KEYS key across a location's entries."""
+    shared: Dict[str, Any] = {"abbreviation": abbreviation}
+    for entry in entries:
+        metadata = entry.get("metadata") or {}
+        if metadata.get("abbreviation") not in (None, "", abbreviation):
+            continue
+        for key in LOCATION_KEYS:
+            if key not in shared and metadata.get(key) not in (None, "", 0.0):
+                shared[key] = metadata[key]
+    return {key: shared[key] for key in LOCATION_KEYS if key in shared}
+
+
+def _without_shared(entry: Dict[str, Any], shared: Dict[str, Any]) -> Dict[str, Any]:
+    metadata = entry.get("metadata")
+    if metadata is None:
+        return entry
+    return {
+        **entry,
+        "metadata": {
+            key: value for key, value in metadata.items()
+            if not (key in LOCATION_KEYS and shared.get(key) == value)
+        },
+    }
@@ -11,6 +11,7 @@ import pandas as pd
 import requests
 
 from helper import get_location_info, STATEABBREVIATION_TO_FIPS_MAP, retrieve_data_from_endpoint_aslist
+from instrumentation import span
 
 logger = logging.getLogger(__name__)
 script_dir = os.path.dirname(__file__) 
@@ -41,7 +42,9 @@ class NHSNDataProcessor:
         """Fetches, processes, and structures NHSN data into self.output_dict"""
         # Get data set up 
         logger.info(f"Retrieving NHSN data from {self.data_url}...")
-        data = pd.DataFrame(retrieve_data_from_endpoint_aslist(data_url=self.data_url)) # read from endpoint
+        with span("fetch") as timing:
+            data = pd.DataFrame(retrieve_data_from_endpoint_aslist(data_url=self.data_url)) # read from endpoint
+            timing.add(rows=len(data))
         non_numeric_cols = ['jurisdiction', 'weekendingdate'] # make numeric cols not strings
         data = data.drop(columns=['respseason'])
         for col in data.columns:
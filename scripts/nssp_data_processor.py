@@ -10,6 +10,7 @@ import os
 import pandas as pd
 
 from helper import retrieve_data_from_endpoint_aslist, STATENAME_TO_ABBREVIATION_MAP
+from instrumentation import span
 
 
 logger = logging.getLogger(__name__)
@@ -45,7 +46,9 @@ class NSSPDataProcessor:
         """Fetches, processes, and structures NSSP data into self.output_dict"""
         # Get data set up 
         logger.info(f"Retrieving NSSP data from {self.data_url}...")
-        data_list = retrieve_data_from_endpoint_aslist(data_url=self.data_url) # read from endpoint
+        with span("fetch") as timing:
+            data_list = retrieve_data_from_endpoint_aslist(data_url=self.data_url) # read from endpoint
+            timing.add(rows=len(data_list))
         pruned_data_list = []
         for entry in data_list:
             if any(key.startswith('percent_visits_') for key in entry): # only keep entries that have at least one 'percent_visits_...' col
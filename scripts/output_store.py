@@ -0,0 +1,366 @@
+"""
+Single-file SQLite store for processed RespiLens data.
+
+Holds preprocessed hub model output, hub ground truth, hub location metadata and the
+CDC (NHSN/NSSP) series in one indexed database file. JSON outputs are one export
+from the store, and ad-hoc questions ("all models for CA last week") are indexed queries.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import pandas as pd
+
+from helper import OUTPUT_DIR_MAP, clean_nan_values, save_json_file
+from hub_dataset_processor import HubDatasetConfig
+from processors import FlusightDataProcessor, RSVDataProcessor, COVIDDataProcessor, FluMetrocastDataProcessor
+
+logger = logging.getLogger(__name__)
+
+# Store dataset name (an OUTPUT_DIR_MAP directory) -> processor that exports it to JSON
+HUB_PROCESSORS = {
+    "flusight": FlusightDataProcessor,
+    "rsvforecasthub": RSVDataProcessor,
+    "covid19forecasthub": COVIDDataProcessor,
+    "flumetrocast": FluMetrocastDataProcessor,
+}
+SERIES_DATASETS = ("nhsn", "nssp")
+
+FORECAST_COLUMNS = [
+    "location", "reference_date", "target", "model_id", "horizon",
+    "target_end_date", "output_type", "output_type_id", "value",
+]
+GROUND_TRUTH_COLUMNS = ["location", "target", "target_end_date", "as_of", "observation"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecasts (
+    dataset TEXT NOT NULL,
+    location TEXT NOT NULL,
+    reference_date TEXT NOT NULL,
+    target TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    horizon INTEGER NOT NULL,
+    target_end_date TEXT,
+    output_type TEXT NOT NULL,
+    output_type_id TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS forecasts_by_location ON forecasts (dataset, location, reference_date, target, model_id);
+CREATE INDEX IF NOT EXISTS forecasts_by_reference_date ON forecasts (dataset, reference_date, target);
+CREATE INDEX IF NOT EXISTS forecasts_by_model ON forecasts (dataset, model_id, reference_date);
+
+CREATE TABLE IF NOT EXISTS ground_truth (
+    dataset TEXT NOT NULL,
+    location TEXT NOT NULL,
+    target TEXT,
+    target_end_date TEXT NOT NULL,
+    as_of TEXT,
+    observation REAL
+);
+CREATE INDEX IF NOT EXISTS ground_truth_by_location ON ground_truth (dataset, location, target, target_end_date);
+
+CREATE TABLE IF NOT EXISTS series (
+    dataset TEXT NOT NULL,
+    file TEXT NOT NULL,
+    location TEXT,
+    date TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS series_by_location ON series (dataset, location, date);
+CREATE INDEX IF NOT EXISTS series_by_file ON series (dataset, file);
+
+CREATE TABLE IF NOT EXISTS documents (
+    dataset TEXT NOT NULL,
+    file TEXT NOT NULL,
+    contents TEXT NOT NULL,
+    PRIMARY KEY (dataset, file)
+);
+"""
+
+
+class OutputStore:
+    """
+    SQLite-backed store of processed RespiLens data, one file for every dataset.
+
+    Datasets are named by their output directory (`flusight`, `rsvforecasthub`,
+    `covid19forecasthub`, `flumetrocast`, `nhsn`, `nssp`); any `save_json_file`
+    pathogen alias is accepted. Writing a dataset replaces its previous rows.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "OutputStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def dataset_name(dataset: str) -> str:
+        """Canonical store name for a dataset or `save_json_file` pathogen alias."""
+        if dataset not in OUTPUT_DIR_MAP:
+            raise ValueError(f"Invalid dataset ('{dataset}') provided; must be one of {list(OUTPUT_DIR_MAP.keys())}")
+        return OUTPUT_DIR_MAP[dataset]
+
+    # -- writing --------------------------------------------------------------------------
+
+    def write_hub(
+        self,
+        dataset: str,
+        data: Union[pd.DataFrame, "pyarrow.dataset.Dataset"],
+        target_data: pd.DataFrame,
+        locations_data: pd.DataFrame,
+        config: HubDatasetConfig,
+    ) -> None:
+        """
+        Replace a hub's forecasts, ground truth and location metadata.
+
+        `data` is a preprocessed Hubverse DataFrame, or a raw hub dataset that is
+        preprocessed with `config` one record batch at a time.
+        """
+        dataset = self.dataset_name(dataset)
+        with self.connection:
+            for table in ("forecasts", "ground_truth"):
+                self.connection.execute(f"DELETE FROM {table} WHERE dataset = ?", (dataset,))
+            for batch in _iter_forecast_batches(data, config):
+                _forecast_rows(batch, dataset).to_sql("forecasts", self.connection, if_exists="append", index=False)
+            _ground_truth_rows(target_data, dataset, config.observation_column).to_sql(
+                "ground_truth", self.connection, if_exists="append", index=False
+            )
+        locations_data.to_sql(f"locations_{dataset}", self.connection, if_exists="replace", index=False)
+        self.connection.commit()
+
+    def write_series(self, dataset: str, output_dict: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Replace a CDC dataset from its processor's `output_dict`.
+
+        Each file's `series` is stored in long form (one row per date and column);
+        everything else (file metadata, dataset-level files) is kept as a JSON document.
+        """
+        dataset = self.dataset_name(dataset)
+        series_parts, documents = [], []
+        for filename, contents in output_dict.items():
+            series = contents.get("series") if isinstance(contents, dict) else None
+            if series is not None:
+                contents = {key: value for key, value in contents.items() if key != "series"}
+                location = contents.get("metadata", {}).get("location")
+                dates = series["dates"]
+                for column, values in series.items():
+                    if column == "dates":
+                        continue
+                    series_parts.append(pd.DataFrame({
+                        "dataset": dataset,
+                        "file": filename,
+                        "location": None if location is None else str(location),
+                        "date": dates[:len(values)],
+                        "column_name": column,
+                        "value": pd.to_numeric(pd.Series(values[:len(dates)], dtype=object), errors="coerce"),
+                    }))
+            documents.append((dataset, filename, json.dumps(contents)))
+
+        with self.connection:
+            for table in ("series", "documents"):
+                self.connection.execute(f"DELETE FROM {table} WHERE dataset = ?", (dataset,))
+            if series_parts:
+                pd.concat(series_parts, ignore_index=True).to_sql("series", self.connection, if_exists="append", index=False)
+            self.connection.executemany("INSERT INTO documents (dataset, file, contents) VALUES (?, ?, ?)", documents)
+
+    # -- querying -------------------------------------------------------------------------
+
+    def datasets(self) -> list:
+        """Names of every dataset with rows in the store."""
+        return [
+            dataset for (dataset,) in self.connection.execute(
+                "SELECT DISTINCT dataset FROM forecasts UNION SELECT DISTINCT dataset FROM documents"
+            )
+        ]
+
+    def query_forecasts(
+        self,
+        dataset: str,
+        location: Optional[str] = None,
+        reference_date: Optional[str] = None,
+        target: Optional[str] = None,
+        model_id: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        Indexed lookup of forecast rows, e.g. every model for one location and reference date.
+
+        Returns Hubverse-typed rows as produced by `hubverse_df_preprocessor` (dates as
+        `datetime.date`, quantile `output_type_id`s as floats).
+        """
+        filters = {"location": location, "reference_date": reference_date, "target": target, "model_id": model_id}
+        where, params = _where_clause(self.dataset_name(dataset), filters)
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(FORECAST_COLUMNS)} FROM forecasts WHERE {where} ORDER BY rowid", self.connection, params=params
+        )
+        return _restore_forecast_types(df)
+
+    def query_ground_truth(
+        self, dataset: str, location: Optional[str] = None, target: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Ground truth rows (all `as_of` vintages) for a hub, optionally for one location and target."""
+        where, params = _where_clause(self.dataset_name(dataset), {"location": location, "target": target})
+        return pd.read_sql_query(
+            f"SELECT {', '.join(GROUND_TRUTH_COLUMNS)} FROM ground_truth WHERE {where} ORDER BY rowid", self.connection, params=params
+        )
+
+    def query_series(self, dataset: str, location: Optional[str] = None) -> pd.DataFrame:
+        """CDC series rows in long form (`file`, `location`, `date`, `column_name`, `value`)."""
+        where, params = _where_clause(self.dataset_name(dataset), {"location": location})
+        return pd.read_sql_query(
+            f"SELECT file, location, date, column_name, value FROM series WHERE {where} ORDER BY rowid", self.connection, params=params
+        )
+
+    def read_hub_inputs(self, dataset: str, config: HubDatasetConfig) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """Return `(data, target_data, locations_data)` ready to hand to the dataset's processor."""
+        dataset = self.dataset_name(dataset)
+        data = clean_nan_values(self.query_forecasts(dataset))
+        target_data = self.query_ground_truth(dataset).rename(columns={"observation": config.observation_column})
+        locations_data = pd.read_sql_query(f"SELECT * FROM locations_{dataset}", self.connection)
+        return data, clean_nan_values(target_data), clean_nan_values(locations_data)
+
+    # -- exporting ------------------------------------------------------------------------
+
+    def build_outputs(self, dataset: str, **processor_options: Any) -> Dict[str, Dict[str, Any]]:
+        """Rebuild a dataset's JSON `output_dict` from the store."""
+        dataset = self.dataset_name(dataset)
+        if dataset in HUB_PROCESSORS:
+            processor_class = HUB_PROCESSORS[dataset]
+            data, target_data, locations_data = self.read_hub_inputs(dataset, processor_class.config)
+            return processor_class(
+                data=data, locations_data=locations_data, target_data=target_data, **processor_options
+            ).output_dict
+        return self._build_series_outputs(dataset)
+
+    def export_json(self, output_path: str, datasets: Iterable[str], overwrite: bool = True, **processor_options: Any) -> None:
+        """Write the JSON outputs of `datasets` under `output_path`, as `process_RespiLens_data.py` lays them out."""
+        for dataset in datasets:
+            logger.info("Exporting %s JSON files from %s...", dataset, self.path)
+            for filename, contents in self.build_outputs(dataset, **processor_options).items():
+                save_json_file(
+                    pathogen=dataset,
+                    output_path=output_path,
+                    output_filename=filename,
+                    file_contents=contents,
+                    overwrite=overwrite,
+                )
+
+    def _build_series_outputs(self, dataset: str) -> Dict[str, Dict[str, Any]]:
+        documents = self.connection.execute(
+            "SELECT file, contents FROM documents WHERE dataset = ? ORDER BY rowid", (dataset,)
+        ).fetchall()
+        series = pd.read_sql_query(
+            "SELECT file, date, column_name, value FROM series WHERE dataset = ? ORDER BY rowid",
+            self.connection,
+            params=(dataset,),
+        )
+        series["value"] = series["value"].astype(object).where(series["value"].notna(), None)
+        series_by_file = {filename: file_series for filename, file_series in series.groupby("file", sort=False)}
+
+        output_dict: Dict[str, Dict[str, Any]] = {}
+        for filename, contents in documents:
+            payload = json.loads(contents)
+            if filename in series_by_file:
+                file_series = series_by_file[filename]
+                columns = {column: rows for column, rows in file_series.groupby("column_name", sort=False)}
+                first = next(iter(columns.values()))
+                payload["series"] = {"dates": first["date"].tolist()}
+                for column, rows in columns.items():
+                    payload["series"][column] = rows["value"].tolist()
+            output_dict[filename] = payload
+        return output_dict
+
+
+def _where_clause(dataset: str, filters: Dict[str, Optional[str]]) -> Tuple[str, list]:
+    clauses, params = ["dataset = ?"], [dataset]
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(str(value))
+    return " AND ".join(clauses), params
+
+
+def _iter_forecast_batches(data, config: HubDatasetConfig) -> Iterable[pd.DataFrame]:
+    if isinstance(data, pd.DataFrame):
+        yield data
+        return
+    for batch in data.to_batches(): # raw hub dataset: preprocessing is row-wise, so batches can be filtered independently
+        df = config.preprocess(batch.to_pandas())
+        if not df.empty:
+            yield df
+
+
+def _iso_dates(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values).dt.strftime("%Y-%m-%d")
+
+
+def _forecast_rows(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    rows = pd.DataFrame({
+        "dataset": dataset,
+        "location": df["location"].astype(str),
+        "reference_date": _iso_dates(df["reference_date"]),
+        "target": df["target"].astype(str),
+        "model_id": df["model_id"].astype(str),
+        "horizon": df["horizon"].astype(int),
+        "target_end_date": _iso_dates(df["target_end_date"]),
+        "output_type": df["output_type"].astype(str),
+        "output_type_id": df["output_type_id"].map(str, na_action="ignore"), # mean/median rows have no id: keep NULL
+        "value": pd.to_numeric(df["value"], errors="coerce"),
+    })
+    return rows
+
+
+def _ground_truth_rows(target_data: pd.DataFrame, dataset: str, observation_column: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        "dataset": dataset,
+        "location": target_data["location"].astype(str),
+        "target": target_data["target"].astype(str) if "target" in target_data.columns else None,
+        "target_end_date": _iso_dates(target_data["target_end_date"]),
+        "as_of": _iso_dates(target_data["as_of"]) if "as_of" in target_data.columns else None,
+        "observation": pd.to_numeric(target_data[observation_column], errors="coerce"),
+    })
+
+
+def _restore_forecast_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Give rows read back from SQLite the types hubdata and `hubverse_df_preprocessor` produce."""
+    for column in ("reference_date", "target_end_date"):
+        df[column] = pd.to_datetime(df[column], format="%Y-%m-%d").dt.date
+    output_type_id = df["output_type_id"].astype(object)
+    is_quantile = (df["output_type"] == "quantile").to_numpy()
+    output_type_id[is_quantile] = pd.to_numeric(output_type_id[is_quantile]).astype(float).tolist()
+    df["output_type_id"] = output_type_id
+    return df
+
+
+def main():
+    """
+    Main execution function
+    """
+    parser = argparse.ArgumentParser(description="Export RespiLens JSON files from a single-file store.")
+    parser.add_argument("--store", type=str, required=True, help="Path to the SQLite store written by process_RespiLens_data.py --store.")
+    parser.add_argument("--output-path", type=str, required=True, help="Directory where JSON files will be saved.")
+    parser.add_argument("--dataset", type=str, action="append", choices=sorted([*HUB_PROCESSORS, *SERIES_DATASETS]),
+                        help="Dataset to export (repeatable; default: every dataset in the store).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with OutputStore(args.store) as store:
+        store.export_json(args.output_path, args.dataset or store.datasets())
+    logger.info("Process complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,12 @@
 import argparse
 import logging
 import pandas as pd
+import re
 import sys
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
 from hubdata import connect_hub
 from hubdata import connect_target_data
 from hubdata.create_target_data_schema import TargetType
@@ -14,13 +18,462 @@ from processors import FlusightDataProcessor, RSVDataProcessor, COVIDDataProcess
 from nhsn_data_processor import NHSNDataProcessor
 from nssp_data_processor import NSSPDataProcessor
 from myrespi_fetch import myrespi_fetch
-from helper import save_json_file, hubverse_df_preprocessor, clean_nan_values
+from hub_dataset_processor import HubDatasetConfig, OUTPUT_LAYOUTS, PAYLOAD_FORMATS
+from helper import save_json_file, clean_nan_values, payload_digest, OUTPUT_DIR_MAP
+from output_store import OutputStore
+from build_manifest import BuildManifest, KEEP_BUILDS
+from location_bundles import build_location_bundles, dataset_slices
+from watch import Watcher, WatchedSource, affected_parts, cdc_fingerprint, changed_paths, hub_fingerprint
+import instrumentation
+from instrumentation import span, MemoryBudgetExceeded, MEMORY_MODES
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1])) # the repository-level `baselinenowcast` package
+from baselinenowcast import baseline_nowcasts
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SCRIPT_LOCATION = Path(__file__).resolve().parent
 LOCATIONS_DATA = pd.read_csv(SCRIPT_LOCATION / "locations.csv")
+SCORES_FILENAME = "scores.parquet"
+WATCH_STATUS_FILENAME = "watch_status.json"
+# a hubverse submission: model-output/{model_id}/{round_id}-{model_id}.{ext}, rounds keyed by reference date
+MODEL_OUTPUT_FILE = re.compile(r"model-output/(?P<model_id>[^/]+)/(?P<round_id>\d{4}-\d{2}-\d{2})-(?P=model_id)\.\w+")
+
+
+@dataclass(frozen=True)
+class HubSource:
+    """A forecast hub `main` can process: its CLI path argument, processor and output directory."""
+
+    name: str # span prefix, e.g. "flusight.load"
+    label: str # for log messages
+    pathogen: str # `save_json_file` / OUTPUT_DIR_MAP slug, also the store and scores key
+    processor: type
+    path_arg: str
+    hub_locations: bool = False # DEP: metrocast still pulls hub locations.csv
+
+
+HUB_SOURCES = (
+    HubSource("flusight", "FluSight", "flusight", FlusightDataProcessor, "flusight_hub_path"),
+    HubSource("rsv", "RSV", "rsvforecasthub", RSVDataProcessor, "rsv_hub_path"),
+    HubSource("covid19", "covid19", "covid19forecasthub", COVIDDataProcessor, "covid_hub_path"),
+    HubSource("flumetrocast", "flu metrocast", "flumetrocast", FluMetrocastDataProcessor, "flu_metrocast_hub_path", hub_locations=True),
+)
+
+
+@dataclass(frozen=True)
+class CDCSource:
+    """A data.cdc.gov series `main` can process: its CLI flag, processor and dataset id."""
+
+    name: str # span prefix and `save_json_file` slug
+    label: str
+    flag: str
+    processor: type
+    resource_id: str
+
+
+CDC_SOURCES = (
+    CDCSource("nhsn", "NHSN", "NHSN", NHSNDataProcessor, "ua7e-t2fy"),
+    CDCSource("nssp", "NSSP", "NSSP", NSSPDataProcessor, "rdmq-nq56"),
+)
+
+
+class HubInputs(NamedTuple):
+    """A hub's loaded model output, target data and locations (kept warm between --watch rebuilds)."""
+
+    hubverse_df: Any # preprocessed DataFrame, or the raw dataset when out of core
+    target_data: pd.DataFrame
+    locations_data: pd.DataFrame
+
+
+def load_hubverse_data(hub_conn, config: HubDatasetConfig, out_of_core: bool = False):
+    """
+    Get hub model output ready to hand to a processor.
+
+    Returns the hubverse df preprocessed per `config`, or (if `out_of_core`) the raw
+    hub dataset so the processor can load it one location at a time.
+    """
+    if out_of_core:
+        return hub_conn.get_dataset()
+    with span("to_pandas") as timing:
+        hubverse_df = config.read_dataset(hub_conn.get_dataset())
+        timing.add(rows=len(hubverse_df))
+    hubverse_df = config.preprocess(hubverse_df)
+    with span("clean_nan_values", rows=len(hubverse_df)):
+        return clean_nan_values(hubverse_df)
+
+
+def load_target_data(hub_path: str) -> pd.DataFrame:
+    """A hub's time-series target data, with every `as_of` vintage."""
+    return clean_nan_values(connect_target_data(hub_path=hub_path, target_type=TargetType.TIME_SERIES).to_table().to_pandas())
+
+
+def load_hub(source: HubSource, hub_path: str, out_of_core: bool = False, store: Optional[OutputStore] = None) -> HubInputs:
+    """Connect to a local hub repository and load everything its processor needs."""
+    with span(f"{source.name}.load"):
+        # Use HubdataPy to get all of the hub's data in one df
+        logger.info(f"Establishing connection to local {source.label} repository...")
+        hub_conn = connect_hub(hub_path)
+        logger.info("Success ✅")
+        logger.info(f"Collecting data from {source.label} repo...")
+        hubverse_df = load_hubverse_data(hub_conn, source.processor.config, out_of_core=out_of_core)
+        locations_data = LOCATIONS_DATA
+        if source.hub_locations:
+            locations_data = clean_nan_values(pd.read_csv(Path(hub_path) / 'auxiliary-data/locations.csv'))
+        target_data = load_target_data(hub_path)
+        logger.info("Success ✅")
+        if store is not None: # the store is the source of truth; JSON is exported from it
+            store.write_hub(source.pathogen, hubverse_df, target_data, locations_data, config=source.processor.config)
+            hubverse_df, target_data, store_locations = store.read_hub_inputs(source.pathogen, source.processor.config)
+            if source.hub_locations:
+                locations_data = store_locations
+    return HubInputs(hubverse_df, target_data, locations_data)
+
+
+def read_model_output_files(hub_path: str, config: HubDatasetConfig, paths: List[str]) -> Optional[pd.DataFrame]:
+    """Read and preprocess some of a hub's model-output files (paths relative to the hub) like `load_hubverse_data`."""
+    import pyarrow.dataset as ds
+
+    relative = tuple(str(Path(path).relative_to("model-output")) for path in paths)
+    dataset = connect_hub(hub_path).get_dataset()
+    parts = []
+    for child in getattr(dataset, "children", None) or [dataset]: # a union dataset has one child per file format
+        fragments = [
+            fragment for fragment in child.get_fragments()
+            if any(fragment.path == path or fragment.path.endswith(f"/{path}") for path in relative)
+        ]
+        if fragments:
+            parts.append(config.read_dataset(ds.FileSystemDataset(fragments, child.schema, child.format, child.filesystem)))
+    if not parts:
+        return None
+    return clean_nan_values(config.preprocess(pd.concat(parts, ignore_index=True)))
+
+
+def reload_model_output(
+    source: HubSource,
+    hub_path: str,
+    inputs: HubInputs,
+    paths: List[str],
+) -> Optional[Tuple[HubInputs, Set[str], Set[str]]]:
+    """
+    Swap the changed model-output `paths` into warm in-memory `inputs`.
+
+    The rows of every changed submission (its model's round) are dropped and the file read
+    again if it still exists. Returns the new inputs with the locations and reference dates
+    whose rows changed, or None if the hub has to be reloaded: a changed path that is not a
+    `{round_id}-{model_id}` submission, or a location left without any model output.
+    """
+    submissions = [MODEL_OUTPUT_FILE.fullmatch(path) for path in paths]
+    if not submissions or not all(submissions):
+        return None
+    hubverse_df = inputs.hubverse_df
+    rounds = {(match["model_id"], match["round_id"]) for match in submissions}
+    with span(f"{source.name}.load", files=len(paths)):
+        stale = pd.MultiIndex.from_arrays([
+            hubverse_df["model_id"].astype(str),
+            pd.to_datetime(hubverse_df["reference_date"]).dt.strftime("%Y-%m-%d"),
+        ]).isin(list(rounds))
+        locations = set(hubverse_df.loc[stale, "location"].astype(str))
+        hubverse_df = hubverse_df[~stale]
+        added = read_model_output_files(
+            hub_path, source.processor.config, [path for path in paths if (Path(hub_path) / path).exists()]
+        )
+        if added is not None:
+            locations.update(added["location"].astype(str))
+            hubverse_df = pd.concat([hubverse_df, added], ignore_index=True)
+    if not locations <= set(hubverse_df["location"].astype(str)):
+        return None
+    return inputs._replace(hubverse_df=hubverse_df), locations, {round_id for _, round_id in rounds}
+
+
+def write_outputs(
+    pathogen: str,
+    outputs: Dict[str, Any],
+    output_path: str,
+    indent: Optional[int] = 4,
+    digests: Optional[Dict[str, str]] = None,
+    manifest: Optional[BuildManifest] = None,
+    partial: bool = False,
+) -> Dict[str, int]:
+    """
+    Save every output file of one dataset.
+
+    With `digests` (filename -> `payload_digest` of what was last written, updated in place),
+    files whose contents have not changed are not rewritten. With a `manifest`, files are
+    written under content-addressed names and recorded in it instead (see `build_manifest`);
+    `partial=True` keeps the manifest entries of the dataset's files not in `outputs`.
+    """
+    if manifest is not None:
+        return manifest.save_dataset(pathogen, outputs, indent=indent, partial=partial)
+    counts = {"written": 0, "unchanged": 0}
+    for filename, contents in outputs.items():
+        if digests is not None:
+            digest = payload_digest(contents)
+            if digests.get(filename) == digest:
+                counts["unchanged"] += 1
+                continue
+            digests[filename] = digest
+        save_json_file(
+            pathogen=pathogen,
+            output_path=output_path,
+            output_filename=filename,
+            file_contents=contents,
+            overwrite=True,
+            indent=indent,
+        )
+        counts["written"] += 1
+    return counts
+
+
+def build_hub(
+    source: HubSource,
+    hub_path: str,
+    args: argparse.Namespace,
+    processor_options: Dict[str, Any],
+    store: Optional[OutputStore] = None,
+    inputs: Optional[HubInputs] = None,
+    documents: bool = True,
+    digests: Optional[Dict[str, str]] = None,
+    manifest: Optional[BuildManifest] = None,
+    only_locations: Optional[Set[str]] = None,
+    only_reference_dates: Optional[Set[str]] = None,
+):
+    """
+    Load (unless warm `inputs` are given), process and save one hub, then fetch its MyRespiLens documents.
+
+    With `only_locations` (and `only_reference_dates`), only those locations' payloads are
+    rebuilt and saved (see `HubDataProcessorBase`). Returns the hub's inputs, its processor
+    and the `write_outputs` counts.
+    """
+    if inputs is None:
+        inputs = load_hub(source, hub_path, out_of_core=args.out_of_core, store=store)
+    # Initialize converter object
+    with span(f"{source.name}.process"):
+        processor = source.processor(
+            data=inputs.hubverse_df,
+            locations_data=inputs.locations_data,
+            target_data=inputs.target_data,
+            previous_scores=load_previous_scores(args.state_path, source.pathogen, enabled=args.score),
+            nowcasts=build_nowcasts(inputs.target_data, source.processor.config, enabled=args.nowcast),
+            only_locations=only_locations,
+            only_reference_dates=only_reference_dates,
+            **processor_options,
+        )
+    # Iteratively save output files; compact payloads are written without whitespace
+    with span(f"{source.name}.write"):
+        logger.info(f"Saving {source.label} JSON files...")
+        counts = write_outputs(
+            source.pathogen,
+            processor.output_dict,
+            args.output_path,
+            indent=None if args.payload_format == "compact" else 4,
+            digests=digests,
+            manifest=manifest,
+            partial=only_locations is not None,
+        )
+        save_scores(processor, args.state_path, source.pathogen)
+    if documents:
+        with span(f"{source.name}.documents"):
+            logger.info("Fetching documents for MyRespiLens...")
+            myrespi_fetch(hub_path=hub_path, folder_name=source.pathogen, output_path=args.output_path)
+    logger.info("Success ✅")
+    return inputs, processor, counts
+
+
+def build_cdc(
+    source: CDCSource,
+    output_path: str,
+    store: Optional[OutputStore] = None,
+    digests: Optional[Dict[str, str]] = None,
+    manifest: Optional[BuildManifest] = None,
+):
+    """Fetch, process and save one CDC series; returns its outputs and the `write_outputs` counts."""
+    with span(f"{source.name}.process"):
+        outputs = source.processor(resource_id=source.resource_id).output_dict
+        if store is not None:
+            store.write_series(source.name, outputs)
+            outputs = store.build_outputs(source.name)
+    with span(f"{source.name}.write"):
+        logger.info(f"Iteratively saving {source.label} JSON files...")
+        counts = write_outputs(source.name, outputs, output_path, digests=digests, manifest=manifest)
+    logger.info("Success ✅")
+    return outputs, counts
+
+
+def build_bundles(
+    bundle_slices: Dict[str, Dict[str, Any]],
+    output_path: str,
+    indent: Optional[int] = 4,
+    digests: Optional[Dict[str, str]] = None,
+    manifest: Optional[BuildManifest] = None,
+) -> Dict[str, int]:
+    """Save one bundle per location from each dataset's in-memory latest slices (see `location_bundles`)."""
+    with span("bundles", datasets=len(bundle_slices)):
+        bundles = build_location_bundles(bundle_slices)
+        logger.info(f"Saving {len(bundles)} location bundles...")
+        return write_outputs("bundles", bundles, output_path, indent=indent, digests=digests, manifest=manifest)
+
+
+def _initial_cdc_fingerprint(source: CDCSource):
+    try:
+        return cdc_fingerprint(source.resource_id)
+    except Exception as error: # the first poll rebuilds it instead
+        logger.warning("Could not check %s for updates: %s", source.label, error)
+        return None
+
+
+def watch_sources(
+    args: argparse.Namespace,
+    processor_options: Dict[str, Any],
+    store: Optional[OutputStore],
+    hub_inputs: Dict[str, HubInputs],
+    digests: Dict[str, Dict[str, str]],
+    manifest: Optional[BuildManifest] = None,
+    bundle_slices: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> list:
+    """
+    The --watch sources for every hub and CDC series `args` selected.
+
+    A hub rebuild reloads only what the commits touched: target data alone keeps the warm
+    model output (and processes it again), model output alone swaps the changed submissions
+    into the warm model output and rebuilds only the locations and reference dates they
+    touch (see `reload_model_output`), hub config or (for MetroCast) auxiliary data reload
+    the hub, and other changes (e.g. model metadata) need no rebuild. Only files whose
+    contents changed are rewritten, and the `manifest` (if any) and the run report (see
+    `write_run_report`) are rewritten after every rebuild. With `bundle_slices`, the rebuilt
+    dataset's slices are replaced (or, for a partial rebuild, updated) and the location
+    bundles rebuilt from them.
+    """
+    def rebuild_bundles(dataset, outputs, partial=False):
+        if bundle_slices is None:
+            return
+        slices = dataset_slices(dataset, outputs, series_weeks=HubDatasetConfig.latest_ground_truth_weeks)
+        if partial:
+            bundle_slices.setdefault(dataset, {}).update(slices)
+        else:
+            bundle_slices[dataset] = slices
+        build_bundles(
+            bundle_slices, args.output_path, indent=None if args.payload_format == "compact" else 4,
+            digests=digests.setdefault("bundles", {}), manifest=manifest,
+        )
+
+    sources = []
+    for source in HUB_SOURCES:
+        hub_path = getattr(args, source.path_arg)
+        if not hub_path:
+            continue
+
+        def rebuild(previous, current, source=source, hub_path=hub_path):
+            paths = changed_paths(hub_path, previous, current)
+            parts = affected_parts(paths)
+            inputs = hub_inputs.get(source.name)
+            only_locations = only_reference_dates = None
+            if inputs is None or store is not None or args.out_of_core or "hub-config" in parts or (
+                source.hub_locations and "auxiliary-data" in parts
+            ):
+                inputs = None
+            elif "model-output" in parts:
+                reloaded = None
+                if parts == {"model-output"}:
+                    reloaded = reload_model_output(
+                        source, hub_path, inputs, [path for path in paths if path.startswith("model-output/")]
+                    )
+                if reloaded is None:
+                    inputs = None
+                else:
+                    inputs, only_locations, only_reference_dates = reloaded
+            elif "target-data" in parts:
+                with span(f"{source.name}.load"):
+                    inputs = inputs._replace(target_data=load_target_data(hub_path))
+            elif not parts:
+                return {"written": 0, "unchanged": 0}
+            inputs, processor, counts = build_hub(
+                source, hub_path, args, processor_options, store=store, inputs=inputs,
+                documents=bool(parts & {"target-data", "auxiliary-data"}),
+                digests=digests.setdefault(source.pathogen, {}), manifest=manifest,
+                only_locations=only_locations, only_reference_dates=only_reference_dates,
+            )
+            hub_inputs[source.name] = inputs
+            rebuild_bundles(source.name, processor.output_dict, partial=only_locations is not None)
+            if manifest is not None:
+                manifest.write()
+            write_run_report(args)
+            return counts
+
+        sources.append(WatchedSource(
+            source.name, partial(hub_fingerprint, hub_path, pull=args.pull), rebuild, interval=args.poll_interval
+        ))
+    for source in CDC_SOURCES:
+        if not getattr(args, source.flag):
+            continue
+
+        def rebuild(previous, current, source=source):
+            outputs, counts = build_cdc(
+                source, args.output_path, store=store, digests=digests.setdefault(source.name, {}), manifest=manifest
+            )
+            rebuild_bundles(source.name, outputs)
+            if manifest is not None:
+                manifest.write()
+            write_run_report(args)
+            return counts
+
+        sources.append(WatchedSource(
+            source.name, partial(cdc_fingerprint, source.resource_id), rebuild, interval=args.cdc_poll_interval
+        ))
+    return sources
+
+
+def default_state_path(output_path: str) -> str:
+    """`--state-path` default: an `{output directory name}-state` directory next to `--output-path`, outside the published tree."""
+    output_dir = Path(output_path).resolve()
+    return str(output_dir.with_name(f"{output_dir.name}-state"))
+
+
+def write_run_report(args: argparse.Namespace) -> None:
+    """
+    Write the run report (every span since the process started) to --run-report.
+
+    Without --run-report, building the report still dumps the --profile-stage stats to --profile-output.
+    """
+    if args.run_report:
+        run_report = instrumentation.write_report()
+        logger.info(f"Run report ({run_report['seconds']:.1f}s) written to {args.run_report}")
+    elif args.profile_stage:
+        instrumentation.report()
+        logger.info(f"Profile of stage '{args.profile_stage}' written to {args.profile_output}")
+
+
+def load_previous_scores(state_path: str, pathogen: str, enabled: bool = True):
+    """Read the per-forecast scores saved by the previous `--score` run, if any."""
+    scores_path = Path(state_path) / OUTPUT_DIR_MAP[pathogen] / SCORES_FILENAME
+    if not enabled or not scores_path.exists():
+        return None
+    return pd.read_parquet(scores_path)
+
+
+def build_nowcasts(target_data: pd.DataFrame, config: HubDatasetConfig, enabled: bool = True):
+    """Baseline quantile nowcasts of every location in a hub's `as_of` target data (None if disabled or unavailable)."""
+    if not enabled:
+        return None
+    with span("nowcast", rows=len(target_data)):
+        try:
+            return baseline_nowcasts(
+                target_data,
+                quantile_levels=config.quantile_levels,
+                observation_column=config.observation_column,
+            )
+        except ValueError as error:
+            logger.warning("Skipping %s nowcasts: %s", config.dataset_label, error)
+            return None
+
+
+def save_scores(processor, state_path: str, pathogen: str) -> None:
+    """Persist a processor's per-forecast scores so the next run only re-scores revised forecasts and observations."""
+    if processor.scores is None:
+        return
+    scores_path = Path(state_path) / OUTPUT_DIR_MAP[pathogen] / SCORES_FILENAME
+    scores_path.parent.mkdir(parents=True, exist_ok=True)
+    processor.scores.to_parquet(scores_path, index=False)
 
 
 def main():
@@ -56,170 +509,236 @@ def main():
                         action='store_true',
                         required=False,
                         help="If set, pull NSSP data.")
+    parser.add_argument("--out-of-core",
+                        action='store_true',
+                        required=False,
+                        help="If set, process hub model output one location at a time instead of loading whole hubs into memory.")
+    parser.add_argument("--output-layout",
+                        type=str,
+                        choices=OUTPUT_LAYOUTS,
+                        default="single",
+                        required=False,
+                        help="Projection file layout: one file per location ('single'), per-location index + one file per reference date ('sharded'), or 'both'.")
+    parser.add_argument("--ensembles",
+                        action='store_true',
+                        required=False,
+                        help="If set, add server-side quantile-mean and quantile-median ensemble pseudo-models to hub outputs.")
+    parser.add_argument("--score",
+                        action='store_true',
+                        required=False,
+                        help="If set, score hub forecasts with WIS against ground truth and save a leaderboard.json per hub.")
+    parser.add_argument("--state-path",
+                        type=str,
+                        required=False,
+                        help="Directory for state kept between runs but not published, such as the --score per-forecast scores (default: '<output-path>-state', next to --output-path).")
+    parser.add_argument("--nowcast",
+                        action='store_true',
+                        required=False,
+                        help="If set, add baseline nowcasts (estimated from the hub target data's `as_of` vintages) to hub outputs as the RespiLens-baselinenowcast model.")
+    parser.add_argument("--payload-format",
+                        type=str,
+                        choices=PAYLOAD_FORMATS,
+                        default="default",
+                        required=False,
+                        help="Projection file schema: the nested 'default' schema, or 'compact' (shared level/date tables, columnar values, minified JSON).")
+    parser.add_argument("--significant-digits",
+                        type=int,
+                        default=4,
+                        required=False,
+                        help="Significant digits kept for forecast and ground truth values with --payload-format compact.")
+    parser.add_argument("--keep-intermediates",
+                        action='store_true',
+                        required=False,
+                        help="If set, hub processors keep copies of every per-location hubverse and ground truth DataFrame while building (by default they run lean and only rebuild them if `intermediate_dataframes` is read).")
+    parser.add_argument("--store",
+                        type=str,
+                        required=False,
+                        help="Path to a single-file SQLite store. If set, processed forecasts, ground truth and CDC series are written there first and the JSON files are exported from it (not available with --out-of-core).")
+    parser.add_argument("--run-report",
+                        type=str,
+                        required=False,
+                        help="Path to write a JSON report of per-stage timings and row/file/byte counts to.")
+    parser.add_argument("--profile-stage",
+                        type=str,
+                        required=False,
+                        help="Run every span with this name (e.g. 'forecasts' or 'flusight.process') under cProfile; its top functions go in --run-report and the raw stats to --profile-output (one of them is required).")
+    parser.add_argument("--profile-output",
+                        type=str,
+                        required=False,
+                        help="With --profile-stage, also dump the raw cProfile stats to this path.")
+    parser.add_argument("--track-memory",
+                        type=str,
+                        choices=MEMORY_MODES,
+                        required=False,
+                        help="With --run-report, record RSS ('rss') or RSS plus traced allocation peaks and top allocation sites ('tracemalloc', slower) per stage.")
+    parser.add_argument("--memory-budget-mb",
+                        type=float,
+                        required=False,
+                        help="Stop with a memory report (written to --run-report, if set) as soon as RSS exceeds this many MB at a stage boundary.")
+    parser.add_argument("--content-addressed",
+                        action='store_true',
+                        required=False,
+                        help="If set, write every JSON output under a content-hashed name and map logical names to them in a per-build manifest.json.")
+    parser.add_argument("--deltas",
+                        action='store_true',
+                        required=False,
+                        help="With --content-addressed, also write a structural patch from the previous build's version of every changed file that is small enough (see --delta-max-ratio).")
+    parser.add_argument("--delta-max-ratio",
+                        type=float,
+                        default=0.25,
+                        required=False,
+                        help="With --deltas, only keep patches at most this fraction of the new file's size.")
+    parser.add_argument("--keep-builds",
+                        type=int,
+                        default=KEEP_BUILDS,
+                        required=False,
+                        help="With --content-addressed, keep the hashed files (and patches) of this many most recent manifests and delete older ones.")
+    parser.add_argument("--bundles",
+                        action='store_true',
+                        required=False,
+                        help="If set, also write one bundles/{abbr}_bundle.json per location holding every processed dataset's latest slice, so a location page needs one request.")
+    parser.add_argument("--watch",
+                        action='store_true',
+                        required=False,
+                        help="If set, keep running after the build: poll the hub repositories and CDC endpoints and rebuild (and rewrite) only what changed.")
+    parser.add_argument("--poll-interval",
+                        type=float,
+                        default=300,
+                        required=False,
+                        help="With --watch, seconds between checks of each hub repository's HEAD.")
+    parser.add_argument("--cdc-poll-interval",
+                        type=float,
+                        default=3600,
+                        required=False,
+                        help="With --watch, seconds between checks of each CDC dataset's last update time.")
+    parser.add_argument("--pull",
+                        action='store_true',
+                        required=False,
+                        help="With --watch, `git pull --ff-only` each hub repository before checking it.")
+    parser.add_argument("--status-file",
+                        type=str,
+                        required=False,
+                        help=f"With --watch, path of the JSON status file (default: {WATCH_STATUS_FILENAME} under --output-path).")
+    parser.add_argument("--status-port",
+                        type=int,
+                        required=False,
+                        help="With --watch, also serve /health and /status over HTTP on this local port.")
     args = parser.parse_args()
+    if args.state_path is None:
+        args.state_path = default_state_path(args.output_path)
+    if args.store and args.out_of_core:
+        parser.error("--store cannot be combined with --out-of-core: JSON is exported from the store, which reads each hub back into memory")
+    if args.profile_output and not args.profile_stage:
+        parser.error("--profile-output needs --profile-stage (the stage whose profile is dumped)")
+    if args.profile_stage and not (args.run_report or args.profile_output):
+        parser.error("--profile-stage needs --run-report or --profile-output to write the profile to")
+    if args.track_memory and not args.run_report:
+        parser.error("--track-memory needs --run-report (the per-stage memory is only written to the run report)")
+    if args.deltas and not args.content_addressed:
+        parser.error("--deltas needs --content-addressed (patches are keyed by content hash)")
+    if args.keep_builds < 1:
+        parser.error("--keep-builds must be at least 1 (the build being written)")
 
     if not (args.flusight_hub_path or args.rsv_hub_path or args.covid_hub_path or args.NHSN or args.flu_metrocast_hub_path or args.NSSP):
         print("🛑 No hub paths, NSSP or NHSN flag provided 🛑, so no data will be fetched.")
         print("Please re-run script with hub path(s) specified or other flag set.")
         sys.exit(1)
 
+    if args.run_report or args.track_memory or args.memory_budget_mb or args.profile_stage:
+        instrumentation.enable(
+            profile_stage=args.profile_stage,
+            profile_output=args.profile_output,
+            track_memory=args.track_memory,
+            memory_budget_mb=args.memory_budget_mb,
+            report_path=args.run_report,
+        )
     logger.info("Beginning conversion process...")
-
-    if args.flusight_hub_path:
-        # Use HubdataPy to get all Flusight data in one df
-        logger.info("Establishing connection to local FluSight repository...")
-        flu_hub_conn = connect_hub(args.flusight_hub_path)
-        logger.info("Success ✅")
-        logger.info("Collecting data from FluSight repo...")
-        flu_hubverse_df = clean_nan_values(hubverse_df_preprocessor(df=flu_hub_conn.get_dataset().to_table().to_pandas(), filter_nowcasts=True))
-        flu_target_data = clean_nan_values(connect_target_data(hub_path=args.flusight_hub_path, target_type=TargetType.TIME_SERIES).to_table().to_pandas()) 
-        logger.info("Success ✅")
-        # Initialize converter object
-        flu_processor_object = FlusightDataProcessor(
-            data=flu_hubverse_df,
-            locations_data=LOCATIONS_DATA,
-            target_data=flu_target_data,
+    # Options shared by every hub processor
+    processor_options = {
+        "output_layout": args.output_layout,
+        "build_ensembles": args.ensembles,
+        "score_forecasts": args.score,
+        "payload_format": args.payload_format,
+        "significant_digits": args.significant_digits,
+        "lean": not args.keep_intermediates,
+    }
+    store = OutputStore(args.store) if args.store else None
+    manifest = None
+    if args.content_addressed:
+        manifest = BuildManifest(
+            args.output_path, delta_max_ratio=args.delta_max_ratio if args.deltas else None, keep_builds=args.keep_builds
         )
-        # Iteratively save output files
-        logger.info("Saving flu JSON files...")
-        for filename, contents in flu_processor_object.output_dict.items():
-            save_json_file(
-                pathogen='flusight',
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Fetching documents for MyRespiLens...")
-        myrespi_fetch(hub_path=args.flusight_hub_path, folder_name="flusight", output_path=args.output_path)
-        logger.info("Success ✅")
 
-    
-    if args.rsv_hub_path:
-        # Use HubdataPy to get all RSV data in one df
-        logger.info("Establishing connection to local RSV repository...")
-        rsv_hub_conn = connect_hub(args.rsv_hub_path)
-        logger.info("Success ✅")
-        logger.info("Collecting data from RSV repo...")
-        rsv_hubverse_df = clean_nan_values(hubverse_df_preprocessor(df=rsv_hub_conn.get_dataset().to_table().to_pandas(), filter_nowcasts=True))
-        rsv_target_data = clean_nan_values(connect_target_data(hub_path=args.rsv_hub_path, target_type=TargetType.TIME_SERIES).to_table().to_pandas()) 
-        logger.info("Success ✅")
-        # Initialize converter object
-        rsv_processor_object = RSVDataProcessor(
-            data=rsv_hubverse_df,
-            locations_data=LOCATIONS_DATA,
-            target_data=rsv_target_data,
+    hub_inputs = {} # hub name -> HubInputs, kept warm for --watch
+    digests = {} if args.watch else None # pathogen -> filename -> digest of the last written payload
+    initial_fingerprints = {}
+    bundle_slices = {} if args.bundles else None # dataset -> abbreviation -> latest slice, taken from the in-memory outputs
+    bundle_weeks = HubDatasetConfig.latest_ground_truth_weeks
+    for source in HUB_SOURCES:
+        hub_path = getattr(args, source.path_arg)
+        if not hub_path:
+            continue
+        if args.watch: # taken before loading, so changes made during the build are picked up by the first poll
+            initial_fingerprints[source.name] = hub_fingerprint(hub_path)
+        inputs, processor, _ = build_hub(
+            source, hub_path, args, processor_options, store=store,
+            digests=None if digests is None else digests.setdefault(source.pathogen, {}), manifest=manifest,
         )
-        # Iteratively save output files
-        logger.info("Saving RSV JSON files...")
-        for filename, contents in rsv_processor_object.output_dict.items():
-            save_json_file(
-                pathogen='rsvforecasthub',
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Fetching documents for MyRespiLens...")
-        myrespi_fetch(hub_path=args.rsv_hub_path, folder_name="rsvforecasthub", output_path=args.output_path)
-        logger.info("Success ✅")
-    
-    if args.covid_hub_path:
-        # Use HubdataPy to get all covid19 data in one df
-        logger.info("Establishing connection to local covid19 repository...")
-        covid_hub_conn = connect_hub(args.covid_hub_path)
-        logger.info("Success ✅")
-        logger.info("Collecting data from covid19 repo...")
-        covid_hubverse_df = clean_nan_values(hubverse_df_preprocessor(df=covid_hub_conn.get_dataset().to_table().to_pandas(), filter_nowcasts=True))
-        covid_target_data = clean_nan_values(connect_target_data(hub_path=args.covid_hub_path, target_type=TargetType.TIME_SERIES).to_table().to_pandas())
-        logger.info("Success ✅")
-        # Initialize converter object
-        covid_processor_object = COVIDDataProcessor(
-            data=covid_hubverse_df,
-            locations_data=LOCATIONS_DATA,
-            target_data=covid_target_data,
+        if args.watch:
+            hub_inputs[source.name] = inputs
+        if bundle_slices is not None:
+            bundle_slices[source.name] = dataset_slices(source.name, processor.output_dict, series_weeks=bundle_weeks)
+        del processor
+
+    for source in CDC_SOURCES:
+        if not getattr(args, source.flag):
+            continue
+        if args.watch:
+            initial_fingerprints[source.name] = _initial_cdc_fingerprint(source)
+        outputs, _ = build_cdc(
+            source, args.output_path, store=store,
+            digests=None if digests is None else digests.setdefault(source.name, {}), manifest=manifest,
         )
-        # Iteratively save output files
-        logger.info("Saving covid19 JSON files...")
-        for filename, contents in covid_processor_object.output_dict.items():
-            save_json_file(
-                pathogen='covid19forecasthub',
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Fetching documents for MyRespiLens...")
-        myrespi_fetch(hub_path=args.covid_hub_path, folder_name="covid19forecasthub", output_path=args.output_path)
-        logger.info("Success ✅")
-    
-    if args.flu_metrocast_hub_path:
-        # Use HubdataPy to get all flu-metrocast data in one df
-        logger.info("Establishing connection to local flu metrocast repository...")
-        flu_metrocast_hub_conn = connect_hub(args.flu_metrocast_hub_path)
-        logger.info("Success ✅")
-        logger.info("Collecting data from flu metrocast repo...")
-        flu_metrocast_hubverse_df = clean_nan_values(hubverse_df_preprocessor(df=flu_metrocast_hub_conn.get_dataset().to_table().to_pandas(), filter_nowcasts=True))
-        flu_metrocast_locations_data = clean_nan_values(pd.read_csv(Path(args.flu_metrocast_hub_path) / 'auxiliary-data/locations.csv')) # DEP: metrocast still pulls hub locations.csv
-        flu_metrocast_target_data = clean_nan_values(connect_target_data(hub_path=args.flu_metrocast_hub_path, target_type=TargetType.TIME_SERIES).to_table().to_pandas())
-        logger.info("Success ✅")
-        # Initialize converter object
-        flu_metrocast_processor_object = FluMetrocastDataProcessor(
-            data=flu_metrocast_hubverse_df,
-            locations_data=flu_metrocast_locations_data,
-            target_data=flu_metrocast_target_data
+        if bundle_slices is not None:
+            bundle_slices[source.name] = dataset_slices(source.name, outputs, series_weeks=bundle_weeks)
+        del outputs
+    if bundle_slices:
+        build_bundles(
+            bundle_slices, args.output_path, indent=None if args.payload_format == "compact" else 4,
+            digests=None if digests is None else digests.setdefault("bundles", {}), manifest=manifest,
         )
-        # Iteratively save output files
-        logger.info("Saving flu metrocast JSON files...")
-        for filename, contents in flu_metrocast_processor_object.output_dict.items():
-            save_json_file(
-                pathogen='flumetrocast',
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Fetching documents for MyRespiLens...")
-        myrespi_fetch(hub_path=args.flu_metrocast_hub_path, folder_name="flumetrocast", output_path=args.output_path)
-        logger.info("Success ✅")
+    if manifest is not None:
+        manifest.write()
+        logger.info(f"Build manifest ({len(manifest.files)} files) written to {manifest.path}")
 
-    if args.NHSN:
-        NHSN_processor_object = NHSNDataProcessor(resource_id='ua7e-t2fy', replace_column_names=True)
-        logger.info("Iteratively saving NHSN JSON files...")
-        for filename, contents in NHSN_processor_object.output_dict.items():
-            save_json_file(
-                pathogen="nhsn",
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Success ✅")
-
-    if args.NSSP:
-        NSSP_processor_object = NSSPDataProcessor(resource_id='rdmq-nq56')
-        logger.info("Iteratively saving NSSP JSON files...")
-        for filename, contents in NSSP_processor_object.output_dict.items():
-            save_json_file(
-                pathogen="nssp",
-                output_path=args.output_path,
-                output_filename=filename,
-                file_contents=contents,
-                overwrite=True
-            )
-        logger.info("Success ✅")
-        # save the location info we need to save (for easier frontend processing w/ schematic map of states)
-        save_json_file(
-            pathogen="nssp",
-            output_path=args.output_path,
-            output_filename="location_info.json",
-            file_contents = NSSP_processor_object.output_dict["location_info.json"],
-            overwrite=True
+    if args.watch:
+        watcher = Watcher(
+            watch_sources(args, processor_options, store, hub_inputs, digests, manifest=manifest, bundle_slices=bundle_slices),
+            status_path=args.status_file or Path(args.output_path) / WATCH_STATUS_FILENAME,
+            initial=initial_fingerprints,
         )
-    
+        status_server = watcher.serve_status(args.status_port) if args.status_port else None
+        logger.info("Watching for changes (hubs every %ss, CDC every %ss)...", args.poll_interval, args.cdc_poll_interval)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logger.info("Stopping watch mode...")
+        finally:
+            if status_server is not None:
+                status_server.shutdown()
+
+    if store is not None:
+        store.close()
+    write_run_report(args)
     logger.info("Process complete.")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except MemoryBudgetExceeded as error:
+        logger.error(f"🛑 {error}")
+        for stage in error.report["memory"]["top_stages"]:
+            logger.error(f"    {stage}")
+        sys.exit(1)
     
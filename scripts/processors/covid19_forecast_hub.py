@@ -6,15 +6,19 @@ from hub_dataset_processor import HubDataProcessorBase, HubDatasetConfig
 
 
 class COVIDDataProcessor(HubDataProcessorBase):
-    def __init__(self, data: pd.DataFrame, locations_data: pd.DataFrame, target_data: pd.DataFrame):
-        config = HubDatasetConfig(
-            file_suffix="covid19",
-            dataset_label="covid19 forecast hub",
-            ground_truth_min_date=pd.Timestamp("2023-10-01"),
-        )
+    config = HubDatasetConfig(
+        file_suffix="covid19",
+        dataset_label="covid19 forecast hub",
+        ground_truth_min_date=pd.Timestamp("2023-10-01"),
+        baseline_model="CovidHub-baseline",
+        ensemble_models=("CovidHub-ensemble",),
+    )
+
+    def __init__(self, data: pd.DataFrame, locations_data: pd.DataFrame, target_data: pd.DataFrame, **kwargs):
         super().__init__(
             data=data,
             locations_data=locations_data,
             target_data=target_data,
-            config=config,
+            config=self.config,
+            **kwargs,
         )
@@ -2,19 +2,25 @@
 
 import pandas as pd
 
+from helper import FLU_PEAK_TARGETS
 from hub_dataset_processor import HubDataProcessorBase, HubDatasetConfig
 
 
 class FlusightDataProcessor(HubDataProcessorBase):
-    def __init__(self, data: pd.DataFrame, locations_data: pd.DataFrame, target_data: pd.DataFrame):
-        config = HubDatasetConfig(
-            file_suffix="flu",
-            dataset_label="flusight forecasts",
-            ground_truth_min_date=pd.Timestamp("2022-10-01"),
-        )
+    config = HubDatasetConfig(
+        file_suffix="flu",
+        dataset_label="flusight forecasts",
+        ground_truth_min_date=pd.Timestamp("2022-10-01"),
+        baseline_model="FluSight-baseline",
+        ensemble_models=("FluSight-ensemble",),
+        peak_targets=FLU_PEAK_TARGETS,
+    )
+
+    def __init__(self, data: pd.DataFrame, locations_data: pd.DataFrame, target_data: pd.DataFrame, **kwargs):
         super().__init__(
             data=data,
             locations_data=locations_data,
             target_data=target_data,
-            config=config,
+            config=self.config,
+            **kwargs,
         )
@@ -0,0 +1,235 @@
+"""
+Vectorized Weighted Interval Score (WIS) scoring of Hubverse quantile forecasts.
+
+Scores are computed per forecast (one model's quantiles for a location, reference date,
+target and horizon) from NumPy arrays, then summarised into compact leaderboard payloads.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from helper import PEAK_TARGETS
+
+
+# One scored forecast per unique combination of these columns
+FORECAST_KEYS = ["location", "reference_date", "target", "model_id", "horizon", "target_end_date"]
+# Hash of a forecast's (quantile_level, value) pairs, so revised forecasts are not reused
+DIGEST_COLUMN = "forecast_digest"
+
+# Central prediction intervals reported as coverage, as (lower level, upper level)
+COVERAGE_INTERVALS = {
+    "coverage_50": (0.25, 0.75),
+    "coverage_95": (0.025, 0.975),
+}
+
+LEADERBOARD_COLUMNS = ["model", "n", "wis", "relative_wis", "ae_median", "coverage_50", "coverage_95"]
+
+
+def score_quantile_forecasts(
+    forecasts: pd.DataFrame,
+    ground_truth: pd.DataFrame,
+    observation_column: str = "observation",
+    previous_scores: Optional[pd.DataFrame] = None,
+    exclude_targets: Iterable[str] = PEAK_TARGETS,
+) -> pd.DataFrame:
+    """
+    Score quantile forecasts against ground truth with WIS, median absolute error and interval coverage.
+
+    WIS is the mean quantile (pinball) score over the submitted levels, which for a symmetric
+    set of levels that includes the median equals scoringutils' interval-based WIS.
+
+    Args:
+        forecasts: Hubverse rows with `location`, `reference_date`, `target`, `model_id`, `horizon`,
+            `target_end_date`, `output_type`, `value` and either a typed `quantile_level`
+            or a raw `output_type_id` column
+        ground_truth: Observations with `location`, `target`, `target_end_date` and `observation_column`
+            (one row per date and target, as produced by `HubDataProcessorBase._prepare_ground_truth_df`)
+        observation_column: Name of the observed value column in `ground_truth`
+        previous_scores: Output of an earlier call; forecasts whose observation and values are unchanged
+            (same DIGEST_COLUMN) are reused from here instead of being re-scored
+        exclude_targets: Targets that are not scored (the dataset's peak targets)
+
+    Returns:
+        One row per forecast: FORECAST_KEYS, DIGEST_COLUMN, `observation`, `n_quantiles`, `wis`, `ae_median`
+        and the COVERAGE_INTERVALS columns (NaN where a forecast lacks the interval's levels).
+    """
+    quantile_rows = forecasts[(forecasts["output_type"] == "quantile") & ~forecasts["target"].isin(list(exclude_targets))]
+    levels = (
+        quantile_rows["quantile_level"]
+        if "quantile_level" in quantile_rows.columns
+        else pd.to_numeric(quantile_rows["output_type_id"], errors="coerce")
+    )
+    rows = pd.DataFrame({
+        "location": quantile_rows["location"].astype(str),
+        "reference_date": quantile_rows["reference_date"].astype(str),
+        "target": quantile_rows["target"].astype(str),
+        "model_id": quantile_rows["model_id"].astype(str),
+        "horizon": quantile_rows["horizon"].astype(int),
+        "target_end_date": pd.to_datetime(quantile_rows["target_end_date"]).dt.strftime("%Y-%m-%d"),
+        "quantile_level": levels.astype(float),
+        "value": pd.to_numeric(quantile_rows["value"], errors="coerce"),
+    })
+    truth = pd.DataFrame({
+        "location": ground_truth["location"].astype(str),
+        "target": ground_truth["target"].astype(str),
+        "target_end_date": pd.to_datetime(ground_truth["target_end_date"]).dt.strftime("%Y-%m-%d"),
+        "observation": pd.to_numeric(ground_truth[observation_column], errors="coerce"),
+    }).dropna(subset=["observation"])
+    rows = rows.merge(truth, on=["location", "target", "target_end_date"], how="inner")
+    rows[DIGEST_COLUMN] = _forecast_digests(rows)
+
+    reused = _empty_scores()
+    reuse_keys = FORECAST_KEYS + [DIGEST_COLUMN, "observation"]
+    if previous_scores is not None and DIGEST_COLUMN in previous_scores.columns and not previous_scores.empty and not rows.empty:
+        # Only forecasts whose values or observation changed (or that are new) need scoring again
+        unchanged = previous_scores.merge(rows[reuse_keys].drop_duplicates(), on=reuse_keys, how="inner")
+        if not unchanged.empty:
+            reused = unchanged[_empty_scores().columns]
+            is_unchanged = rows.merge(
+                unchanged[FORECAST_KEYS].assign(_unchanged=True), on=FORECAST_KEYS, how="left"
+            )["_unchanged"].fillna(False).to_numpy(dtype=bool)
+            rows = rows[~is_unchanged]
+
+    if rows.empty:
+        return reused.reset_index(drop=True)
+
+    # groups are numbered in order of first appearance, matching `drop_duplicates` below
+    group_ids = rows.groupby(FORECAST_KEYS, sort=False).ngroup().to_numpy()
+    scores = rows[FORECAST_KEYS + [DIGEST_COLUMN]].drop_duplicates().reset_index(drop=True)
+    n_groups = len(scores)
+    tau = rows["quantile_level"].to_numpy()
+    q = rows["value"].to_numpy(dtype=float)
+    y = rows["observation"].to_numpy(dtype=float)
+
+    counts = np.bincount(group_ids, minlength=n_groups)
+    pinball = 2.0 * ((y < q).astype(float) - tau) * (q - y)
+    scores["observation"] = np.bincount(group_ids, weights=y, minlength=n_groups) / counts
+    scores["n_quantiles"] = counts
+    scores["wis"] = np.bincount(group_ids, weights=pinball, minlength=n_groups) / counts
+
+    is_median = np.isclose(tau, 0.5)
+    median_counts = np.bincount(group_ids[is_median], minlength=n_groups)
+    median_errors = np.bincount(group_ids[is_median], weights=np.abs(y - q)[is_median], minlength=n_groups)
+    scores["ae_median"] = np.where(median_counts > 0, median_errors / np.maximum(median_counts, 1), np.nan)
+
+    for column, (lower, upper) in COVERAGE_INTERVALS.items():
+        is_lower = np.isclose(tau, lower)
+        is_upper = np.isclose(tau, upper)
+        bound_counts = np.bincount(group_ids[is_lower | is_upper], minlength=n_groups)
+        misses = (is_lower & (q > y)) | (is_upper & (q < y))
+        miss_counts = np.bincount(group_ids[misses], minlength=n_groups)
+        scores[column] = np.where(bound_counts == 2, (miss_counts == 0).astype(float), np.nan)
+
+    return pd.concat([reused, scores], ignore_index=True) if not reused.empty else scores
+
+
+def relative_skill(scores: pd.DataFrame, baseline_model: Optional[str] = None) -> pd.Series:
+    """
+    Pairwise relative WIS per model (lower is better), as in scoringutils' `get_pairwise_comparisons`.
+
+    For each pair of models the ratio of mean WIS is taken over the forecasts both made;
+    a model's skill is the geometric mean of its ratios against all models. If `baseline_model`
+    is present, skills are divided by the baseline's so it scores exactly 1.
+    """
+    wide = scores.pivot_table(
+        index=[key for key in FORECAST_KEYS if key != "model_id"], columns="model_id", values="wis", aggfunc="first"
+    )
+    models = wide.columns.tolist()
+    available = wide.notna().to_numpy(dtype=float)
+    wis = wide.fillna(0.0).to_numpy()
+
+    # overlap_sums[i, j] = total WIS of model i over forecasts that models i and j both made
+    overlap_sums = wis.T @ available
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = overlap_sums / overlap_sums.T
+        has_overlap = (available.T @ available) > 0
+        comparable = has_overlap & np.isfinite(ratios) & (ratios > 0)
+        log_ratios = np.where(comparable, np.log(np.where(comparable, ratios, 1.0)), 0.0)
+        theta = np.exp(log_ratios.sum(axis=1) / comparable.sum(axis=1))
+    skill = pd.Series(theta, index=models, dtype=float)
+    if baseline_model is not None and baseline_model in skill.index and skill[baseline_model] > 0:
+        skill = skill / skill[baseline_model]
+    return skill
+
+
+def build_leaderboard(
+    scores: pd.DataFrame,
+    baseline_model: Optional[str] = None,
+    dataset_label: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Summarise per-forecast scores into a compact leaderboard payload.
+
+    Rows are LEADERBOARD_COLUMNS lists, sorted by relative WIS, for every target
+    overall, by horizon and by location.
+    """
+    leaderboard: Dict[str, Any] = {
+        "last_updated": pd.Timestamp.now(tz='UTC').strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "dataset": dataset_label,
+        "baseline_model": baseline_model,
+        "columns": LEADERBOARD_COLUMNS,
+        "reference_dates": sorted(scores["reference_date"].unique().tolist()),
+        "targets": {},
+    }
+    for target, target_scores in scores.groupby("target", sort=True):
+        leaderboard["targets"][target] = {
+            "overall": _leaderboard_rows(target_scores, baseline_model),
+            "by_horizon": {
+                str(horizon): _leaderboard_rows(horizon_scores, baseline_model)
+                for horizon, horizon_scores in target_scores.groupby("horizon", sort=True)
+            },
+            "by_location": {
+                str(location): _leaderboard_rows(location_scores, baseline_model)
+                for location, location_scores in target_scores.groupby("location", sort=True)
+            },
+        }
+    return leaderboard
+
+
+def _leaderboard_rows(scores: pd.DataFrame, baseline_model: Optional[str]) -> List[List[Any]]:
+    summary = scores.groupby("model_id").agg(
+        n=("wis", "size"),
+        wis=("wis", "mean"),
+        ae_median=("ae_median", "mean"),
+        coverage_50=("coverage_50", "mean"),
+        coverage_95=("coverage_95", "mean"),
+    )
+    summary["relative_wis"] = relative_skill(scores, baseline_model)
+    summary = summary.sort_values(["relative_wis", "wis"], na_position="last")
+    return [
+        [str(model)] + [_round_or_none(summary.at[model, column]) for column in LEADERBOARD_COLUMNS[1:]]
+        for model in summary.index
+    ]
+
+
+def _round_or_none(value: Any, digits: int = 4) -> Any:
+    if pd.isna(value):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return round(float(value), digits)
+
+
+def _forecast_digests(rows: pd.DataFrame) -> np.ndarray:
+    """Per-row digest of the row's forecast: the wrapping sum of its (quantile_level, value) pair hashes."""
+    if rows.empty:
+        return np.array([], dtype=np.uint64)
+    group_ids = rows.groupby(FORECAST_KEYS, sort=False).ngroup().to_numpy()
+    pair_hashes = pd.util.hash_pandas_object(rows[["quantile_level", "value"]], index=False).to_numpy()
+    digests = np.zeros(group_ids.max() + 1, dtype=np.uint64)
+    np.add.at(digests, group_ids, pair_hashes) # uint64 addition wraps, and does not depend on row order
+    return digests[group_ids]
+
+
+def _empty_scores() -> pd.DataFrame:
+    return pd.DataFrame(
+        columns=FORECAST_KEYS + [DIGEST_COLUMN, "observation", "n_quantiles", "wis", "ae_median"] + list(COVERAGE_INTERVALS)
+    )
+
+
+def concat_scores(parts: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate per-location score frames (empty input gives an empty scores frame)."""
+    parts = [part for part in parts if not part.empty]
+    return pd.concat(parts, ignore_index=True) if parts else _empty_scores()
@@ -0,0 +1,138 @@
+"""Load generator for `slice_server.py`: replays random forecast slice requests and reports latency percentiles."""
+
+import argparse
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def build_request_pool(meta: Dict[str, Any], dataset: str, distinct: int, seed: int) -> List[str]:
+    """Draw `distinct` random slice URLs (location, target, reference date window, model subset) from `/meta`."""
+    rng = random.Random(seed)
+    reference_dates = meta["reference_dates"]
+    pool = []
+    for _ in range(distinct):
+        start = rng.randrange(len(reference_dates))
+        end = min(len(reference_dates) - 1, start + rng.randrange(1, 9))
+        query = {
+            "location": rng.choice(meta["locations"]),
+            "target": rng.choice(meta["targets"]),
+            "start": reference_dates[start],
+            "end": reference_dates[end],
+        }
+        if rng.random() < 0.5:
+            query["models"] = ",".join(rng.sample(meta["models"], k=rng.randint(1, min(3, len(meta["models"])))))
+        pool.append(f"/{dataset}/forecasts?{urlencode(query)}")
+    return pool
+
+
+def run_load(
+    url: str,
+    dataset: str,
+    requests: int = 2000,
+    concurrency: int = 8,
+    distinct: int = 200,
+    use_gzip: bool = True,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Send `requests` GETs from `concurrency` keep-alive connections and summarize the run.
+
+    Requests are drawn from a pool of `distinct` slices, so repeated slices exercise the
+    server's response cache.
+    """
+    parts = urlsplit(url)
+    meta_connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    meta_connection.request("GET", f"/{dataset}/meta")
+    meta = json.loads(meta_connection.getresponse().read())
+    meta_connection.close()
+    pool = build_request_pool(meta, dataset, distinct, seed)
+    headers = {"Accept-Encoding": "gzip"} if use_gzip else {}
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    received_bytes = [0]
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def worker(worker_index: int) -> None:
+        rng = random.Random(seed + worker_index + 1)
+        connection = http.client.HTTPConnection(parts.hostname, parts.port)
+        local_latencies, local_statuses, local_bytes = [], {}, 0
+        for _ in range(per_worker[worker_index]):
+            start = time.perf_counter()
+            connection.request("GET", rng.choice(pool), headers=headers)
+            response = connection.getresponse()
+            local_bytes += len(response.read())
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            received_bytes[0] += local_bytes
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "dataset": dataset,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "distinct_slices": distinct,
+        "gzip": use_gzip,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            name: round(float(np.percentile(latencies_ms, q)), 3) if len(latencies_ms) else None
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "bytes_received": received_bytes[0],
+    }
+
+
+def main():
+    """
+    Main execution function
+    """
+    parser = argparse.ArgumentParser(description="Benchmark slice_server.py with random forecast slice requests.")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8765", help="Base URL of the running slice server.")
+    parser.add_argument("--dataset", type=str, required=True, help="Dataset to query (e.g. flusight).")
+    parser.add_argument("--requests", type=int, default=2000, help="Total number of requests.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent keep-alive connections.")
+    parser.add_argument("--distinct", type=int, default=200, help="Number of distinct slices requests are drawn from.")
+    parser.add_argument("--no-gzip", action="store_true", help="Request uncompressed responses.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the request mix.")
+    parser.add_argument("--output", type=str, help="Optional path to write the JSON report to.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = run_load(
+        args.url, args.dataset, requests=args.requests, concurrency=args.concurrency,
+        distinct=args.distinct, use_gzip=not args.no_gzip, seed=args.seed,
+    )
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as of:
+            json.dump(report, of, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Local HTTP service answering forecast slice requests from an `output_store` database.
+
+Each hub's forecast rows are dictionary-encoded into NumPy column files, sorted by
+(location, target, reference date, model, horizon) and memory-mapped, so a slice
+(location + target + reference date range + model subset) is a contiguous range found
+with a binary search. Responses are cached in an LRU, served with ETags (304 on
+`If-None-Match`) and gzip-compressed when the client accepts it.
+
+Endpoints:
+    GET /health
+    GET /{dataset}/meta
+    GET /{dataset}/forecasts?location=06&target=wk+inc+flu+hosp&start=2024-10-05&end=2024-12-28&models=A,B
+"""
+
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from hub_dataset_processor import PEAK_OUTPUT_TYPES
+from output_store import HUB_PROCESSORS, OutputStore
+
+logger = logging.getLogger(__name__)
+
+# Dictionary-encoded columns (codes index into the sorted tables in `tables.json`)
+CODED_COLUMNS = ("location", "target", "reference_date", "model_id", "output_type", "output_type_id", "target_end_date")
+NUMERIC_COLUMNS = ("horizon", "value")
+TABLES_FILENAME = "tables.json"
+
+
+class SliceRequestError(Exception):
+    """A slice request that cannot be answered; carries the HTTP status to return."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def build_columnar_cache(store_path: Union[str, Path], cache_dir: Union[str, Path], rebuild: bool = False) -> List[str]:
+    """
+    Write every hub in the store as memory-mappable column files under `cache_dir/{dataset}/`.
+
+    A dataset is only re-encoded when the store file is newer than its cache (or `rebuild`).
+    Returns the names of the cached datasets.
+    """
+    store_path, cache_dir = Path(store_path), Path(cache_dir)
+    store_mtime = store_path.stat().st_mtime
+    cached = []
+    with OutputStore(store_path) as store:
+        for dataset in store.datasets():
+            dataset_dir = cache_dir / dataset
+            tables_path = dataset_dir / TABLES_FILENAME
+            if not rebuild and tables_path.exists() and tables_path.stat().st_mtime >= store_mtime:
+                cached.append(dataset)
+                continue
+            df = pd.read_sql_query(
+                "SELECT location, target, reference_date, model_id, horizon, output_type, output_type_id, "
+                "target_end_date, value FROM forecasts WHERE dataset = ? ORDER BY rowid",
+                store.connection,
+                params=(dataset,),
+            )
+            if df.empty: # CDC-only datasets have no forecast rows
+                continue
+            logger.info("Encoding %s (%d rows) into %s...", dataset, len(df), dataset_dir)
+            dataset_dir.mkdir(parents=True, exist_ok=True)
+            codes, tables = {}, {}
+            for column in CODED_COLUMNS:
+                column_codes, uniques = pd.factorize(df[column].fillna(""), sort=True)
+                codes[column], tables[column] = column_codes.astype(np.int32), [str(value) for value in uniques]
+            # lexsort is stable, so rows within a forecast keep their store (submission) order
+            order = np.lexsort((
+                df["horizon"].to_numpy(), codes["model_id"], codes["reference_date"], codes["target"], codes["location"],
+            ))
+            for column in CODED_COLUMNS:
+                np.save(dataset_dir / f"{column}.npy", codes[column][order])
+            np.save(dataset_dir / "horizon.npy", df["horizon"].to_numpy(dtype=np.int64)[order])
+            np.save(dataset_dir / "value.npy", df["value"].to_numpy(dtype=np.float64, na_value=np.nan)[order])
+            with open(tables_path, "w") as of: # written last: its mtime marks a complete cache
+                json.dump(tables, of)
+            cached.append(dataset)
+    return cached
+
+
+class ColumnarDataset:
+    """One hub's memory-mapped forecast columns plus the (location, target) -> row range index."""
+
+    def __init__(self, dataset_dir: Union[str, Path], peak_targets: Tuple[str, ...] = ()) -> None:
+        dataset_dir = Path(dataset_dir)
+        self.peak_targets = set(peak_targets)
+        with open(dataset_dir / TABLES_FILENAME) as f:
+            self.tables: Dict[str, List[str]] = json.load(f)
+        self.columns = {
+            column: np.load(dataset_dir / f"{column}.npy", mmap_mode="r")
+            for column in (*CODED_COLUMNS, *NUMERIC_COLUMNS)
+        }
+        self.codes = {column: {value: i for i, value in enumerate(table)} for column, table in self.tables.items()}
+
+        # Rows are sorted by (location, target, ...), so each pair is one contiguous block
+        location, target = self.columns["location"], self.columns["target"]
+        boundaries = np.flatnonzero(np.concatenate((
+            [True], (location[1:] != location[:-1]) | (target[1:] != target[:-1])
+        ))) if len(location) else np.array([], dtype=int)
+        ends = np.append(boundaries[1:], len(location))
+        self.blocks: Dict[Tuple[int, int], Tuple[int, int]] = {
+            (int(location[start]), int(target[start])): (int(start), int(end))
+            for start, end in zip(boundaries, ends)
+        }
+
+    def meta(self) -> Dict[str, Any]:
+        return {
+            "locations": self.tables["location"],
+            "targets": self.tables["target"],
+            "models": self.tables["model_id"],
+            "reference_dates": self.tables["reference_date"],
+        }
+
+    def slice(
+        self,
+        location: str,
+        target: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        models: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Forecasts for one location and target, for reference dates in [start, end] and the given models.
+
+        Returns `{reference_date: {model: {...}}}` under `forecasts`, with each model entry in
+        the projections schema (`predictions` keyed by horizon, or the `peaks` layout for peak targets).
+        """
+        location_code = self.codes["location"].get(location)
+        target_code = self.codes["target"].get(target)
+        if location_code is None or target_code is None or (location_code, target_code) not in self.blocks:
+            raise SliceRequestError(404, f"No forecasts for location '{location}' and target '{target}'.")
+        block_start, block_end = self.blocks[(location_code, target_code)]
+
+        # reference date codes are sorted within the block; the date table is sorted too
+        reference_dates = self.tables["reference_date"]
+        first_code = bisect.bisect_left(reference_dates, start) if start else 0
+        last_code = bisect.bisect_right(reference_dates, end) if end else len(reference_dates)
+        block_dates = self.columns["reference_date"][block_start:block_end]
+        lo = block_start + int(np.searchsorted(block_dates, first_code, side="left"))
+        hi = block_start + int(np.searchsorted(block_dates, last_code, side="left"))
+
+        rows = np.arange(lo, hi)
+        if models:
+            wanted = [self.codes["model_id"][model] for model in models if model in self.codes["model_id"]]
+            rows = rows[np.isin(self.columns["model_id"][lo:hi], wanted)]
+        return {
+            "location": location,
+            "target": target,
+            "start": start,
+            "end": end,
+            "forecasts": self._format_rows(rows, is_peak=target in self.peak_targets),
+        }
+
+    def _format_rows(self, rows: np.ndarray, is_peak: bool) -> Dict[str, Any]:
+        if not len(rows):
+            return {}
+        date_codes = np.asarray(self.columns["reference_date"][rows])
+        model_codes = np.asarray(self.columns["model_id"][rows])
+        horizons = np.asarray(self.columns["horizon"][rows])
+        type_codes = np.asarray(self.columns["output_type"][rows])
+        ids = [self.tables["output_type_id"][code] for code in self.columns["output_type_id"][rows].tolist()]
+        end_dates = np.asarray(self.columns["target_end_date"][rows])
+        values = [None if value != value else value for value in self.columns["value"][rows].tolist()]
+
+        # one forecast per contiguous (reference date, model, horizon, output type) run
+        changes = (
+            (date_codes[1:] != date_codes[:-1]) | (model_codes[1:] != model_codes[:-1])
+            | (horizons[1:] != horizons[:-1]) | (type_codes[1:] != type_codes[:-1])
+        )
+        starts = np.flatnonzero(np.concatenate(([True], changes))).tolist()
+        ends = starts[1:] + [len(rows)]
+
+        forecasts: Dict[str, Any] = {}
+        for start, end in zip(starts, ends):
+            reference_date = self.tables["reference_date"][date_codes[start]]
+            model = self.tables["model_id"][model_codes[start]]
+            output_type = self.tables["output_type"][type_codes[start]]
+            model_dict = forecasts.setdefault(reference_date, {}).setdefault(model, {"type": output_type})
+            levels = [float(level) for level in ids[start:end]] if output_type == "quantile" else ids[start:end]
+            if is_peak:
+                id_key, value_key = PEAK_OUTPUT_TYPES.get(output_type, ("categories", "probabilities"))
+            else:
+                id_key, value_key = ("quantiles", "values") if output_type == "quantile" else ("categories", "probabilities")
+            prediction = {id_key: levels, value_key: values[start:end]}
+            if is_peak:
+                model_dict["predictions"] = prediction
+            else:
+                prediction = {"date": self.tables["target_end_date"][end_dates[start]], **prediction}
+                model_dict.setdefault("predictions", {})[str(int(horizons[start]))] = prediction
+        return forecasts
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with a maximum number of entries."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SliceService:
+    """Routes slice requests to memory-mapped datasets and caches encoded responses."""
+
+    def __init__(self, cache_dir: Union[str, Path], datasets: List[str], cache_size: int = 1024) -> None:
+        self.datasets = {
+            dataset: ColumnarDataset(Path(cache_dir) / dataset, peak_targets=HUB_PROCESSORS[dataset].config.peak_target_names)
+            for dataset in datasets
+        }
+        self.cache = LRUCache(cache_size)
+
+    def respond(self, path: str, query: Dict[str, List[str]]) -> Tuple[bytes, bytes, str]:
+        """Return `(body, gzipped body, etag)` for a request, computing it on a cache miss."""
+        is_health = path.strip("/") == "health" # live counters, never cached
+        key = (path, tuple(sorted((name, tuple(values)) for name, values in query.items())))
+        cached = None if is_health else self.cache.get(key)
+        if cached is not None:
+            return cached
+        body = json.dumps(self._payload(path, query), separators=(",", ":")).encode()
+        response = (body, gzip.compress(body, compresslevel=5), f'"{hashlib.sha1(body).hexdigest()}"')
+        if not is_health:
+            self.cache.put(key, response)
+        return response
+
+    def _payload(self, path: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"]:
+            return {
+                "status": "ok",
+                "datasets": sorted(self.datasets),
+                "cache": {"entries": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses},
+            }
+        if len(parts) != 2 or parts[0] not in self.datasets:
+            raise SliceRequestError(404, f"Unknown path '{path}'.")
+        dataset = self.datasets[parts[0]]
+        if parts[1] == "meta":
+            return dataset.meta()
+        if parts[1] == "forecasts":
+            if "location" not in query or "target" not in query:
+                raise SliceRequestError(400, "`location` and `target` query parameters are required.")
+            models = query.get("models", [""])[0]
+            return dataset.slice(
+                location=query["location"][0],
+                target=query["target"][0],
+                start=query.get("start", [None])[0],
+                end=query.get("end", [None])[0],
+                models=[model for model in models.split(",") if model] or None,
+            )
+        raise SliceRequestError(404, f"Unknown path '{path}'.")
+
+
+class SliceRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, so load generators can reuse connections
+    disable_nagle_algorithm = True # headers and body go out as separate writes; don't wait on delayed ACKs
+    service: SliceService # set on the handler subclass built by `make_server`
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        try:
+            body, gzipped, etag = self.service.respond(url.path, parse_qs(url.query))
+        except SliceRequestError as e:
+            self._send(e.status, json.dumps({"error": str(e)}).encode())
+            return
+        except Exception: # a broken cache file or a bug must not drop the connection without a response
+            logger.exception("Failed to serve %s", self.path)
+            self._send(500, json.dumps({"error": "Internal server error."}).encode())
+            return
+        if etag in self.headers.get("If-None-Match", ""):
+            self._send(304, b"", etag=etag)
+            return
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            self._send(200, gzipped, etag=etag, encoding="gzip")
+        else:
+            self._send(200, body, etag=etag)
+
+    def _send(self, status: int, body: bytes, etag: Optional[str] = None, encoding: Optional[str] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(service: SliceService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Build (but do not start) a threaded HTTP server for `service`; port 0 picks a free port."""
+    handler = type("BoundSliceRequestHandler", (SliceRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """
+    Main execution function
+    """
+    parser = argparse.ArgumentParser(description="Serve forecast slices from a RespiLens output store over HTTP.")
+    parser.add_argument("--store", type=str, required=True, help="Path to the SQLite store written by process_RespiLens_data.py --store.")
+    parser.add_argument("--cache-dir", type=str, required=True, help="Directory for the memory-mapped column files.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Maximum number of cached responses (LRU).")
+    parser.add_argument("--rebuild", action="store_true", help="Re-encode every dataset even if its column cache is up to date.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    datasets = build_columnar_cache(args.store, args.cache_dir, rebuild=args.rebuild)
+    server = make_server(SliceService(args.cache_dir, datasets, cache_size=args.cache_size), args.host, args.port)
+    logger.info("Serving %s on http://%s:%d", ", ".join(datasets), *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Long-running watch mode for `process_RespiLens_data.py --watch`.
+
+A `Watcher` polls a set of `WatchedSource`s on their own schedules. Each source has a
+cheap `fingerprint` (a hub repository's git HEAD, a CDC dataset's `rowsUpdatedAt`) and a
+`rebuild` callback that is only run when the fingerprint changes. The callback receives
+the previous and new fingerprints so it can work out what changed (see `changed_paths`
+and `affected_parts`) and only redo that part of the build.
+
+Per-source status (last check, last build and its duration, written/unchanged file counts,
+last error) is kept in memory and published as a JSON status file and, optionally, over
+HTTP:
+
+    GET /health   200 if every source's last build succeeded, else 503
+    GET /status   the full status document
+"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Top-level hub directories the build reads; changes anywhere else in a hub need no rebuild
+HUB_PARTS = ("model-output", "target-data", "auxiliary-data", "hub-config")
+CDC_METADATA_URL = "https://data.cdc.gov/api/views/{resource_id}.json"
+
+
+@dataclass
+class WatchedSource:
+    """
+    A source the watcher polls every `interval` seconds.
+
+    `rebuild(previous, current)` is called with the last built and the new fingerprint
+    (`previous` is None for the first build) and may return counts, e.g. `written`/`unchanged`.
+    """
+
+    name: str
+    fingerprint: Callable[[], Any]
+    rebuild: Callable[[Any, Any], Optional[Dict[str, int]]]
+    interval: float = 300.0
+
+
+@dataclass
+class SourceStatus:
+    """What the watcher knows about one source."""
+
+    fingerprint: Any = None
+    last_checked: Optional[float] = None
+    last_build_started: Optional[float] = None
+    last_build_finished: Optional[float] = None
+    last_build_seconds: Optional[float] = None
+    builds: int = 0
+    counts: Dict[str, int] = field(default_factory=dict)
+    last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": None if self.fingerprint is None else str(self.fingerprint),
+            "last_checked": _isoformat(self.last_checked),
+            "last_build_started": _isoformat(self.last_build_started),
+            "last_build_finished": _isoformat(self.last_build_finished),
+            "last_build_seconds": None if self.last_build_seconds is None else round(self.last_build_seconds, 3),
+            "builds": self.builds,
+            "counts": dict(self.counts),
+            "last_error": self.last_error,
+        }
+
+
+class Watcher:
+    """
+    Poll sources and rebuild the ones whose fingerprint changed.
+
+    `initial` maps source names to the fingerprint of an already completed build (e.g. the
+    full build `main` runs before watching), so they are not rebuilt on the first poll.
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[WatchedSource],
+        status_path: Optional[Union[str, Path]] = None,
+        initial: Optional[Dict[str, Any]] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.sources = {source.name: source for source in sources}
+        self.status_path = Path(status_path) if status_path else None
+        self.clock = clock
+        self.started = clock()
+        self._lock = threading.Lock()
+        self._next_poll = {name: self.started for name in self.sources}
+        self._status = {name: SourceStatus() for name in self.sources}
+        for name, fingerprint in (initial or {}).items():
+            self._status[name].fingerprint = fingerprint
+            self._status[name].last_checked = self._status[name].last_build_finished = self.started
+
+    def poll(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """Check `names` (default: every source that is due) and rebuild changed ones; returns the rebuilt names."""
+        now = self.clock()
+        if names is None:
+            names = [name for name, due in self._next_poll.items() if due <= now]
+        rebuilt = []
+        for name in names:
+            source, status = self.sources[name], self._status[name]
+            self._next_poll[name] = now + source.interval
+            try:
+                fingerprint = source.fingerprint()
+            except Exception as error: # a failed check is retried on the next poll
+                logger.warning("Checking %s failed: %s", name, error)
+                with self._lock:
+                    status.last_checked, status.last_error = self.clock(), f"check failed: {error}"
+                continue
+            with self._lock:
+                status.last_checked = self.clock()
+            if fingerprint is not None and fingerprint == status.fingerprint:
+                continue
+            if self._rebuild(source, status, fingerprint):
+                rebuilt.append(name)
+        self.write_status()
+        return rebuilt
+
+    def _rebuild(self, source: WatchedSource, status: SourceStatus, fingerprint: Any) -> bool:
+        logger.info("Rebuilding %s (%s -> %s)...", source.name, status.fingerprint, fingerprint)
+        started = self.clock()
+        with self._lock:
+            status.last_build_started = started
+        try:
+            counts = source.rebuild(status.fingerprint, fingerprint) or {}
+        except MemoryError as error: # includes MemoryBudgetExceeded: retrying would only run over again, so stop
+            with self._lock:
+                status.last_error = f"{type(error).__name__}: {error}"
+            self.write_status()
+            raise
+        except Exception as error: # keep the old fingerprint so the build is retried
+            logger.exception("Rebuilding %s failed", source.name)
+            with self._lock:
+                status.last_error = f"{type(error).__name__}: {error}"
+            return False
+        finished = self.clock()
+        with self._lock:
+            status.fingerprint = fingerprint
+            status.last_build_finished = finished
+            status.last_build_seconds = finished - started
+            status.builds += 1
+            status.counts = dict(counts)
+            status.last_error = None
+        logger.info("Rebuilt %s in %.1fs %s", source.name, finished - started, counts)
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        """The status document served on `/status` and written to `status_path`."""
+        with self._lock:
+            sources = {name: status.as_dict() for name, status in self._status.items()}
+        return {
+            "healthy": all(source["last_error"] is None for source in sources.values()),
+            "started": _isoformat(self.started),
+            "now": _isoformat(self.clock()),
+            "sources": sources,
+        }
+
+    def write_status(self) -> None:
+        """Atomically replace the status file (if any) with the current status."""
+        if self.status_path is None:
+            return
+        self.status_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.status_path.with_name(self.status_path.name + ".tmp")
+        temporary.write_text(json.dumps(self.status(), indent=2))
+        os.replace(temporary, self.status_path)
+
+    def serve_status(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve `/health` and `/status` from a daemon thread; call `.shutdown()` on the result to stop."""
+        server = ThreadingHTTPServer((host, port), _status_handler(self))
+        threading.Thread(target=server.serve_forever, name="watch-status", daemon=True).start()
+        logger.info("Serving watch status on http://%s:%d/status", host, server.server_address[1])
+        return server
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """Poll due sources until `stop` is set (or forever)."""
+        stop = stop or threading.Event()
+        self.write_status()
+        while not stop.is_set():
+            self.poll()
+            stop.wait(max(0.0, min(self._next_poll.values()) - self.clock()))
+
+
+def _status_handler(watcher: Watcher) -> type:
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            status = watcher.status()
+            if self.path.split("?")[0] == "/health":
+                code, body = (200 if status["healthy"] else 503), {"healthy": status["healthy"]}
+            elif self.path.split("?")[0] == "/status":
+                code, body = 200, status
+            else:
+                code, body = 404, {"error": f"unknown path {self.path}"}
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(format, *args)
+
+    return StatusHandler
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat(timespec="seconds")
+
+
+def _git(repo: Union[str, Path], *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *args], check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def hub_fingerprint(hub_path: Union[str, Path], pull: bool = False) -> Any:
+    """
+    A git hub's HEAD commit (after a fast-forward `git pull` if `pull`).
+
+    Hubs that are not git checkouts fall back to the file count and newest modification
+    time under HUB_PARTS.
+    """
+    hub_path = Path(hub_path)
+    if not (hub_path / ".git").exists():
+        files = [path.stat().st_mtime_ns for part in HUB_PARTS for path in (hub_path / part).rglob("*") if path.is_file()]
+        return f"{len(files)}:{max(files, default=0)}"
+    if pull:
+        _git(hub_path, "pull", "--ff-only", "--quiet")
+    return _git(hub_path, "rev-parse", "HEAD")
+
+
+def changed_paths(repo: Union[str, Path], previous: Optional[str], current: str) -> Optional[List[str]]:
+    """Paths changed between two commits, or None if that cannot be told (first build, no git, unknown commit)."""
+    if previous is None or not (Path(repo) / ".git").exists():
+        return None
+    try:
+        return _git(repo, "diff", "--name-only", previous, current).splitlines()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def affected_parts(paths: Optional[Iterable[str]]) -> Set[str]:
+    """The HUB_PARTS touched by `paths` (every part if `paths` is None)."""
+    if paths is None:
+        return set(HUB_PARTS)
+    return {part for part in (Path(path).parts[0] for path in paths if path) if part in HUB_PARTS}
+
+
+def cdc_fingerprint(resource_id: str, timeout: float = 30) -> Any:
+    """When a data.cdc.gov dataset's rows were last updated, from its (small) view metadata."""
+    response = requests.get(CDC_METADATA_URL.format(resource_id=resource_id), timeout=timeout)
+    response.raise_for_status()
+    metadata = response.json()
+    return metadata.get("rowsUpdatedAt") or metadata.get("viewLastModified")
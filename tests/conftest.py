@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "scripts"))
+sys.path.append(str(ROOT))  # the repository-level `baselinenowcast` package
+
+from external_data import load_inputs
+from support import SAMPLES
+
+
+@pytest.fixture
+def flusight_inputs():
+    """The FluSight sample hub: forecasts, target data and locations as the processors take them."""
+    base = SAMPLES / "flusight"
+    return load_inputs(
+        pathogen="flu",
+        data_path=base / "forecast_data.csv",
+        target_data_path=base / "target_data.csv",
+        locations_data_path=base / "locations.csv",
+    )
+
+
+@pytest.fixture
+def flusight_raw():
+    """The FluSight sample forecasts as raw hub model output (string `output_type_id`), for building datasets."""
+    return pd.read_csv(SAMPLES / "flusight" / "forecast_data.csv", dtype={"location": str, "output_type_id": str})
@@ -0,0 +1,27 @@
+import json
+from pathlib import Path
+
+SAMPLES = Path(__file__).resolve().parent / "samples"
+
+
+def load_expected(filename: str) -> dict:
+    path = SAMPLES / "expected" / filename
+    with path.open() as handle:
+        return json.load(handle)
+
+
+def sanitize(payload: dict) -> dict:
+    payload = json.loads(json.dumps(payload))  # deep copy
+    metadata = payload.get("metadata", {})
+    metadata.pop("last_updated", None)
+    return _canonicalize_numbers(payload)
+
+
+def _canonicalize_numbers(obj):
+    if isinstance(obj, dict):
+        return {key: _canonicalize_numbers(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_canonicalize_numbers(value) for value in obj]
+    if isinstance(obj, float):
+        return int(obj) if obj.is_integer() else round(obj, 10)
+    return obj
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from baselinenowcast import NOWCAST_MODEL, baseline_nowcasts, estimate_delay, nowcast_quantiles, reporting_triangle
+from hub_dataset_processor import ENSEMBLE_MODELS
+from processors import FlusightDataProcessor
+
+
+def test_baseline_nowcasts_recover_delay_and_join_processor_outputs(flusight_inputs):
+    # every week reports 50%, 80%, 95% then 100% of its final value over successive weekly vintages
+    shares = [0.5, 0.8, 0.95, 1.0]
+    dates = pd.date_range("2024-01-06", periods=20, freq="7D")
+    rows = [
+        {"location": location, "target": "wk inc flu hosp", "target_end_date": date, "as_of": as_of,
+         "observation": round(final * shares[min(delay, 3)])}
+        for location, final in (("06", 400), ("36", 1000))
+        for date in dates
+        for delay, as_of in enumerate(pd.date_range(date + pd.Timedelta(days=4), dates[-1] + pd.Timedelta(days=4), freq="7D"))
+    ]
+    target_data = pd.DataFrame(rows)
+
+    triangle = reporting_triangle(target_data)
+    assert triangle.values.shape == (2, 20, 5)
+    estimate = estimate_delay(triangle)
+    assert estimate.delay_pmf[0] == pytest.approx([0.5, 0.3, 0.15, 0.05, 0.0])
+
+    nowcasts = baseline_nowcasts(target_data, quantile_levels=[0.25, 0.5, 0.75])
+    assert set(nowcasts["model_id"]) == {NOWCAST_MODEL}
+    assert sorted(set(nowcasts["horizon"])) == [-4, -3, -2, -1]
+    assert nowcasts.loc[nowcasts["location"] == "36", "value"].tolist() == pytest.approx([1000.0] * 12)
+
+    fixture_nowcasts = baseline_nowcasts(flusight_inputs.target_data, quantile_levels=FlusightDataProcessor.config.quantile_levels)
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        nowcasts=fixture_nowcasts,
+        build_ensembles=True,
+    )
+
+    forecasts = processor.output_dict["CA_flu.json"]["forecasts"]
+    nowcast_reference_date = str(fixture_nowcasts["reference_date"].iloc[0])
+    nowcast_payload = forecasts[nowcast_reference_date]["wk inc flu hosp"][NOWCAST_MODEL]
+    assert all(int(horizon) < 0 for horizon in nowcast_payload["predictions"])
+    assert NOWCAST_MODEL in processor.output_dict["metadata.json"]["models"]
+    assert not any(model in forecasts[nowcast_reference_date]["wk inc flu hosp"] for model in ENSEMBLE_MODELS)
+
+
+def test_median_nowcast_scales_latest_value_by_completion_factor():
+    # the share reported in the first week alternates, so per-date ratios and the ratio of totals differ
+    dates = pd.date_range("2024-01-06", periods=12, freq="7D")
+    rows = [
+        {"location": "06", "target": "wk inc flu hosp", "target_end_date": date, "as_of": as_of,
+         "observation": final * (1.0 if delay else share)}
+        for date, final, share in zip(dates, [100, 300] * 6, [0.25, 0.75] * 6)
+        for delay, as_of in enumerate(pd.date_range(date + pd.Timedelta(days=4), dates[-1] + pd.Timedelta(days=4), freq="7D"))
+    ]
+    triangle = reporting_triangle(pd.DataFrame(rows), max_delay=1)
+    estimate = estimate_delay(triangle, levels=[0.25, 0.5, 0.75])
+
+    assert estimate.multipliers[0, 0] == pytest.approx(400 / 250)  # per-date ratios are 4 and 4/3
+    nowcasts = nowcast_quantiles(triangle, estimate)
+    assert nowcasts["quantile_level"].tolist() == [0.25, 0.5, 0.75]
+    latest = triangle.values[0, -1, 0]
+    assert nowcasts["value"].tolist()[1] == pytest.approx(latest * estimate.multipliers[0, 0])
+    assert np.all(np.diff(nowcasts["value"]) > 0)
@@ -0,0 +1,21 @@
+import json
+
+from benchmark import compare_results, run_benchmarks
+
+
+def test_benchmark_suite_runs_on_synthetic_inputs_and_flags_regressions():
+    results = run_benchmarks(repeat=1, hubs=["flusight"], n_locations=2, n_models=2, n_reference_dates=2)
+    benchmarks = results["benchmarks"]
+    assert set(benchmarks) == {
+        "flusight.preprocess", "flusight.process", "flusight.save_json",
+        "nhsn.process", "nhsn.save_json", "nssp.process", "nssp.save_json",
+    }
+    # two location files (single + latest) each, plus the dataset-wide files
+    assert benchmarks["flusight.process"]["files"] == 2 * 2 + 3
+    assert benchmarks["nhsn.process"]["files"] == 53
+    assert compare_results(results, results) == []
+
+    slower = json.loads(json.dumps(results))
+    slower["benchmarks"]["flusight.process"]["seconds"]["median"] *= 2
+    regressions = compare_results(slower, results, threshold=0.5)
+    assert [regression["benchmark"] for regression in regressions] == ["flusight.process"]
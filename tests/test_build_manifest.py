@@ -0,0 +1,48 @@
+from build_manifest import BuildManifest
+
+
+def test_build_manifest_names_outputs_by_content(tmp_path):
+    outputs = {
+        "metadata.json": {"last_updated": "2024-01-01T00:00:00Z", "models": ["A"]},
+        "CA_flu.json": {"forecasts": {"2024-01-06": 1}},
+        "CA_flu/index.json": {"reference_dates": ["2024-01-06"]},
+    }
+    first = BuildManifest(tmp_path)
+    assert first.save_dataset("flusight", outputs) == {"written": 3, "unchanged": 0, "deltas": 0}
+    first.save_dataset("nhsn", {"CA_nhsn.json": {"series": [1]}})
+    first_manifest = first.write()
+    ca_entry = first_manifest["files"]["flusight/CA_flu.json"]
+    assert ca_entry["path"].startswith("flusight/CA_flu.") and ca_entry["path"].endswith(".json")
+    assert (tmp_path / ca_entry["path"]).stat().st_size == ca_entry["size"]
+    assert first_manifest["files"]["flusight/CA_flu/index.json"]["path"].startswith("flusight/CA_flu/index.")
+
+    # next build: a new timestamp keeps names, a changed payload gets a new one, dropped files leave the manifest
+    second = BuildManifest(tmp_path)
+    counts = second.save_dataset("flusight", {
+        "metadata.json": {"last_updated": "2024-01-08T00:00:00Z", "models": ["A"]},
+        "CA_flu.json": {"forecasts": {"2024-01-06": 1, "2024-01-13": 2}},
+    })
+    second_manifest = second.write()
+
+    assert counts == {"written": 1, "unchanged": 1, "deltas": 0}
+    assert second_manifest["previous_build_id"] == first_manifest["build_id"]
+    assert second_manifest["files"]["flusight/metadata.json"] == first_manifest["files"]["flusight/metadata.json"]
+    assert second_manifest["files"]["flusight/CA_flu.json"]["path"] != ca_entry["path"]
+    assert second.previous_entry("flusight/CA_flu.json") == second_manifest["files"]["flusight/CA_flu.json"]
+    assert "flusight/CA_flu/index.json" not in second_manifest["files"]
+    assert second_manifest["files"]["nhsn/CA_nhsn.json"] == first_manifest["files"]["nhsn/CA_nhsn.json"]
+    assert (tmp_path / ca_entry["path"]).exists() # the last KEEP_BUILDS builds' files stay for clients holding their manifest
+
+
+def test_build_manifest_removes_files_only_older_builds_reference(tmp_path):
+    paths = []
+    for week in range(3):
+        manifest = BuildManifest(tmp_path, keep_builds=2)
+        manifest.save_dataset("flusight", {"CA_flu.json": {"forecasts": list(range(week + 1))}})
+        (tmp_path / "flusight" / "notes.json").write_text("{}")
+        paths.append(manifest.write()["files"]["flusight/CA_flu.json"]["path"])
+
+    assert not (tmp_path / paths[0]).exists()
+    assert (tmp_path / paths[1]).exists() and (tmp_path / paths[2]).exists()
+    assert len(list((tmp_path / "manifests").glob("*.json"))) == 2
+    assert (tmp_path / "flusight" / "notes.json").exists() # not a hashed file
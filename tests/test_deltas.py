@@ -0,0 +1,49 @@
+import json
+
+from build_manifest import BuildManifest
+from deltas import apply_delta, diff_payload
+from processors import FlusightDataProcessor
+from support import sanitize
+
+
+def test_deltas_patch_previous_build_payloads(tmp_path, flusight_inputs):
+    # yesterday's build lacks the latest reference date and ground truth vintage
+    yesterday = FlusightDataProcessor(
+        data=flusight_inputs.data[flusight_inputs.data["reference_date"] < "2023-10-14"],
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data[flusight_inputs.target_data["as_of"] < "2023-10-13"],
+    ).output_dict
+    today = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    ).output_dict
+
+    operations = diff_payload(yesterday["CA_flu.json"], today["CA_flu.json"])
+    assert {"op": "extend", "path": "/ground_truth/dates", "value": ["2023-10-21"]} in operations
+    assert [op["path"] for op in operations if op["op"] == "add"] == ["/forecasts/2023-10-14"]
+
+    first = BuildManifest(tmp_path, delta_max_ratio=0.5)
+    first.save_dataset("flusight", yesterday)
+    first.write()
+    second = BuildManifest(tmp_path, delta_max_ratio=0.5)
+    counts = second.save_dataset("flusight", today)
+    manifest = second.write()
+
+    entry = manifest["files"]["flusight/CA_flu.json"]
+    previous = first.previous["files"]["flusight/CA_flu.json"]
+    assert counts["deltas"] >= 1
+    assert entry["delta"]["from"] == previous["hash"]
+    assert entry["delta"]["size"] <= 0.5 * entry["size"]
+    delta = json.loads((tmp_path / entry["delta"]["path"]).read_text())
+    assert (delta["from"], delta["to"]) == (previous["hash"], entry["hash"])
+    patched = apply_delta(json.loads((tmp_path / previous["path"]).read_text()), delta)
+    assert sanitize(patched) == sanitize(today["CA_flu.json"])
+    # metadata only changes its timestamp, so it keeps its file and has no patch
+    assert manifest["files"]["flusight/metadata.json"] == first.previous["files"]["flusight/metadata.json"]
+
+    # a patch that is not much smaller than the file is not written
+    strict = BuildManifest(tmp_path, delta_max_ratio=0.01)
+    strict.previous = first.previous
+    strict.save_dataset("flusight", today)
+    assert "delta" not in strict.files["flusight/CA_flu.json"]
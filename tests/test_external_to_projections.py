@@ -0,0 +1,146 @@
+import json
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+import external_data
+from external_data import FORECAST_REQUIRED_COLUMNS, ExternalDataError, load_forecast_inputs
+from external_to_projections import BATCH_REPORT_FILENAME, main, read_batch_manifest, run_batch
+from processors import FlusightDataProcessor
+from support import SAMPLES
+
+MANIFEST_HEADER = "name,pathogen,data_path,target_data_path,locations_data_path\n"
+
+
+@pytest.fixture
+def batch_dir(tmp_path):
+    """A manifest directory holding the FluSight sample files under relative paths."""
+    inputs = tmp_path / "inputs"
+    shutil.copytree(SAMPLES / "flusight", inputs)
+    (inputs / "broken.csv").write_text("location,value\n06,1\n")
+    return tmp_path
+
+
+def _write_manifest(directory, rows):
+    path = directory / "manifest.csv"
+    path.write_text(MANIFEST_HEADER + "".join(",".join(row) + "\n" for row in rows))
+    return path
+
+
+def test_batch_manifest_paths_resolve_against_the_manifest_directory(batch_dir, monkeypatch):
+    manifest = _write_manifest(batch_dir, [
+        ("good", "flu", "inputs/forecast_data.csv", "inputs/target_data.csv", "inputs/locations.csv"),
+    ])
+    monkeypatch.chdir(SAMPLES)
+    (submission,) = read_batch_manifest(manifest)
+    assert submission["data_path"] == str(batch_dir / "inputs" / "forecast_data.csv")
+    assert submission["locations_data_path"] == str(batch_dir / "inputs" / "locations.csv")
+
+
+def test_batch_manifest_rejects_missing_columns_and_duplicate_names(tmp_path):
+    missing = tmp_path / "missing.csv"
+    missing.write_text("name,pathogen,data_path\na,flu,a.csv\n")
+    with pytest.raises(ExternalDataError, match="missing required columns"):
+        read_batch_manifest(missing)
+    duplicates = _write_manifest(tmp_path, [("a", "flu", "a.csv", "t.csv", "l.csv")] * 2)
+    with pytest.raises(ExternalDataError, match="duplicate submission names"):
+        read_batch_manifest(duplicates)
+
+
+def test_run_batch_isolates_failed_submissions_and_reports_each_one(batch_dir):
+    submissions = read_batch_manifest(_write_manifest(batch_dir, [
+        ("good", "flu", "inputs/forecast_data.csv", "inputs/target_data.csv", "inputs/locations.csv"),
+        ("broken", "flu", "inputs/broken.csv", "inputs/target_data.csv", "inputs/locations.csv"),
+        ("no-targets", "flu", "inputs/forecast_data.csv", "inputs/absent.csv", "inputs/locations.csv"),
+    ]))
+    output = batch_dir / "out"
+    report = run_batch(submissions, output, overwrite=False, workers=2)
+
+    with open(output / BATCH_REPORT_FILENAME) as handle:
+        written = json.load(handle)
+    assert written["submissions"] == report
+    by_name = {entry["name"]: entry for entry in report}
+    assert [entry["name"] for entry in report] == ["broken", "good", "no-targets"]
+
+    good = by_name["good"]
+    assert good["status"] == "success" and good["error"] is None
+    assert good["rows"] > 0 and good["files"] > 0
+    assert (output / "good" / "flusight" / "CA_flu.json").exists()
+
+    # The worker's exception is caught and reported, and the other submissions still ran
+    broken = by_name["broken"]
+    assert broken["status"] == "failed" and broken["rows"] == 0 and broken["files"] == 0
+    assert broken["error"].startswith("ExternalDataError: ") and "missing required columns" in broken["error"]
+    assert not (output / "broken").exists()
+
+    # Shared inputs that fail to load fail their submissions without reaching the pool
+    no_targets = by_name["no-targets"]
+    assert no_targets["status"] == "failed" and no_targets["seconds"] == 0.0
+    assert "Target data path does not exist" in no_targets["error"]
+
+
+def test_batch_manifest_cli_exits_non_zero_when_a_submission_fails(batch_dir, monkeypatch):
+    manifest = _write_manifest(batch_dir, [
+        ("good", "flu", "inputs/forecast_data.csv", "inputs/target_data.csv", "inputs/locations.csv"),
+        ("broken", "flu", "inputs/broken.csv", "inputs/target_data.csv", "inputs/locations.csv"),
+    ])
+    output = batch_dir / "out"
+    monkeypatch.setattr(sys, "argv", [
+        "external_to_projections.py", "--output-path", str(output), "--batch-manifest", str(manifest), "--workers", "1",
+    ])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 1
+    with open(output / BATCH_REPORT_FILENAME) as handle:
+        statuses = {entry["name"]: entry["status"] for entry in json.load(handle)["submissions"]}
+    assert statuses == {"broken": "failed", "good": "success"}
+
+
+def test_forecast_inputs_use_the_processor_preprocessor(flusight_inputs):
+    calls = []
+
+    def preprocess(df, filter_nowcasts=True):
+        calls.append(filter_nowcasts)
+        return FlusightDataProcessor.config.preprocess(df, filter_nowcasts=filter_nowcasts)
+
+    base = SAMPLES / "flusight"
+    data = load_forecast_inputs(
+        base / "forecast_data.csv", flusight_inputs.locations_data, base / "locations.csv",
+        filter_nowcasts=False, preprocess=preprocess,
+    )
+    assert calls == [False]
+    assert len(data) == len(flusight_inputs.data)
+
+
+def _load_raw_forecasts(data_path, locations_data):
+    """Forecasts as the loader reads them, before preprocessing."""
+    return load_forecast_inputs(
+        data_path, locations_data, SAMPLES / "flusight" / "locations.csv", preprocess=lambda df, filter_nowcasts: df,
+    )
+
+
+def test_forecast_data_loads_the_same_from_csv_parquet_and_without_pyarrow(tmp_path, flusight_inputs, monkeypatch):
+    csv_path = tmp_path / "forecast_data.csv"
+    sample = pd.read_csv(SAMPLES / "flusight" / "forecast_data.csv", dtype=str)
+    sample.assign(notes="ignored").to_csv(csv_path, index=False)
+    from_csv = _load_raw_forecasts(csv_path, flusight_inputs.locations_data)
+    assert "notes" not in from_csv.columns
+    assert set(from_csv.columns) == FORECAST_REQUIRED_COLUMNS
+    assert from_csv["location"].tolist()[0] == "06" and from_csv["value"].dtype == "float64"
+
+    parquet_path = tmp_path / "forecast_data.parquet"
+    from_csv.assign(horizon=from_csv["horizon"].astype("int64"), notes="ignored").to_parquet(parquet_path, index=False)
+    pd.testing.assert_frame_equal(_load_raw_forecasts(parquet_path, flusight_inputs.locations_data), from_csv)
+
+    monkeypatch.setattr(external_data, "pa_csv", None)
+    pd.testing.assert_frame_equal(_load_raw_forecasts(csv_path, flusight_inputs.locations_data), from_csv)
+
+
+def test_forecast_locations_must_be_in_the_location_metadata(tmp_path, flusight_inputs):
+    data_path = tmp_path / "forecast_data.csv"
+    sample = pd.read_csv(SAMPLES / "flusight" / "forecast_data.csv", dtype=str)
+    pd.concat([sample, sample.head(1).assign(location="99")]).to_csv(data_path, index=False)
+    with pytest.raises(ExternalDataError, match=r"missing from location metadata: \['99'\]"):
+        _load_raw_forecasts(data_path, flusight_inputs.locations_data)
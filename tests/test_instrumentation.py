@@ -0,0 +1,86 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from helper import save_json_file
+import instrumentation
+from processors import FlusightDataProcessor
+
+
+def test_instrumentation_reports_merged_stage_spans(tmp_path, flusight_inputs):
+    assert instrumentation.span("idle") is instrumentation.NULL_SPAN
+
+    instrumentation.enable(profile_stage="forecasts")
+    try:
+        with instrumentation.span("flusight.process"):
+            processor = FlusightDataProcessor(
+                data=flusight_inputs.data,
+                locations_data=flusight_inputs.locations_data,
+                target_data=flusight_inputs.target_data,
+            )
+        with instrumentation.span("flusight.write"):
+            for filename, contents in processor.output_dict.items():
+                save_json_file("flusight", str(tmp_path), filename, contents, overwrite=True)
+        report = instrumentation.report()
+    finally:
+        instrumentation.disable()
+
+    stages = report["stages"]
+    assert stages["flusight.process/locations"]["groups"] == 1
+    assert stages["flusight.process/locations/forecasts"]["calls"] == 1
+    assert stages["flusight.write/save_json"]["files"] == len(processor.output_dict)
+    written = sum(path.stat().st_size for path in (tmp_path / "flusight").rglob("*.json"))
+    assert stages["flusight.write/save_json"]["bytes"] == written
+    assert any("_build_forecasts_key" in row["function"] for row in report["profile"]["functions"])
+    assert not instrumentation.is_enabled()
+
+
+def test_memory_tracking_names_top_stages_and_enforces_budget(tmp_path):
+    instrumentation.enable(track_memory="tracemalloc")
+    try:
+        with instrumentation.span("build"):
+            with instrumentation.span("small"):
+                small = np.ones(10_000)
+            with instrumentation.span("large"):
+                large = np.ones(2_000_000)
+                del large
+        report = instrumentation.report()
+    finally:
+        instrumentation.disable()
+
+    stages = report["stages"]
+    assert stages["build/large"]["alloc_peak_mb"] >= 15
+    assert stages["build/large"]["alloc_net_mb"] < 1
+    assert [stage["stage"] for stage in report["memory"]["top_stages"]][:2] == ["build", "build/large"]
+    assert report["memory"]["top_allocation_sites"]
+    assert small.size == 10_000
+
+    report_path = tmp_path / "run_report.json"
+    instrumentation.enable(memory_budget_mb=1, report_path=str(report_path))
+    try:
+        with pytest.raises(instrumentation.MemoryBudgetExceeded, match="1 MB memory budget at stage 'load'"):
+            with instrumentation.span("load"):
+                pass
+    finally:
+        instrumentation.disable()
+    written = json.loads(report_path.read_text())
+    assert written["memory"]["budget_exceeded"].startswith("RSS")
+
+
+def test_memory_watchdog_stops_a_stage_that_grows_past_the_budget(tmp_path):
+    budget_mb = instrumentation.rss_bytes()["current"] / 2**20 + 100
+    instrumentation.enable(memory_budget_mb=budget_mb, report_path=str(tmp_path / "run_report.json"))
+    try:
+        with pytest.raises(instrumentation.MemoryBudgetExceeded, match="memory budget at stage 'build/grow'"):
+            with instrumentation.span("build"):
+                with instrumentation.span("grow"):
+                    blocks = [np.ones(2**25 // 8) for _ in range(8)] # 256 MB, held inside one stage
+                    deadline = time.monotonic() + 5
+                    while time.monotonic() < deadline: # no span boundary until the watchdog fires
+                        time.sleep(0.01)
+    finally:
+        instrumentation.disable()
+    written = json.loads((tmp_path / "run_report.json").read_text())
+    assert "build/grow" in written["memory"]["budget_exceeded"]
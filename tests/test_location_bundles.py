@@ -0,0 +1,50 @@
+from location_bundles import build_location_bundles, dataset_slices
+from processors import FlusightDataProcessor
+
+
+def test_location_bundles_combine_latest_slices_with_shared_metadata(flusight_inputs):
+    flusight = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    ).output_dict
+    dates = [f"2023-{month:02d}-01" for month in range(1, 11)]
+    nhsn = {
+        "metadata.json": {"last_updated": "2023-10-21T00:00:00Z"},
+        "CA_nhsn.json": {
+            "metadata": {"location": "06", "abbreviation": "CA", "location_name": "California",
+                         "population": flusight["CA_flu.json"]["metadata"]["population"],
+                         "dataset": "NHSN", "series_type": "timeseries"},
+            "series": {"dates": dates, "Number of Hospitalized Patients": list(range(10))},
+        },
+    }
+    nssp = {
+        f"CA_{hsa}_nssp.json": {
+            "metadata": {"location": hsa, "abbreviation": "CA", "location_name": counties,
+                         "population": None, "dataset": "NSSP", "series_type": "timeseries"},
+            "series": {"dates": dates, "percent_visits_rsv": [0.1] * 10},
+        }
+        for hsa, counties in (("701", "Alameda"), ("702", "Fresno"))
+    }
+    slices = {
+        "flusight": dataset_slices("flusight", flusight),
+        "nhsn": dataset_slices("nhsn", nhsn, series_weeks=8),
+        "nssp": dataset_slices("nssp", nssp, series_weeks=8),
+    }
+    bundles = build_location_bundles(slices)
+
+    bundle = bundles["CA_bundle.json"]
+    assert bundle["metadata"] == {key: flusight["CA_flu.json"]["metadata"][key]
+                                  for key in ("location", "abbreviation", "location_name", "population")}
+    assert list(bundle["datasets"]) == ["flusight", "nhsn", "nssp"]
+    latest = flusight["CA_flu_latest.json"]
+    assert bundle["datasets"]["flusight"]["forecasts"] == latest["forecasts"]
+    assert "location_name" not in bundle["datasets"]["flusight"]["metadata"]
+    assert bundle["datasets"]["nhsn"]["metadata"] == {"dataset": "NHSN", "series_type": "timeseries"}
+    assert bundle["datasets"]["nhsn"]["series"]["dates"] == ["2023-09-01", "2023-10-01"]
+    assert bundle["datasets"]["nhsn"]["series"]["Number of Hospitalized Patients"] == [8, 9]
+    nssp_entry = bundle["datasets"]["nssp"]
+    assert nssp_entry["metadata"] == {"dataset": "NSSP", "series_type": "timeseries"}
+    assert nssp_entry["locations"]["702"]["metadata"] == {"location": "702", "location_name": "Fresno", "population": None}
+    # locations without a series still get a bundle of their forecasts
+    assert set(bundles) == {f"{name[:-len('_flu_latest.json')]}_bundle.json" for name in flusight if name.endswith("_flu_latest.json")}
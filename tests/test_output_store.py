@@ -0,0 +1,41 @@
+import pandas as pd
+
+from output_store import OutputStore
+from processors import FlusightDataProcessor
+from support import load_expected, sanitize
+
+
+def test_output_store_round_trips_hub_and_series_outputs(tmp_path, flusight_inputs):
+    series_outputs = {
+        "CA_nhsn.json": {
+            "metadata": {"location": "06", "abbreviation": "CA", "dataset": "NHSN", "series_type": "timeseries"},
+            "series": {"dates": ["2023-10-07", "2023-10-14"], "Total Influenza Admissions": [40, None]},
+        },
+        "metadata.json": {"dataset": "NHSN", "columns": ["Total Influenza Admissions"]},
+    }
+
+    with OutputStore(tmp_path / "respilens.sqlite") as store:
+        store.write_hub("flu", flusight_inputs.data, flusight_inputs.target_data, flusight_inputs.locations_data, FlusightDataProcessor.config)
+        store.write_series("nhsn", series_outputs)
+
+        outputs = store.build_outputs("flusight")
+        ca_rows = store.query_forecasts("flusight", location="06", reference_date="2023-10-07", target="wk inc flu hosp")
+
+        assert sanitize(outputs["CA_flu.json"]) == sanitize(load_expected("CA_flu.json"))
+        assert sorted(ca_rows["model_id"].unique()) == ["FluSight-ensemble", "UNC_IDD-Influpaint"]
+        assert store.build_outputs("nhsn") == series_outputs
+
+
+def test_output_store_keeps_missing_output_type_ids_null(tmp_path, flusight_inputs):
+    data = flusight_inputs.data
+    median = data[(data["output_type"] == "quantile") & (data["output_type_id"] == 0.5)].assign(output_type="median", output_type_id=None)
+    with OutputStore(tmp_path / "respilens.sqlite") as store:
+        store.write_hub("flu", pd.concat([data, median], ignore_index=True), flusight_inputs.target_data,
+                        flusight_inputs.locations_data, FlusightDataProcessor.config)
+
+        (n_null,) = store.connection.execute("SELECT COUNT(*) FROM forecasts WHERE output_type_id IS NULL").fetchone()
+        rows = store.query_forecasts("flusight", location="06")
+
+    assert n_null == len(median) > 0
+    assert rows.loc[rows["output_type"] == "median", "output_type_id"].isna().all()
+    assert "None" not in set(rows["output_type_id"].astype(str))
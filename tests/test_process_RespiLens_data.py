@@ -0,0 +1,17 @@
+import sys
+
+import pytest
+
+pytest.importorskip("hubdata")
+
+from process_RespiLens_data import main
+
+
+def test_track_memory_needs_a_run_report(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", [
+        "process_RespiLens_data.py", "--output-path", str(tmp_path), "--NHSN", "--track-memory", "rss",
+    ])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 2
+    assert "--track-memory needs --run-report" in capsys.readouterr().err
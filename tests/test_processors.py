@@ -1,57 +1,434 @@
-import json
-import sys
-from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
 
-ROOT = Path(__file__).resolve().parents[1]
-sys.path.append(str(ROOT / "scripts"))
-
-from external_data import load_inputs
+from helper import hubverse_df_preprocessor, output_type_id_values, payload_digest, split_output_type_id
+from hub_dataset_processor import (
+    COMPACT_SCHEMA_VERSION,
+    HubDataProcessorBase,
+    HubDatasetConfig,
+    build_availability_index,
+    build_ground_truth_vintages,
+    compact_projection_payload,
+    compute_ensemble_quantiles,
+    expand_compact_payload,
+    ground_truth_as_of,
+)
 from processors import FlusightDataProcessor
+from support import load_expected, sanitize
 
 
-def _load_expected(filename: str) -> dict:
-    path = Path(__file__).resolve().parent / "samples" / "expected" / filename
-    with path.open() as handle:
-        return json.load(handle)
+def test_flusight_processor_matches_expected(flusight_inputs):
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
 
+    actual = sanitize(processor.output_dict["CA_flu.json"])
+    expected = sanitize(load_expected("CA_flu.json"))
+    assert actual == expected
 
-def _sanitize(payload: dict) -> dict:
-    payload = json.loads(json.dumps(payload))  # deep copy
-    metadata = payload.get("metadata", {})
-    metadata.pop("last_updated", None)
-    return _canonicalize_numbers(payload)
+    actual_meta = sanitize(processor.output_dict["metadata.json"])
+    expected_meta = sanitize(load_expected("metadata.json"))
+    assert actual_meta["models"] == expected_meta["models"]
+    assert actual_meta["locations"] == expected_meta["locations"]
 
 
-def _canonicalize_numbers(obj):
-    if isinstance(obj, dict):
-        return {key: _canonicalize_numbers(value) for key, value in obj.items()}
-    if isinstance(obj, list):
-        return [_canonicalize_numbers(value) for value in obj]
-    if isinstance(obj, float):
-        return int(obj) if obj.is_integer() else round(obj, 10)
-    return obj
+def test_flusight_processor_out_of_core_matches_in_memory(flusight_inputs, flusight_raw):
+    pa = pytest.importorskip("pyarrow")
+    ds = pytest.importorskip("pyarrow.dataset")
 
+    dataset = ds.dataset(pa.Table.from_pandas(flusight_raw, preserve_index=False))
 
-def test_flusight_processor_matches_expected():
-    base = Path(__file__).resolve().parent / "samples" / "flusight"
-    inputs = load_inputs(
-        pathogen="flu",
-        data_path=base / "forecast_data.csv",
-        target_data_path=base / "target_data.csv",
-        locations_data_path=base / "locations.csv",
+    processor = FlusightDataProcessor(
+        data=dataset,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
     )
 
+    assert processor.location_dataframes == {}
+    actual = sanitize(processor.output_dict["CA_flu.json"])
+    expected = sanitize(load_expected("CA_flu.json"))
+    assert actual == expected
+    actual_meta = sanitize(processor.output_dict["metadata.json"])
+    assert actual_meta["models"] == sanitize(load_expected("metadata.json"))["models"]
+
+
+def test_hubverse_df_preprocessor_retains_configured_levels():
+    df = pd.DataFrame({
+        "target": ["wk inc flu hosp"] * 3 + ["peak week inc flu hosp"] * 2 + ["wk inc flu hosp"],
+        "horizon": [0, 0, -1, None, None, 1],
+        "output_type": ["quantile", "quantile", "quantile", "pmf", "pmf", "sample"],
+        "output_type_id": ["0.1", "0.5", "0.1", "2024-12-07", "not-a-date", "1"],
+        "value": [1.0, 2.0, 3.0, 0.4, 0.6, 5.0],
+    })
+
+    processed = hubverse_df_preprocessor(df, quantile_levels=(0.1,))
+
+    assert processed["output_type_id"].tolist() == [0.1, "2024-12-07"]
+    assert processed["horizon"].tolist() == [0, 50]
+
+
+def test_split_output_type_id_round_trips_to_output_format():
+    df = pd.DataFrame({
+        "target": ["wk inc flu hosp", "wk flu hosp rate change", "peak week inc flu hosp", "peak inc flu hosp"],
+        "output_type": ["quantile", "pmf", "pmf", "quantile"],
+        "output_type_id": pd.Series([0.5, "stable", "2024-12-07", 0.975], dtype=object),
+    })
+
+    typed = split_output_type_id(df)
+
+    assert "output_type_id" not in typed.columns
+    assert typed["quantile_level"].dtype == "float64"
+    assert typed["output_type_id_kind"].tolist() == ["quantile", "category", "date", "quantile"]
+    assert output_type_id_values(typed) == [0.5, "stable", "2024-12-07", 0.975]
+
+
+def test_sharded_layout_reassembles_single_file_payload(flusight_inputs):
     processor = FlusightDataProcessor(
-        data=inputs.data,
-        locations_data=inputs.locations_data,
-        target_data=inputs.target_data,
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        output_layout="both",
     )
 
-    actual = _sanitize(processor.output_dict["CA_flu.json"])
-    expected = _sanitize(_load_expected("CA_flu.json"))
-    assert actual == expected
+    index = processor.output_dict["CA_flu/index.json"]
+    assert index["reference_dates"] == ["2023-10-07", "2023-10-14"]
+    assert index["latest_reference_date"] == "2023-10-14"
+    assert index["shards"]["2023-10-14"]["targets"] == ["wk inc flu hosp"]
 
-    actual_meta = _sanitize(processor.output_dict["metadata.json"])
-    expected_meta = _sanitize(_load_expected("metadata.json"))
-    assert actual_meta["models"] == expected_meta["models"]
-    assert actual_meta["locations"] == expected_meta["locations"]
+    forecasts = {}
+    for entry in index["shards"].values():
+        forecasts.update(processor.output_dict[f"CA_flu/{entry['file']}"]["forecasts"])
+    ground_truth = processor.output_dict["CA_flu/" + index["ground_truth_file"]]["ground_truth"]
+    single = processor.output_dict["CA_flu.json"]
+    assert forecasts == single["forecasts"]
+    assert ground_truth == single["ground_truth"]
+
+
+def test_only_locations_rebuilds_their_payloads_and_keeps_dataset_files_whole(flusight_inputs):
+    data = pd.concat([flusight_inputs.data, flusight_inputs.data.assign(location="36")], ignore_index=True)
+    locations = pd.concat([
+        flusight_inputs.locations_data,
+        pd.DataFrame({"location": ["36"], "abbreviation": ["NY"], "location_name": ["New York"], "population": [20201249]}),
+    ], ignore_index=True)
+    target_data = pd.concat([flusight_inputs.target_data, flusight_inputs.target_data.assign(location="36")], ignore_index=True)
+    options = dict(data=data, locations_data=locations, target_data=target_data, output_layout="both", build_ensembles=True)
+    full = FlusightDataProcessor(**options)
+    partial = FlusightDataProcessor(**options, only_locations=["36"], only_reference_dates=["2023-10-14"])
+
+    assert "CA_flu.json" not in partial.output_dict
+    assert sanitize(partial.output_dict["NY_flu.json"]) == sanitize(full.output_dict["NY_flu.json"])
+    assert sorted(name for name in partial.output_dict if name.startswith("NY_flu/")) == [
+        "NY_flu/2023-10-14.json", "NY_flu/ground_truth.json", "NY_flu/index.json",
+    ]
+    for filename in ("metadata.json", "availability.json"):
+        assert sanitize(partial.output_dict[filename]) == sanitize(full.output_dict[filename])
+
+
+def test_ground_truth_vintages_need_target_and_as_of_columns(flusight_inputs):
+    for column in ("target", "as_of"):
+        with pytest.raises(ValueError, match=f"missing columns \\['{column}'\\]"):
+            build_ground_truth_vintages(flusight_inputs.target_data.drop(columns=[column]))
+
+
+def test_latest_payload_holds_newest_reference_date_only(flusight_inputs):
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+
+    latest = processor.output_dict["CA_flu_latest.json"]
+    full = processor.output_dict["CA_flu.json"]
+    assert list(latest["forecasts"]) == ["2023-10-14"]
+    assert latest["forecasts"]["2023-10-14"] == full["forecasts"]["2023-10-14"]
+    assert latest["metadata"] == full["metadata"]
+    assert latest["ground_truth"] == full["ground_truth"]  # fixture truth is inside the window
+
+
+def test_latest_payload_trims_ground_truth_older_than_the_window(flusight_inputs):
+    old_truth = pd.DataFrame({
+        "as_of": ["2023-01-20", "2023-04-28"],
+        "target": ["wk inc flu hosp"] * 2,
+        "target_end_date": ["2023-01-14", "2023-04-22"],
+        "location": ["06"] * 2,
+        "observation": [90.0, 20.0],
+    })
+    target_data = pd.concat([old_truth, flusight_inputs.target_data], ignore_index=True)
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=target_data,
+    )
+
+    full = processor.output_dict["CA_flu.json"]["ground_truth"]
+    latest = processor.output_dict["CA_flu_latest.json"]["ground_truth"]
+    assert full["dates"][0] == "2023-01-14"
+    # The window is 26 weeks before the latest reference date (2023-10-14), i.e. from 2023-04-15
+    start = full["dates"].index("2023-04-22")
+    assert latest["dates"] == full["dates"][start:]
+    assert "2023-01-14" not in latest["dates"]
+    assert {key: values[start:] for key, values in full.items()} == latest
+
+
+def test_build_availability_index_run_length_encodes_reference_dates():
+    df = pd.DataFrame({
+        "target": ["wk inc flu hosp"] * 5,
+        "model_id": ["A", "B", "A", "B", "A"],
+        "location": ["06"] * 5,
+        "reference_date": ["2024-10-05", "2024-10-12", "2024-10-26", "2024-10-26", "2024-10-05"],
+    })
+
+    index = build_availability_index(df)
+
+    assert index["reference_dates"] == ["2024-10-05", "2024-10-12", "2024-10-26"]
+    assert index["availability"]["wk inc flu hosp"]["A"]["06"] == [[0, 1], [2, 1]]
+    assert index["availability"]["wk inc flu hosp"]["B"]["06"] == [[1, 2]]
+
+
+def test_ensembles_average_member_quantiles(flusight_inputs):
+    data = flusight_inputs.data
+    unc = data[data["model_id"] == "UNC_IDD-Influpaint"]
+    data = pd.concat([
+        data,
+        unc.assign(model_id="MOBS-GLEAM_FLUH", value=unc["value"] + 10),
+        unc.assign(model_id="FluSight-baseline", value=unc["value"] * 100),
+    ], ignore_index=True)
+    processor = FlusightDataProcessor(
+        data=data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        build_ensembles=True,
+    )
+
+    payload = processor.output_dict["CA_flu.json"]
+    # FluSight-ensemble (the hub's ensemble) and FluSight-baseline are not members
+    mean = payload["forecasts"]["2023-10-07"]["wk inc flu hosp"]["RespiLens-QuantileMean"]
+    assert mean["predictions"]["0"] == {
+        "date": "2023-10-14",
+        "quantiles": [0.25, 0.5, 0.75],
+        "values": [37.0, 49.0, 65.0],
+    }
+    assert "RespiLens-QuantileMedian" not in payload["forecasts"]["2023-10-07"]["wk flu hosp rate change"]
+    assert "RespiLens-QuantileMean" in processor.output_dict["metadata.json"]["models"]
+    availability = processor.output_dict["availability.json"]
+    reference_dates = availability["reference_dates"]
+    for model in ("RespiLens-QuantileMean", "RespiLens-QuantileMedian"):
+        runs = availability["availability"]["wk inc flu hosp"][model]["06"]
+        assert [reference_dates[start + offset] for start, length in runs for offset in range(length)] == ["2023-10-07", "2023-10-14"]
+    assert "RespiLens-QuantileMean" not in availability["availability"]["wk flu hosp rate change"]
+
+
+def test_ensemble_quantiles_keep_configured_levels_and_stay_monotone():
+    rows = [("A", level, value) for level, value in ((0.25, 10.0), (0.3, 11.0), (0.5, 20.0), (0.75, 30.0))]
+    rows += [("B", 0.5, 60.0), ("A-ensemble", 0.75, 1000.0)]
+    df = pd.DataFrame({
+        "location": "06",
+        "reference_date": "2023-10-07",
+        "target": "wk inc flu hosp",
+        "horizon": 0,
+        "output_type": "quantile",
+        "model_id": [model for model, _, _ in rows],
+        "output_type_id": [str(level) for _, level, _ in rows],
+        "value": [value for _, _, value in rows],
+        "target_end_date": "2023-10-14",
+    })
+
+    ensemble = compute_ensemble_quantiles(df, exclude_models=["A-ensemble"], quantile_levels=(0.25, 0.5, 0.75))
+
+    assert ensemble["quantile_level"].tolist() == [0.25, 0.5, 0.75]
+    assert "n_models" not in ensemble.columns
+    # Unsorted, the 0.5 mean (40) would exceed the 0.75 mean (30, from A alone)
+    assert ensemble["mean"].tolist() == [10.0, 30.0, 40.0]
+    assert ensemble["median"].tolist() == [10.0, 30.0, 40.0]
+
+
+def test_compact_payload_round_trips_to_default_schema(flusight_inputs):
+
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        payload_format="compact",
+    )
+
+    compact = processor.output_dict["CA_flu.json"]
+    assert compact["schema_version"] == COMPACT_SCHEMA_VERSION
+    assert compact["tables"]["quantiles"] == [0.25, 0.5, 0.75]
+    block = compact["forecasts"]["2023-10-07"]["wk inc flu hosp"]["FluSight-ensemble"]
+    assert block == {
+        "type": "quantile",
+        "horizons": [0],
+        "dates": [compact["tables"]["dates"].index("2023-10-14")],
+        "quantiles": [0, 1, 2],
+        "values": [[35, 42, 55]],
+    }
+    assert sanitize(expand_compact_payload(compact)) == sanitize(load_expected("CA_flu.json"))
+
+
+def test_compact_payload_rounds_to_significant_digits():
+    payload = {"ground_truth": {"dates": ["2023-10-07", "2023-10-14"], "wk inc flu hosp": [1234.5678, None]}}
+
+    compact = compact_projection_payload(payload, significant_digits=3)
+
+    assert compact["ground_truth"]["wk inc flu hosp"] == [1230, None]
+
+
+def test_peak_targets_are_declared_on_the_dataset_config(flusight_inputs):
+    config = HubDatasetConfig(
+        file_suffix="rsv",
+        dataset_label="rsv forecasts",
+        peak_targets=(("peak inc rsv hosp", "quantile"), ("peak week inc rsv hosp", "pmf")),
+    )
+    raw = pd.DataFrame({
+        "location": ["06"] * 7,
+        "reference_date": ["2023-10-07"] * 7,
+        "target": ["wk inc rsv hosp"] + ["peak week inc rsv hosp"] * 2 + ["peak inc rsv hosp"] * 3 + ["peak week inc rsv hosp"],
+        "model_id": ["A"] * 6 + ["B"],
+        "horizon": [0] + [None] * 6,
+        "target_end_date": ["2023-10-14"] + [None] * 6,
+        "output_type": ["quantile", "pmf", "pmf", "quantile", "quantile", "quantile", "pmf"],
+        "output_type_id": [0.5, "2023-12-16", "2023-12-23", 0.25, 0.5, 0.75, "2023-12-16"],
+        "value": [10.0, 0.4, 0.6, 90.0, 120.0, 150.0, 1.0],
+    })
+
+    processor = HubDataProcessorBase(
+        data=config.preprocess(raw),
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        config=config,
+    )
+
+    payload = processor.output_dict["CA_rsv.json"]
+    assert list(payload["forecasts"]["2023-10-07"]) == ["wk inc rsv hosp"]
+    assert payload["peaks"]["2023-10-07"]["peak inc rsv hosp"]["A"] == {
+        "type": "quantile",
+        "predictions": {"quantiles": [0.25, 0.5, 0.75], "values": [90.0, 120.0, 150.0]},
+    }
+    assert payload["peaks"]["2023-10-07"]["peak week inc rsv hosp"]["A"]["predictions"] == {
+        "peak week": ["2023-12-16", "2023-12-23"],
+        "probabilities": [0.4, 0.6],
+    }
+    assert list(payload["peaks"]["2023-10-07"]["peak week inc rsv hosp"]) == ["A", "B"]
+
+
+def test_ground_truth_vintages_reconstruct_each_as_of(flusight_inputs):
+    processor = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+
+    vintages = processor.output_dict["ground_truth_vintages.json"]
+    assert vintages["as_of"] == ["2023-10-05", "2023-10-12", "2023-10-19"]
+    series = vintages["series"]["wk inc flu hosp"]["06"]
+    assert series["base"] == [38, 45, 49]
+    assert series["revisions"] == {"as_of": [1, 1], "dates": [0, 1], "deltas": [2, 2]}
+
+    first = ground_truth_as_of(vintages, "2023-10-05")
+    assert first["target_end_date"].tolist() == ["2023-10-07", "2023-10-14"]
+    assert first["observation"].tolist() == [38.0, 45.0]
+    latest = ground_truth_as_of(vintages, "2023-10-19")
+    assert latest["observation"].tolist() == [40.0, 47.0, 49.0]
+
+
+def test_lean_processor_skips_retention_and_rebuilds_intermediates_lazily(flusight_inputs):
+    eager = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+    lean = FlusightDataProcessor(
+        data=flusight_inputs.data,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+        lean=True,
+    )
+
+    assert sanitize(lean.output_dict["CA_flu.json"]) == sanitize(eager.output_dict["CA_flu.json"])
+    assert lean.location_dataframes == {} and lean.ground_truth_dataframes == {}
+
+    rebuilt = lean.intermediate_dataframes
+    assert list(rebuilt["locations"]) == list(eager.intermediate_dataframes["locations"])
+    assert rebuilt["locations"]["06"].reset_index(drop=True).equals(
+        eager.intermediate_dataframes["locations"]["06"].reset_index(drop=True)
+    )
+    assert rebuilt["ground_truth"]["06"].equals(eager.intermediate_dataframes["ground_truth"]["06"])
+    assert lean.intermediate_dataframes is rebuilt
+
+
+def test_sample_only_models_are_reduced_to_quantiles(tmp_path, flusight_inputs, flusight_raw):
+    pa = pytest.importorskip("pyarrow")
+    ds = pytest.importorskip("pyarrow.dataset")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    # a model that only submits 200 samples per horizon, plus a sampled task in a file that also has its quantiles
+    samples = pd.DataFrame([
+        {"location": "06", "reference_date": "2023-10-07", "target": "wk inc flu hosp", "model_id": model_id,
+         "horizon": horizon, "output_type": "sample", "output_type_id": str(sample),
+         "value": float(sample * (horizon + 1)), "target_end_date": str(pd.Timestamp("2023-10-07") + pd.Timedelta(weeks=horizon + 1))[:10]}
+        for model_id, horizons in (("Sample-Model", (0, 1)), ("FluSight-ensemble", (0,)))
+        for horizon in horizons
+        for sample in range(200)
+    ])
+    is_sample_model = samples["model_id"] == "Sample-Model"
+    mixed = pd.concat([flusight_raw, samples.loc[~is_sample_model, flusight_raw.columns]], ignore_index=True)
+    pq.write_table(pa.Table.from_pandas(mixed, preserve_index=False), tmp_path / "mixed.parquet")
+    pq.write_table(pa.Table.from_pandas(samples.loc[is_sample_model, flusight_raw.columns], preserve_index=False), tmp_path / "samples.parquet")
+    dataset = ds.dataset(tmp_path, format="parquet")
+    config = FlusightDataProcessor.config
+
+    hubverse_df = config.read_dataset(dataset)
+    assert "sample" not in set(hubverse_df["output_type"])
+    assert len(hubverse_df) == len(flusight_raw) + 2 * len(config.quantile_levels)
+
+    in_memory = FlusightDataProcessor(
+        data=config.preprocess(hubverse_df),
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+    out_of_core = FlusightDataProcessor(
+        data=dataset,
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+
+    forecasts = in_memory.output_dict["CA_flu.json"]["forecasts"]["2023-10-07"]["wk inc flu hosp"]
+    sample_model = forecasts["Sample-Model"]["predictions"]
+    assert sample_model["1"]["quantiles"] == list(config.quantile_levels)
+    assert sample_model["1"]["values"] == pytest.approx(np.quantile(np.arange(200) * 2.0, config.quantile_levels))
+    assert forecasts["FluSight-ensemble"] == sanitize(
+        FlusightDataProcessor(data=flusight_inputs.data, locations_data=flusight_inputs.locations_data, target_data=flusight_inputs.target_data)
+        .output_dict["CA_flu.json"]
+    )["forecasts"]["2023-10-07"]["wk inc flu hosp"]["FluSight-ensemble"]
+    assert sanitize(out_of_core.output_dict["CA_flu.json"]) == sanitize(in_memory.output_dict["CA_flu.json"])
+
+
+def test_sample_only_models_appear_in_every_output(flusight_inputs, flusight_raw):
+    reference = flusight_raw[(flusight_raw["model_id"] == "UNC_IDD-Influpaint") & (flusight_raw["output_type"] == "quantile")]
+    samples = pd.concat([
+        reference.head(1).assign(model_id="Sample-Model", output_type="sample", output_type_id=str(sample), value=float(sample))
+        for sample in range(100)
+    ], ignore_index=True)
+    config = FlusightDataProcessor.config
+    assert config.sample_quantiles
+
+    processor = FlusightDataProcessor(
+        data=config.preprocess(pd.concat([flusight_raw, samples], ignore_index=True)),
+        locations_data=flusight_inputs.locations_data,
+        target_data=flusight_inputs.target_data,
+    )
+
+    assert "Sample-Model" in processor.output_dict["metadata.json"]["models"]
+    assert "Sample-Model" in processor.output_dict["CA_flu.json"]["metadata"]["hubverse_keys"]["models"]
+    target = samples["target"].iloc[0]
+    assert "Sample-Model" in processor.output_dict["availability.json"]["availability"][target]
+
+
+def test_payload_digest_ignores_build_timestamps():
+    payload = {"last_updated": "2024-01-01T00:00:00Z", "series": [1, 2]}
+
+    assert payload_digest(payload) == payload_digest({**payload, "last_updated": "2024-01-02T00:00:00Z"})
+    assert payload_digest(payload) != payload_digest({**payload, "series": [1, 3]})
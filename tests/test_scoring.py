@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from scoring import build_leaderboard, score_quantile_forecasts
+
+
+def test_score_quantile_forecasts_and_leaderboard():
+    forecasts = pd.DataFrame({
+        "location": ["06"] * 6,
+        "reference_date": ["2023-10-07"] * 6,
+        "target": ["wk inc flu hosp"] * 6,
+        "model_id": ["A"] * 3 + ["B"] * 3,
+        "horizon": [0] * 6,
+        "target_end_date": ["2023-10-14"] * 6,
+        "output_type": ["quantile"] * 6,
+        "quantile_level": [0.25, 0.5, 0.75] * 2,
+        "value": [40.0, 45.0, 50.0, 50.0, 60.0, 70.0],
+    })
+    ground_truth = pd.DataFrame({
+        "location": ["06"],
+        "target": ["wk inc flu hosp"],
+        "target_end_date": ["2023-10-14"],
+        "observation": [47.0],
+    })
+
+    scores = score_quantile_forecasts(forecasts, ground_truth).set_index("model_id")
+
+    assert scores.loc["A", "wis"] == pytest.approx(7 / 3)
+    assert scores.loc["B", "wis"] == pytest.approx(29 / 3)
+    assert scores.loc["A", "ae_median"] == 2.0
+    assert scores.loc["A", "coverage_50"] == 1.0
+    assert scores.loc["B", "coverage_50"] == 0.0
+
+    # revised observations are re-scored, unchanged ones are reused
+    revised = score_quantile_forecasts(
+        forecasts, ground_truth.assign(observation=60.0), previous_scores=scores.reset_index()
+    ).set_index("model_id")
+    assert revised.loc["B", "ae_median"] == 0.0
+
+    # resubmitted forecasts are re-scored even though their observation is unchanged
+    resubmitted = score_quantile_forecasts(
+        forecasts.assign(value=forecasts["value"].where(forecasts["model_id"] == "A", forecasts["value"] - 13)),
+        ground_truth,
+        previous_scores=scores.reset_index(),
+    ).set_index("model_id")
+    assert resubmitted.loc["A", "forecast_digest"] == scores.loc["A", "forecast_digest"]
+    assert resubmitted.loc["B", "forecast_digest"] != scores.loc["B", "forecast_digest"]
+    assert resubmitted.loc["B", "ae_median"] == 0.0
+    assert resubmitted.loc["B", "wis"] < scores.loc["B", "wis"]
+
+    leaderboard = build_leaderboard(scores.reset_index(), baseline_model="B")
+    rows = leaderboard["targets"]["wk inc flu hosp"]["overall"]
+    assert [row[0] for row in rows] == ["A", "B"]
+    assert rows[0][3] == round(7 / 29, 4)
+    assert rows[1][3] == 1.0
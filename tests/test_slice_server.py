@@ -0,0 +1,67 @@
+import gzip
+import http.client
+import json
+import threading
+
+from output_store import OutputStore
+from processors import FlusightDataProcessor
+from slice_server import SliceService, build_columnar_cache, make_server
+
+
+def test_slice_server_serves_cached_slices_with_etags(tmp_path, flusight_inputs):
+    with OutputStore(tmp_path / "respilens.sqlite") as store:
+        store.write_hub("flu", flusight_inputs.data, flusight_inputs.target_data, flusight_inputs.locations_data, FlusightDataProcessor.config)
+    datasets = build_columnar_cache(tmp_path / "respilens.sqlite", tmp_path / "columns")
+
+    server = make_server(SliceService(tmp_path / "columns", datasets), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        path = "/flusight/forecasts?location=06&target=wk+inc+flu+hosp&end=2023-10-07&models=FluSight-ensemble"
+        connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+        response = connection.getresponse()
+        body = json.loads(gzip.decompress(response.read()))
+        etag = response.getheader("ETag")
+
+        assert response.status == 200
+        assert body["forecasts"] == {
+            "2023-10-07": {
+                "FluSight-ensemble": {
+                    "type": "quantile",
+                    "predictions": {"0": {"date": "2023-10-14", "quantiles": [0.25, 0.5, 0.75], "values": [35.0, 42.0, 55.0]}},
+                },
+            },
+        }
+
+        connection.request("GET", path, headers={"If-None-Match": etag})
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 304
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_slice_server_answers_unexpected_errors_with_json_500(tmp_path, flusight_inputs, monkeypatch):
+    with OutputStore(tmp_path / "respilens.sqlite") as store:
+        store.write_hub("flu", flusight_inputs.data, flusight_inputs.target_data, flusight_inputs.locations_data, FlusightDataProcessor.config)
+    datasets = build_columnar_cache(tmp_path / "respilens.sqlite", tmp_path / "columns")
+    service = SliceService(tmp_path / "columns", datasets)
+
+    def broken(*args, **kwargs):
+        raise OSError("columns file is truncated")
+
+    monkeypatch.setattr(service, "respond", broken)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        connection.request("GET", "/flusight/meta")
+        response = connection.getresponse()
+
+        assert response.status == 500
+        assert response.getheader("Content-Type") == "application/json"
+        assert json.loads(response.read()) == {"error": "Internal server error."}
+    finally:
+        server.shutdown()
+        server.server_close()
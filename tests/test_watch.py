@@ -0,0 +1,93 @@
+import json
+import subprocess
+import urllib.error
+import urllib.request
+
+import pytest
+
+from instrumentation import MemoryBudgetExceeded
+from watch import WatchedSource, Watcher, affected_parts, changed_paths, hub_fingerprint
+
+
+def test_watcher_rebuilds_changed_sources_and_reports_status(tmp_path):
+    hub = tmp_path / "hub"
+    (hub / "target-data").mkdir(parents=True)
+    (hub / "target-data" / "time-series.csv").write_text("observation\n1\n")
+
+    def git(*args):
+        subprocess.run(["git", "-C", str(hub), "-c", "user.name=t", "-c", "user.email=t@t", *args], check=True, capture_output=True)
+
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-qm", "first")
+    first = hub_fingerprint(hub)
+    (hub / "README.md").write_text("docs")
+    (hub / "target-data" / "time-series.csv").write_text("observation\n2\n")
+    git("add", "-A")
+    git("commit", "-qm", "second")
+    second = hub_fingerprint(hub)
+    assert changed_paths(hub, first, second) == ["README.md", "target-data/time-series.csv"]
+    assert affected_parts(changed_paths(hub, first, second)) == {"target-data"}
+    assert changed_paths(hub, None, second) is None
+
+    now = [1000.0]
+    fingerprints = {"hub": first, "cdc": "v1"}
+    builds = []
+
+    def rebuild(name):
+        def run(previous, current):
+            if current == "broken":
+                raise RuntimeError("endpoint down")
+            builds.append((name, previous, current))
+            return {"written": 1, "unchanged": 0}
+        return run
+
+    watcher = Watcher(
+        [
+            WatchedSource("hub", lambda: fingerprints["hub"], rebuild("hub"), interval=60),
+            WatchedSource("cdc", lambda: fingerprints["cdc"], rebuild("cdc"), interval=600),
+        ],
+        status_path=tmp_path / "status.json",
+        initial={"hub": first},
+        clock=lambda: now[0],
+    )
+
+    assert watcher.poll() == ["cdc"] # the hub was built before watching
+    fingerprints.update(hub=second, cdc="v2")
+    now[0] += 60
+    assert watcher.poll() == ["hub"] # the CDC source is not due yet
+    assert builds == [("cdc", None, "v1"), ("hub", first, second)]
+
+    fingerprints["cdc"] = "broken"
+    now[0] += 600
+    assert watcher.poll() == []
+    status = json.loads((tmp_path / "status.json").read_text())
+    assert status["healthy"] is False
+    assert status["sources"]["cdc"]["last_error"] == "RuntimeError: endpoint down"
+    assert status["sources"]["cdc"]["fingerprint"] == "v1" # retried on the next poll
+    assert status["sources"]["hub"]["builds"] == 1
+    assert status["sources"]["hub"]["counts"] == {"written": 1, "unchanged": 0}
+
+    server = watcher.serve_status(port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with pytest.raises(urllib.error.HTTPError) as unhealthy:
+            urllib.request.urlopen(f"{url}/health")
+        assert unhealthy.value.code == 503
+        with urllib.request.urlopen(f"{url}/status") as response:
+            assert json.load(response)["sources"]["hub"]["fingerprint"] == second
+    finally:
+        server.shutdown()
+
+
+def test_watcher_stops_on_memory_budget_errors(tmp_path):
+    def over_budget(previous, current):
+        raise MemoryBudgetExceeded("RSS 900 MB exceeded the 800 MB memory budget at stage 'flusight.process'", {})
+
+    watcher = Watcher([WatchedSource("hub", lambda: "v1", over_budget)], status_path=tmp_path / "status.json")
+
+    with pytest.raises(MemoryBudgetExceeded):
+        watcher.poll()
+    status = json.loads((tmp_path / "status.json").read_text())
+    assert status["healthy"] is False
+    assert status["sources"]["hub"]["last_error"].startswith("MemoryBudgetExceeded: RSS 900 MB")